@@ -0,0 +1,5 @@
+@rem %USERPROFILE% = C:\Users\%USERNAME%
+call %USERPROFILE%\Anaconda3\Scripts\activate.bat
+call activate ephys-noise-analysis-env
+call python src\ephys_noise.py %*
+call conda deactivate
\ No newline at end of file
@@ -0,0 +1,173 @@
+"""
+-----------------------------------------------------------------------
+File name: backfill_rig_noise.py
+Maintainer: Ramkumar Rajanbabu
+-----------------------------------------------------------------------
+Developer: Ramkumar Rajanbabu
+Date/time created: 10/17/2026
+Description: Memory-bounded, resumable backfill of the noise metrics
+over a date range (ex. python src/backfill_rig_noise.py --from 2022-01-01 --to 2026-12-31)
+-----------------------------------------------------------------------
+"""
+
+
+#-----Imports-----#
+# General imports
+import argparse
+import functools
+import gc
+import os
+from datetime import date, timedelta
+# File imports
+from functions.backfill_functions import current_rss_mb, date_chunks, finished_chunks, mark_chunk_finished, open_checkpoints, with_rss
+from functions.collector_functions import MetricsCollector
+from functions.general_functions import extract_cell_noise, require_ipfx
+from functions.jem_functions import load_jem_metadata
+from functions.ledger_functions import due_cells, open_failure_ledger, pending_cells, record_run_failures
+from functions.lims_functions import generate_cell_paths
+from functions.parallel_functions import run_cells
+from functions.rms_functions import extract_cell_noise_h5
+from functions.runlog_functions import print_run_summary, start_run_log
+from functions.store_functions import export_metrics_csv, open_metrics_store, stored_cell_names
+# Test imports
+import time # To measure program execution time
+
+
+# Directories
+json_data_dir  = "//allen/programs/celltypes/workgroups/279/Patch-Seq/ivscc-data-warehouse/data-sources/jem_lims_metadata.csv"
+noise_data_dir = "//allen/programs/celltypes/workgroups/279/Patch-Seq/ivscc-data-warehouse/data-sources/noise_metrics_backfill.csv"
+nwb_index_dir = os.path.join(os.path.expanduser("~"), ".ephys-noise-analysis", "nwb_index.sqlite") # Local, so it is fast to check
+noise_store_dir = os.path.join(os.path.expanduser("~"), ".ephys-noise-analysis", "metrics_store.sqlite") # Keyed on cell_name, exported to noise_data_dir
+run_log_dir = os.path.join(os.path.expanduser("~"), ".ephys-noise-analysis", "run_logs") # One JSON-lines file of stage timings per run
+failure_ledger_dir = os.path.join(os.path.expanduser("~"), ".ephys-noise-analysis", "failure_ledger.sqlite") # Failed cells and when to retry them
+
+# Settings
+workers = 2 # Number of worker processes
+cell_timeout = 600 # Seconds a cell may take before it is skipped
+chunk_days = 30 # Days of experiments per chunk (each chunk is checkpointed when it finishes)
+cells_per_pool = 200 # Cells per worker pool; the pool is replaced after that, which frees whatever ipfx left behind
+max_rss_mb = 2048 # Halve cells_per_pool whenever this process or a worker grows past this many MB (the run stays near (workers + 1) x this)
+rms_kernel = "ipfx" # "ipfx" (dataset.sweep) or "h5py" (reads only the baseline windows)
+job = "rig_noise_backfill"
+
+# Lists
+jem_fields = ["jem-date_patch", "jem-date_patch_y", "jem-date_patch_m", "jem-date_patch_d", "jem-id_cell_specimen", "jem-id_patched_cell_container", "jem-status_success_failure", "jem-id_rig_number"]
+sweep_cols= ["cell_name", "inbath_long_rms", "inbath_short_rms", "cellatt_long_rms", "cellatt_short_rms", "breakin_long_rms", "breakin_short_rms"]
+noise_cols= ["jem-date_patch", "cell_name", "inbath_long_rms", "inbath_short_rms", "cellatt_long_rms", "cellatt_short_rms", "breakin_long_rms", "breakin_short_rms"]
+noise_table = "noise_metrics_backfill"
+batch_size = 50 # Rows written to the store per transaction (at most this many are lost on a crash)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Backfill the noise metrics of a date range in memory-bounded, resumable chunks.")
+    parser.add_argument("--from", dest="start_date", type=date.fromisoformat, required=True, help="first patch date (YYYY-MM-DD)")
+    parser.add_argument("--to", dest="end_date", type=date.fromisoformat, default=date.today() - timedelta(days=1), help="last patch date (YYYY-MM-DD, default: yesterday)")
+    parser.add_argument("--rig", dest="rigs", nargs="+", metavar="RIG", help="rigs to process (jem-id_rig_number)")
+    parser.add_argument("--chunk-days", type=int, default=chunk_days, help="days of experiments per chunk")
+    parser.add_argument("--workers", type=int, default=workers, help="number of worker processes")
+    parser.add_argument("--max-rss-mb", type=float, default=max_rss_mb,
+                        help="memory cap of this process and of each worker (MB); the run stays near (workers + 1) x this")
+    parser.add_argument("--kernel", choices=["ipfx", "h5py"], default=rms_kernel, help="rms calculation")
+    parser.add_argument("--csv", default=noise_data_dir, help="csv written from the store at the end")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoints of earlier runs")
+    return parser.parse_args(argv)
+
+
+def run_chunk(store_conn, ledger_conn, chunk, worker, args, pool_size):
+    """
+    Processes the cells patched in one date chunk that aren't in the store yet.
+    Only this chunk's metadata is loaded, and the worker pool is replaced every
+    pool_size cells. Failed cells are recorded in the failure ledger.
+
+    The memory cap applies to this process and to each worker: every worker reports
+    its resident memory after each cell, and pool_size is halved when this process or
+    any worker was over the cap, so a worker holds fewer cells' leftovers before its
+    pool is replaced. The whole run is bounded by about (workers + 1) x max_rss_mb.
+
+    Returns:
+        num_cells (int), num_written (int), num_pending (int), pool_size (int): the cells in
+            the chunk, the rows written, the cells waiting for a retry in the failure ledger,
+            and the pool size to use next (halved if over the memory cap).
+    """
+
+    jem_df = load_jem_metadata(json_data_dir, start_date=chunk[0], end_date=chunk[1], fields=jem_fields, rigs=args.rigs)
+    cell_list = jem_df["jem-id_cell_specimen"].tolist()
+    noise_cell_names = stored_cell_names(store_conn, noise_table)
+    new_cells = due_cells(ledger_conn, noise_table, [cell_name for cell_name in cell_list if cell_name not in noise_cell_names])
+    del noise_cell_names
+    cell_paths = generate_cell_paths(new_cells)
+    tasks = [(cell_name, cell_paths.get(cell_name), nwb_index_dir) for cell_name in new_cells]
+    print(f"{chunk[0]} to {chunk[1]}: {len(cell_list)} cells, {len(tasks)} to process.")
+
+    written = set()
+    with MetricsCollector(store_conn, noise_table, sweep_cols, noise_cols, jem_df, batch_size=batch_size, aggregate_cols=sweep_cols[1:]) as collector:
+        i = 0
+        while i < len(tasks):
+            worker_rss_mb = None
+            for (cell_name, path, index_path), result in run_cells(functools.partial(with_rss, worker), tasks[i:i + pool_size],
+                                                                   workers=args.workers, timeout=cell_timeout, isolate=True):
+                # None if the cell raised or timed out
+                row_list, rss_mb = result if result else (None, None)
+                if rss_mb is not None:
+                    worker_rss_mb = max(worker_rss_mb or 0.0, rss_mb)
+                if row_list:
+                    collector.add(row_list)
+                    written.add(cell_name)
+                else:
+                    print(f"{cell_name}: Missing Voltage Sweep")
+            i += pool_size
+            collector.flush()
+            gc.collect()
+            for process, rss_mb in (("This process", current_rss_mb()), ("A worker", worker_rss_mb)):
+                if rss_mb is not None and rss_mb > args.max_rss_mb and pool_size > 1:
+                    pool_size = max(pool_size // 2, 1)
+                    print(f"{process} is at {rss_mb:.0f} MB, over the {args.max_rss_mb:.0f} MB cap, {pool_size} cells per pool from now on.")
+                    break
+    record_run_failures(ledger_conn, noise_table, new_cells, written)
+    return len(cell_list), collector.num_written, len(pending_cells(ledger_conn, noise_table, cell_list)), pool_size
+
+
+def main(argv=None):
+    """
+    Backfills the noise metrics chunk by chunk, oldest first. A finished chunk is
+    checkpointed in the store, so a killed run picks up at the first unfinished
+    chunk (and skips the cells of that chunk already in the store). A chunk with
+    cells waiting for a retry in the failure ledger isn't finished: later runs go
+    through it again and retry the cells that are due.
+    """
+
+    args = parse_args(argv)
+    start_run_log(run_log_dir, job)
+
+    store_conn = open_metrics_store(noise_store_dir, noise_table, noise_cols)
+    open_checkpoints(store_conn)
+    ledger_conn = open_failure_ledger(failure_ledger_dir)
+    done = set() if args.restart else finished_chunks(store_conn, job)
+    worker = extract_cell_noise_h5 if args.kernel == "h5py" else extract_cell_noise
+    if worker is extract_cell_noise:
+        require_ipfx()
+
+    start = time.time()
+    pool_size = cells_per_pool
+    for chunk in date_chunks(args.start_date, args.end_date, args.chunk_days):
+        if (chunk[0].isoformat(), chunk[1].isoformat()) in done:
+            print(f"{chunk[0]} to {chunk[1]}: already done.")
+            continue
+        num_cells, num_written, num_pending, pool_size = run_chunk(store_conn, ledger_conn, chunk, worker, args, pool_size)
+        if not num_pending:
+            mark_chunk_finished(store_conn, job, chunk, num_cells, num_written)
+        gc.collect()
+        rss_mb = current_rss_mb()
+        print(f"{chunk[0]} to {chunk[1]}: {num_written} rows written" + (f", {rss_mb:.0f} MB in use." if rss_mb is not None else "."))
+        if num_pending:
+            print(f"{num_pending} cells wait for a retry, so the chunk isn't checkpointed.")
+
+    # Write the csv from the store for downstream consumers
+    export_metrics_csv(store_conn, noise_table, noise_cols, args.csv)
+
+    print("\nThe backfill was executed in", round(((time.time()-start)/60), 2), "minutes.")
+    print_run_summary()
+
+
+if __name__ == "__main__":
+    main()
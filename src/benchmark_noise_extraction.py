@@ -0,0 +1,261 @@
+"""
+-----------------------------------------------------------------------
+File name: benchmark_noise_extraction.py
+Maintainer: Ramkumar Rajanbabu
+-----------------------------------------------------------------------
+Developer: Ramkumar Rajanbabu
+Date/time created: 10/17/2026
+Description: Benchmark of the noise extraction hot path on synthetic
+NWB v2 files and a local LIMS stand-in
+-----------------------------------------------------------------------
+"""
+
+
+#-----Imports-----#
+# General imports
+import json
+import numpy as np
+import os
+import pandas as pd
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+# File imports
+from functions.fixture_functions import build_fixture_tree, make_lims_stand_in, reference_noise_row
+from functions.general_functions import find_nwb_v2, noise_from_nwb
+from functions.index_functions import find_nwb_v2_indexed
+from functions.lims_functions import generate_cell_paths
+from functions.power_functions import read_power_60hz_file
+from functions.rms_functions import noise_from_nwb_h5
+
+
+# Directories
+fixture_dir = os.path.join(tempfile.gettempdir(), "ephys-noise-benchmark") # Synthetic cells, LIMS stand-in and NWB index
+
+# Settings
+cell_counts = [10, 1000, 10000]
+unique_files = 10 # Distinct NWB files written (the other cells are hard links to them)
+time_budget = 60 # Seconds per benchmark and cell count (throughput is measured on the cells done by then)
+memory_cells = 50 # Cells run again under tracemalloc for the peak memory of each benchmark
+rms_tolerance = 0.0011 # Largest difference from the reference noise row (one step of the 3 decimal rounding, pA)
+nwb_settings = {"sweep_count": 10, "rate": 50000.0, "sweep_duration": 1.0, "power_60hz_rows": 4}
+
+# Lists
+startup_modules = ["generate_rig_noise", "generate_rig_noise_2023", "generate_power_60hz_metrics", "generate_cell_metrics",
+                   "generate_experiment_details", "generate_baseline_archive", "poll_rig_noise"] # Runners whose cold start is measured
+
+
+# Functions
+def _run_cells(fn, cells, budget):
+    """
+    Runs fn(cell) over cells until they are done or the time budget is spent. An
+    error counts as a cell without a result (ex. ipfx can't open a synthetic file).
+
+    Returns:
+        done (int), ok (int), seconds (float): the cells run, those with a result, and the time taken.
+    """
+
+    done = ok = 0
+    start = time.perf_counter()
+    for cell in cells:
+        try:
+            ok += fn(cell) is not None
+        except Exception:
+            pass
+        done += 1
+        if time.perf_counter() - start > budget:
+            break
+    return done, ok, time.perf_counter() - start
+
+
+def _peak_memory(fn, cells):
+    """
+    Returns the peak traced memory (MB) of running fn over cells.
+    """
+
+    tracemalloc.start()
+    try:
+        for cell in cells:
+            try:
+                fn(cell)
+            except Exception:
+                pass
+        return tracemalloc.get_traced_memory()[1] / 1024**2
+    finally:
+        tracemalloc.stop()
+
+
+def _max_rss():
+    """
+    Returns the process's peak resident memory (MB), where the platform reports it.
+    """
+
+    try:
+        import resource
+    except ImportError:
+        return None
+    # KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def benchmark_startup():
+    """
+    Imports each runner in a fresh interpreter (with -X importtime), which is what a
+    scheduled run with no new cells mostly pays for.
+
+    Returns:
+        rows (list): one dict per runner: the import time, the resident memory after it,
+            the heavy packages loaded (see heavy_modules) and the slowest top-level imports.
+    """
+
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    code = ("import json, time; start = time.perf_counter(); import {module}; seconds = time.perf_counter() - start; "
+            "from functions.runlog_functions import process_stats; print(json.dumps(dict(process_stats(), import_s=seconds)))")
+    rows = []
+    for module in startup_modules:
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", code.format(module=module)],
+                                cwd=src_dir, capture_output=True, text=True)
+        if result.returncode:
+            rows.append({"runner": module, "error": (result.stderr.strip().splitlines() or ["?"])[-1]})
+            continue
+        stats = json.loads(result.stdout.strip().splitlines()[-1])
+        # "import time: self [us] | cumulative [us] | module"; a package's outermost import has its largest cumulative time
+        packages = {}
+        for line in result.stderr.splitlines():
+            fields = line.split("|")
+            if line.startswith("import time:") and len(fields) == 3 and fields[1].strip().isdigit():
+                package = fields[2].strip().split(".")[0]
+                packages[package] = max(packages.get(package, 0.0), int(fields[1]) / 1e6)
+        for package in (module, "functions"):
+            packages.pop(package, None)
+        slowest = sorted(((seconds, package) for package, seconds in packages.items()), reverse=True)[:3]
+        rows.append({"runner": module, "import_s": stats["import_s"], "rss_MB": stats["rss_mb"],
+                     "heavy": ", ".join(stats["heavy_modules"]) or "none",
+                     "slowest": ", ".join(f"{name} {seconds:.2f}s" for seconds, name in slowest)})
+    return rows
+
+
+def check_noise_rows(cell_dirs):
+    """
+    Compares each kernel's noise row with reference_noise_row on every distinct fixture
+    file, so a faster kernel can't silently change the numbers. The ipfx kernel is
+    compared wherever it can open the file.
+
+    Returns:
+        mismatches (list): (kernel, cell_name, row, reference row) for every row off by more than rms_tolerance.
+    """
+
+    kernels = [("calculate_std_vs (ipfx)", noise_from_nwb), ("calculate_std_vs_h5", noise_from_nwb_h5)]
+    mismatches = []
+    for cell_name in list(cell_dirs)[:unique_files]:
+        nwb_path = find_nwb_v2(cell_dirs[cell_name])
+        expected = reference_noise_row(cell_name, nwb_path)
+        for kernel, fn in kernels:
+            try:
+                row = fn(cell_name, nwb_path)
+            except Exception:
+                row = None
+            if row is None and kernel.endswith("(ipfx)"):
+                continue
+            if row is None or row[0] != cell_name or not np.allclose(np.array(row[1:], dtype=float), np.array(expected[1:], dtype=float),
+                                                                      rtol=0, atol=rms_tolerance, equal_nan=True):
+                mismatches.append((kernel, cell_name, row, expected))
+    return mismatches
+
+
+def benchmark_cells(num_cells, cell_dirs, lims_db_path):
+    """
+    Times each stage of the hot path over the first num_cells cells.
+
+    Returns:
+        rows (list): one dict per benchmark.
+    """
+
+    cell_names = list(cell_dirs)[:num_cells]
+    nwb_paths = {}
+    index_path = os.path.join(fixture_dir, f"nwb_index_{num_cells}.sqlite")
+    if os.path.exists(index_path):
+        os.remove(index_path)
+
+    def nwb_path(cell_name):
+        if cell_name not in nwb_paths:
+            nwb_paths[cell_name] = find_nwb_v2(cell_dirs[cell_name])
+        return nwb_paths[cell_name]
+
+    benchmarks = [
+        ("find_nwb_v2", lambda cell_name: find_nwb_v2(cell_dirs[cell_name])),
+        ("find_nwb_v2_indexed (cold)", lambda cell_name: find_nwb_v2_indexed(cell_name, cell_dirs[cell_name], index_path)),
+        ("find_nwb_v2_indexed (warm)", lambda cell_name: find_nwb_v2_indexed(cell_name, cell_dirs[cell_name], index_path)),
+        ("calculate_std_vs (ipfx)", lambda cell_name: noise_from_nwb(cell_name, nwb_path(cell_name))),
+        ("calculate_std_vs_h5", lambda cell_name: noise_from_nwb_h5(cell_name, nwb_path(cell_name))),
+        ("power_60hz", lambda cell_name: read_power_60hz_file(nwb_path(cell_name))),
+    ]
+
+    rows = []
+    conn = sqlite3.connect(lims_db_path)
+    try:
+        start = time.perf_counter()
+        cell_paths = generate_cell_paths(cell_names, conn=conn)
+        seconds = time.perf_counter() - start
+        rows.append({"benchmark": "lims_query", "cells": num_cells, "done": num_cells, "ok": len(cell_paths), "seconds": seconds,
+                     "peak_MB": _peak_memory(lambda names: generate_cell_paths(names, conn=conn), [cell_names])})
+    finally:
+        conn.close()
+
+    for name, fn in benchmarks:
+        done, ok, seconds = _run_cells(fn, cell_names, time_budget)
+        if name.endswith("(cold)"):
+            # The warm pass should find every entry, so the cold pass covers all cells
+            for cell_name in cell_names[done:]:
+                fn(cell_name)
+        peak_mb = None if name.endswith("(cold)") else _peak_memory(fn, cell_names[:memory_cells])
+        rows.append({"benchmark": name, "cells": num_cells, "done": done, "ok": ok, "seconds": seconds, "peak_MB": peak_mb})
+    return rows
+
+
+def main():
+    """
+    Measures the runners' cold start, then builds the fixtures for the largest cell
+    count, checks the kernels against the reference and benchmarks every cell count.
+    """
+
+    print("Importing each runner in a fresh interpreter...")
+    startup_df = pd.DataFrame(benchmark_startup())
+    print(startup_df.to_string(index=False, float_format=lambda value: f"{value:.3f}"))
+    print()
+
+    print(f"Building {max(cell_counts)} synthetic cells in {fixture_dir}...")
+    start = time.time()
+    cell_dirs = build_fixture_tree(fixture_dir, max(cell_counts), unique_files=unique_files, **nwb_settings)
+    lims_db_path = os.path.join(fixture_dir, "lims_stand_in.sqlite")
+    make_lims_stand_in(lims_db_path, cell_dirs)
+    print(f"Fixtures ready in {round(time.time() - start, 1)} seconds.")
+
+    # The timings only count if the kernels still agree with the reference
+    mismatches = check_noise_rows(cell_dirs)
+    if mismatches:
+        for kernel, cell_name, row, expected in mismatches:
+            print(f"{kernel} {cell_name}: {row} != {expected}")
+        raise AssertionError(f"{len(mismatches)} noise rows differ from the reference by more than {rms_tolerance} pA")
+    print(f"Noise rows match the reference (within {rms_tolerance} pA).")
+
+    rows = []
+    for num_cells in cell_counts:
+        print(f"Benchmarking {num_cells} cells...")
+        rows.extend(benchmark_cells(num_cells, cell_dirs, lims_db_path))
+
+    results_df = pd.DataFrame(rows)
+    results_df["cells_per_s"] = results_df["done"] / results_df["seconds"]
+    print()
+    print(results_df.to_string(index=False, float_format=lambda value: f"{value:.3f}"))
+    max_rss = _max_rss()
+    if max_rss is not None:
+        print(f"\nPeak resident memory: {max_rss:.0f} MB")
+    return results_df
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+"""
+-----------------------------------------------------------------------
+File name: ephys_noise.py
+Maintainer: Ramkumar Rajanbabu
+-----------------------------------------------------------------------
+Developer: Ramkumar Rajanbabu
+Date/time created: 10/17/2026
+Description: One command for every job (ex. python src/ephys_noise.py
+rig-noise --from 2023-01-01 --to 2023-03-31 --plan)
+-----------------------------------------------------------------------
+"""
+
+
+#-----Imports-----#
+# General imports
+import argparse
+import os
+import sys
+from datetime import date, timedelta
+
+
+# Dates
+date_prev_day = date.today() - timedelta(days=1)
+
+
+# Functions
+def read_cell_names(values):
+    """
+    Returns the cell names given on the command line. A value that is a file is
+    read as one cell name per line.
+    """
+
+    if not values:
+        return None
+    cells = []
+    for value in values:
+        if os.path.isfile(value):
+            with open(value) as f:
+                cells.extend(line.strip() for line in f if line.strip())
+        else:
+            cells.append(value)
+    return cells
+
+
+def date_range(args):
+    """
+    Returns (year, start_date, end_date) from the options, defaulting to yesterday
+    when no year or date is given.
+    """
+
+    if args.year is None and args.start_date is None and args.end_date is None and not args.cells:
+        return None, date_prev_day, date_prev_day
+    return args.year, args.start_date, args.end_date
+
+
+def add_common_args(parser, workers=True, store=True, csv=True):
+    parser.add_argument("--from", dest="start_date", type=date.fromisoformat, help="first patch date (YYYY-MM-DD)")
+    parser.add_argument("--to", dest="end_date", type=date.fromisoformat, help="last patch date (YYYY-MM-DD)")
+    parser.add_argument("--year", type=int, help="patch year (default: yesterday when no year, date or cell is given)")
+    parser.add_argument("--cells", nargs="+", metavar="CELL", help="cell names, or files with one cell name per line")
+    parser.add_argument("--rig", dest="rigs", nargs="+", metavar="RIG", help="rigs to process (jem-id_rig_number)")
+    if workers:
+        parser.add_argument("--workers", type=int, help="number of worker processes")
+    if store:
+        parser.add_argument("--store", help="metrics store (sqlite)")
+    if csv:
+        parser.add_argument("--csv", help="output csv")
+    parser.add_argument("--index", help="NWB index (sqlite)")
+    parser.add_argument("--ledger", help="failure ledger (sqlite)")
+    parser.add_argument("--plan", action="store_true", help="report how many cells are new, cached or failed, without opening any NWB file")
+
+
+def shard_arg(value):
+    """
+    Parses --shard i/N (1 <= i <= N) into (i, N).
+    """
+
+    try:
+        shard, num_shards = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{value!r} isn't i/N (ex. 2/4)")
+    if not 1 <= shard <= num_shards:
+        raise argparse.ArgumentTypeError(f"shard {shard} isn't between 1 and {num_shards}")
+    return shard, num_shards
+
+
+def add_shard_args(parser):
+    parser.add_argument("--shard", type=shard_arg, metavar="i/N", help="process the i-th of N shards of the cells, balanced by past timings and NWB file sizes, into a partial store (see merge)")
+    parser.add_argument("--shard-dir", help="directory of the partial stores (ex. a share every machine can write to)")
+    parser.add_argument("--shard-plan", metavar="CSV", help="cell to shard assignment shared by the machines (written by the first run, ex. with --plan, and read by the others)")
+
+
+def _options(args, **names):
+    """
+    Returns the keyword arguments of the options that were given (option -> parameter name).
+    """
+
+    return {param: getattr(args, option) for option, param in names.items() if getattr(args, option, None) is not None}
+
+
+def run_rig_noise(args):
+    year, start_date, end_date = date_range(args)
+    options = _options(args, rigs="rigs", store="store_path", csv="csv_path", index="index_path", ledger="ledger_path", kernel="kernel")
+    if args.prefetch:
+        if args.all_sweeps:
+            sys.exit("--all-sweeps isn't supported with --prefetch")
+        if args.shard:
+            sys.exit("--shard isn't supported with --prefetch")
+        import generate_rig_noise
+        generate_rig_noise.main(start_date=start_date, end_date=end_date, year=year, cells=read_cell_names(args.cells),
+                                prefetch=args.prefetch, plan=args.plan, **_options(args, workers="workers"), **options)
+    else:
+        import generate_rig_noise_2023
+        generate_rig_noise_2023.main(year=year, start_date=start_date, end_date=end_date, cells=read_cell_names(args.cells),
+                                     all_sweeps=args.all_sweeps, plan=args.plan,
+                                     **_options(args, workers="workers", shard="shard", shard_dir="shard_dir", shard_plan="shard_plan"), **options)
+
+
+def run_cell_metrics(args):
+    import generate_cell_metrics
+    year, start_date, end_date = date_range(args)
+    options = _options(args, rigs="rigs", workers="workers", store="store_path", index="index_path", ledger="ledger_path", cache="cache_path")
+    if args.no_cache:
+        options["cache_path"] = None
+    generate_cell_metrics.main(year=year, start_date=start_date, end_date=end_date, cells=read_cell_names(args.cells),
+                               reprocess=args.reprocess, plan=args.plan, **options)
+
+
+def run_power_60hz(args):
+    import generate_power_60hz_metrics
+    year, start_date, end_date = date_range(args)
+    generate_power_60hz_metrics.main(year=year, start_date=start_date, end_date=end_date, cells=read_cell_names(args.cells), plan=args.plan,
+                                     **_options(args, rigs="rigs", workers="workers", store="store_path", csv="csv_path", index="index_path",
+                                                ledger="ledger_path", shard="shard", shard_dir="shard_dir", shard_plan="shard_plan"))
+
+
+def run_merge(args):
+    if args.job == "rig-noise":
+        import generate_rig_noise_2023 as job_module
+    else:
+        import generate_power_60hz_metrics as job_module
+    job_module.merge_shards(**_options(args, shard_dir="shard_dir", store="store_path", csv="csv_path"))
+
+
+def run_experiment_details(args):
+    import generate_experiment_details
+    year, start_date, end_date = date_range(args)
+    generate_experiment_details.main(start_date=start_date, end_date=end_date, year=year, cells=read_cell_names(args.cells),
+                                     plan=args.plan,
+                                     **_options(args, rigs="rigs", workers="workers", out="out_dir", index="index_path", ledger="ledger_path"))
+
+
+def run_poll(args):
+    import poll_rig_noise
+    poll_rig_noise.main(every=args.every, plan=args.plan,
+                        **_options(args, jem="jem_path", rigs="rigs", lookback="lookback", workers="workers", kernel="kernel", store="store_path",
+                                   csv="csv_path", index="index_path", ledger="ledger_path", state="state_path"))
+
+
+def run_archive(args):
+    if args.rms:
+        if args.rigs:
+            sys.exit("--rig isn't supported with --rms")
+        from functions.archive_functions import BaselineArchive, archive_metrics, default_archive_dir
+        # Every archived sweep (or --cells), straight from the archive
+        with BaselineArchive(args.archive or default_archive_dir) as archive:
+            metrics_df = archive_metrics(archive, cells=read_cell_names(args.cells))
+        metrics_df.to_csv(args.rms, index=False)
+        print(f"{len(metrics_df)} sweeps of {metrics_df['cell_name'].nunique()} cells written to {args.rms}.")
+        return
+    import generate_baseline_archive
+    year, start_date, end_date = date_range(args)
+    generate_baseline_archive.main(year=year, start_date=start_date, end_date=end_date, cells=read_cell_names(args.cells), plan=args.plan,
+                                   **_options(args, rigs="rigs", workers="workers", archive="archive_dir", index="index_path", ledger="ledger_path"))
+
+
+def run_aggregates(args):
+    import generate_rig_noise_2023
+    from functions.aggregate_functions import has_aggregates, query_aggregates, rebuild_aggregates
+    from functions.jem_functions import load_jem_metadata
+    from functions.store_functions import default_store_dir
+    import sqlite3
+
+    metric_cols = {"power_60hz_metrics": ["average_power_60hz"]}.get(args.table, generate_rig_noise_2023.sweep_cols[1:])
+    conn = sqlite3.connect(args.store or default_store_dir, timeout=60)
+    try:
+        if args.rebuild or not has_aggregates(conn, args.table):
+            # Every year's metadata, so old rows get their rig too
+            jem_df = load_jem_metadata(generate_rig_noise_2023.json_data_dir, fields=generate_rig_noise_2023.jem_fields)
+            print(f"{rebuild_aggregates(conn, args.table, metric_cols, jem_df)} rows of {args.table} aggregated.")
+        by = [col for col in ("rig", "day") if col in args.by.split(",")]
+        trend_df = query_aggregates(conn, args.table, args.metric or metric_cols[0], by=by, rigs=args.rig,
+                                    start_day=args.start_date, end_day=args.end_date)
+    finally:
+        conn.close()
+    if args.csv:
+        trend_df.to_csv(args.csv, index=False)
+    else:
+        print(trend_df.to_string(index=False))
+
+
+def run_failures(args):
+    from functions.ledger_functions import default_ledger_dir, failure_report, open_failure_ledger, reset_failures
+
+    conn = open_failure_ledger(args.ledger or default_ledger_dir)
+    try:
+        if args.reset:
+            print(f"{reset_failures(conn, args.job, read_cell_names(args.cells))} ledger entries cleared.")
+            return
+        report_df = failure_report(conn, args.job, permanent_only=not args.all)
+    finally:
+        conn.close()
+    if args.csv:
+        report_df.to_csv(args.csv, index=False)
+    elif len(report_df):
+        print(report_df.groupby(["job", "reason"]).size().rename("cells").reset_index().to_string(index=False))
+        print()
+        print(report_df[["job", "cell_name", "reason", "attempts", "last_failed", "retry_after"]].to_string(index=False))
+    else:
+        print("No cells in the failure ledger." if args.all else "No permanently skipped cells.")
+
+
+def run_backfill(args):
+    import backfill_rig_noise
+    backfill_rig_noise.main(args.backfill_args)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="ephys_noise", description="IVSCC rig noise jobs.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    rig_noise = subparsers.add_parser("rig-noise", help="noise rms of the inbath, cellatt and breakin sweeps")
+    add_common_args(rig_noise)
+    rig_noise.add_argument("--kernel", choices=["ipfx", "h5py"], help="rms calculation")
+    rig_noise.add_argument("--prefetch", type=int, metavar="N", help="copy N NWB files at a time to local scratch (the daily pipeline) instead of using worker processes")
+    rig_noise.add_argument("--all-sweeps", action="store_true", help="also store the rms of every repetition of each stimulus and their median/min/max (read with h5py)")
+    add_shard_args(rig_noise)
+    rig_noise.set_defaults(run=run_rig_noise)
+
+    cell_metrics = subparsers.add_parser("cell-metrics", help="noise, noise spectrum and power60HzRatio metrics from one pass over each NWB file")
+    add_common_args(cell_metrics, csv=False)
+    cell_metrics.add_argument("--cache", help="metric cache (sqlite)")
+    cell_metrics.add_argument("--no-cache", action="store_true", help="always open the NWB files")
+    cell_metrics.add_argument("--reprocess", action="store_true", help="recompute cells already in the store")
+    cell_metrics.set_defaults(run=run_cell_metrics)
+
+    power_60hz = subparsers.add_parser("power60hz", help="last power60HzRatio value of each cell")
+    add_common_args(power_60hz)
+    add_shard_args(power_60hz)
+    power_60hz.set_defaults(run=run_power_60hz)
+
+    merge = subparsers.add_parser("merge", help="merge the partial stores of --shard runs into the store and rewrite the csv")
+    merge.add_argument("job", choices=["rig-noise", "power60hz"], help="the sharded job")
+    merge.add_argument("--shard-dir", help="directory of the partial stores")
+    merge.add_argument("--store", help="metrics store (sqlite)")
+    merge.add_argument("--csv", help="output csv")
+    merge.set_defaults(run=run_merge)
+
+    experiment_details = subparsers.add_parser("experiment-details", help="sweep table of each cell")
+    add_common_args(experiment_details, store=False, csv=False)
+    experiment_details.add_argument("--out", help="parquet dataset directory (one date=YYYY-MM-DD folder per patch day)")
+    experiment_details.set_defaults(run=run_experiment_details)
+
+    poll = subparsers.add_parser("poll", help="process only the cells that are new in the JEM metadata or got a new or changed NWB file since the last poll")
+    poll.add_argument("--every", type=float, metavar="MINUTES", help="keep polling every MINUTES minutes (default: poll once)")
+    poll.add_argument("--lookback", type=int, metavar="DAYS", help="check the directories of known cells patched in the last DAYS days")
+    poll.add_argument("--jem", help="JEM metadata csv (ex. a test copy)")
+    poll.add_argument("--rig", dest="rigs", nargs="+", metavar="RIG", help="rigs to poll (jem-id_rig_number)")
+    poll.add_argument("--state", help="poll state (sqlite)")
+    poll.add_argument("--workers", type=int, help="number of worker processes")
+    poll.add_argument("--kernel", choices=["ipfx", "h5py"], help="rms calculation")
+    poll.add_argument("--store", help="metrics store (sqlite)")
+    poll.add_argument("--csv", help="output csv")
+    poll.add_argument("--index", help="NWB index (sqlite)")
+    poll.add_argument("--ledger", help="failure ledger (sqlite)")
+    poll.add_argument("--plan", action="store_true", help="list what would be queued, without processing or recording anything")
+    poll.set_defaults(run=run_poll)
+
+    archive = subparsers.add_parser("archive", help="save the voltage clamp baselines to the local baseline archive (float32, memory mapped)")
+    add_common_args(archive, store=False, csv=False)
+    archive.add_argument("--archive", help="baseline archive directory")
+    archive.add_argument("--rms", metavar="CSV", help="write the long/short rms of every archived sweep (or --cells) to CSV instead, without opening any NWB file")
+    archive.set_defaults(run=run_archive)
+
+    aggregates = subparsers.add_parser("aggregates", help="per rig, per day noise trends from the stored aggregates (no metric rows are read)")
+    aggregates.add_argument("--table", default="noise_metrics", choices=["noise_metrics", "power_60hz_metrics", "noise_metrics_backfill"], help="metrics table")
+    aggregates.add_argument("--metric", help="aggregated column (default: the table's first metric)")
+    aggregates.add_argument("--by", default="rig,day", help="group by rig, day, both (rig,day) or neither (none)")
+    aggregates.add_argument("--rig", nargs="+", help="rigs to keep")
+    aggregates.add_argument("--from", dest="start_date", type=date.fromisoformat, help="first day (YYYY-MM-DD)")
+    aggregates.add_argument("--to", dest="end_date", type=date.fromisoformat, help="last day (YYYY-MM-DD)")
+    aggregates.add_argument("--store", help="metrics store (sqlite)")
+    aggregates.add_argument("--csv", help="write the trends to this csv instead of printing them")
+    aggregates.add_argument("--rebuild", action="store_true", help="recompute the aggregates from every stored row")
+    aggregates.set_defaults(run=run_aggregates)
+
+    failures = subparsers.add_parser("failures", help="cells skipped for good after repeated failures (and when the others are retried)")
+    failures.add_argument("--job", choices=["noise_metrics", "power_60hz_metrics", "cell_metrics", "experiment_details", "noise_metrics_backfill", "baseline_archive"], help="keep this job only")
+    failures.add_argument("--all", action="store_true", help="every ledger entry, not just the permanently skipped cells")
+    failures.add_argument("--cells", nargs="+", metavar="CELL", help="with --reset: these cells only (names, or files with one cell name per line)")
+    failures.add_argument("--reset", action="store_true", help="clear the entries, so the cells are tried on the next run")
+    failures.add_argument("--ledger", help="failure ledger (sqlite)")
+    failures.add_argument("--csv", help="write the report to this csv instead of printing it")
+    failures.set_defaults(run=run_failures)
+
+    # Its options are parsed by backfill_rig_noise
+    backfill = subparsers.add_parser("backfill", help="resumable rig noise backfill (see backfill --help)", add_help=False)
+    backfill.set_defaults(run=run_backfill)
+
+    args, backfill_args = parser.parse_known_args(argv)
+    if backfill_args and args.command != "backfill":
+        parser.error("unrecognized arguments: " + " ".join(backfill_args))
+    args.backfill_args = backfill_args
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # The job modules are imported here, so --help and bad options don't load pandas or h5py
+    args.run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
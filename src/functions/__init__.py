@@ -0,0 +1,10 @@
+"""
+-----------------------------------------------------------------------
+File name: __init__.py
+Maintainer: Ramkumar Rajanbabu
+-----------------------------------------------------------------------
+Developer: Ramkumar Rajanbabu
+Date/time created: 10/17/2026
+Description: Shared helpers for the generate_* noise scripts
+-----------------------------------------------------------------------
+"""
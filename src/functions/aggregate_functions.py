@@ -0,0 +1,307 @@
+"""
+-----------------------------------------------------------------------
+File name: aggregate_functions.py
+Maintainer: Ramkumar Rajanbabu
+-----------------------------------------------------------------------
+Developer: Ramkumar Rajanbabu
+Date/time created: 10/17/2026
+Description: Per rig, per day noise aggregates (count, mean, Welford
+variance, quantile sketch) kept up to date as rows are written
+-----------------------------------------------------------------------
+"""
+
+
+#-----Imports-----#
+# General imports
+import json
+import math
+import numpy as np
+import pandas as pd
+# File imports
+from functions.jem_functions import parse_patch_dates
+
+
+# Settings
+rig_field = "jem-id_rig_number" # JEM column the rig comes from
+unknown_rig = "unknown" # Rig of cells without one in the JEM metadata
+sketch_accuracy = 0.01 # Relative accuracy of the quantile sketches (1%)
+
+aggregate_schema = """CREATE TABLE IF NOT EXISTS metric_aggregates (
+    table_name TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    rig TEXT NOT NULL,
+    day TEXT NOT NULL,
+    n INTEGER,
+    mean REAL,
+    m2 REAL,
+    sketch TEXT,
+    PRIMARY KEY (table_name, metric, rig, day)
+)"""
+
+# The rig and day each stored row was counted under, so a replaced row can be taken out again
+member_schema = """CREATE TABLE IF NOT EXISTS metric_aggregate_cells (
+    table_name TEXT NOT NULL,
+    cell_name TEXT NOT NULL,
+    rig TEXT,
+    day TEXT,
+    PRIMARY KEY (table_name, cell_name)
+)"""
+
+_gamma = (1 + sketch_accuracy) / (1 - sketch_accuracy)
+_log_gamma = math.log(_gamma)
+
+
+# Functions
+def _quote(name):
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+def open_aggregates(conn):
+    """
+    Creates the aggregate tables in a metrics store if needed.
+    """
+
+    conn.execute(aggregate_schema)
+    conn.execute(member_schema)
+    conn.commit()
+
+
+def sketch_merge(sketch, other):
+    """
+    Adds every count of other to a quantile sketch ({"p": {bucket: count}, "n": ..., "z": count}
+    for positive, negative and zero values).
+    """
+
+    sketch["z"] = sketch.get("z", 0) + other.get("z", 0)
+    for side in ("p", "n"):
+        for key, weight in other.get(side, {}).items():
+            buckets = sketch.setdefault(side, {})
+            buckets[key] = buckets.get(key, 0) + weight
+    return sketch
+
+
+def sketch_quantile(sketch, q):
+    """
+    Returns the q quantile (0-1) of a sketch, within sketch_accuracy (None if empty).
+    """
+
+    values = [(-2 * _gamma ** int(key) / (_gamma + 1), weight) for key, weight in sketch.get("n", {}).items()]
+    if sketch.get("z"):
+        values.append((0.0, sketch["z"]))
+    values += [(2 * _gamma ** int(key) / (_gamma + 1), weight) for key, weight in sketch.get("p", {}).items()]
+    values.sort()
+    total = sum(weight for _, weight in values)
+    if total <= 0:
+        return None
+    rank = q * (total - 1)
+    seen = 0
+    for value, weight in values:
+        seen += weight
+        if seen > rank:
+            return value
+    return values[-1][0]
+
+
+def _combine(n_a, mean_a, m2_a, n_b, mean_b, m2_b):
+    """
+    Combines two (count, mean, sum of squared deviations) summaries (Chan et al.,
+    the batch form of Welford's update). A negative n_b takes b out of a.
+    """
+
+    n = n_a + n_b
+    if n <= 0:
+        return 0, 0.0, 0.0
+    delta = mean_b - mean_a
+    mean = mean_a + delta * n_b / n
+    if n_b > 0:
+        m2 = m2_a + m2_b + delta * delta * n_a * n_b / n
+    else:
+        # Taking b out: mean_a is the combined mean, and mean is what's left
+        delta = mean_b - mean
+        m2 = m2_a - m2_b - delta * delta * n * -n_b / n_a
+    return n, mean, max(m2, 0.0)
+
+
+def _batch_summaries(groups_df, metric_cols):
+    """
+    Returns {(metric, rig, day): (n, mean, m2, sketch)} for the rows of a batch.
+    """
+
+    summaries = {}
+    for (rig, day), group_df in groups_df.groupby(["rig", "day"], sort=False):
+        for metric in metric_cols:
+            values = pd.to_numeric(group_df[metric], errors="coerce").dropna().to_numpy(dtype=np.float64)
+            if not len(values):
+                continue
+            # Bucket k holds |values| in (gamma^(k-1), gamma^k], so its midpoint is within sketch_accuracy of each
+            sketch = {}
+            nonzero = values[values != 0]
+            if len(nonzero) < len(values):
+                sketch["z"] = int(len(values) - len(nonzero))
+            buckets = np.ceil(np.log(np.abs(nonzero)) / _log_gamma).astype(np.int64)
+            for side, keep in (("p", nonzero > 0), ("n", nonzero < 0)):
+                keys, counts = np.unique(buckets[keep], return_counts=True)
+                if len(keys):
+                    sketch[side] = {str(key): int(count) for key, count in zip(keys, counts)}
+            summaries[(metric, rig, day)] = (len(values), float(values.mean()), float(((values - values.mean()) ** 2).sum()), sketch)
+    return summaries
+
+
+def _apply(conn, table, summaries, sign):
+    """
+    Adds (sign=1) or takes out (sign=-1) batch summaries from the stored aggregates.
+    """
+
+    for (metric, rig, day), (n_b, mean_b, m2_b, sketch_b) in summaries.items():
+        row = conn.execute("SELECT n, mean, m2, sketch FROM metric_aggregates WHERE table_name = ? AND metric = ? AND rig = ? AND day = ?",
+                           (table, metric, rig, day)).fetchone()
+        n_a, mean_a, m2_a, sketch_a = (row[0], row[1], row[2], json.loads(row[3])) if row else (0, 0.0, 0.0, {})
+        if sign < 0:
+            n_b = -n_b
+            sketch_b = {"z": -sketch_b.get("z", 0), **{side: {key: -weight for key, weight in sketch_b.get(side, {}).items()} for side in ("p", "n")}}
+        n, mean, m2 = _combine(n_a, mean_a, m2_a, n_b, mean_b, m2_b)
+        sketch = sketch_merge(sketch_a, sketch_b)
+        for side in ("p", "n"):
+            sketch[side] = {key: weight for key, weight in sketch.get(side, {}).items() if weight > 0}
+        conn.execute("INSERT OR REPLACE INTO metric_aggregates VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                     (table, metric, rig, day, n, mean, m2, json.dumps(sketch)))
+
+
+def _rig_day(df):
+    """
+    Returns the rig and day (YYYY-MM-DD) columns of rows with rig_field and a patch date.
+    """
+
+    if "date_patch" in df:
+        days = pd.to_datetime(df["date_patch"])
+    else:
+        days = parse_patch_dates(df["jem-date_patch"])
+    rigs = df[rig_field] if rig_field in df else pd.Series(None, index=df.index, dtype=object)
+    # Rig numbers read as floats where the column has blanks (ex. 3.0)
+    rigs = rigs.map(lambda rig: str(int(rig)) if isinstance(rig, float) and rig.is_integer() else rig)
+    return pd.DataFrame({"rig": rigs.fillna(unknown_rig).astype(str).str.strip().replace("", unknown_rig).to_numpy(),
+                         "day": days.dt.strftime("%Y-%m-%d").fillna("unknown").to_numpy()}, index=df.index)
+
+
+def update_aggregates(conn, table, metric_cols, rows_df):
+    """
+    Adds a batch of rows to the aggregates of a metrics table. Rows of cells that
+    were counted before (the cell is being rewritten) are taken out first, using
+    the values still in the store, so the aggregates always match the store. Call
+    it before the rows are written, in the same transaction (nothing is committed here).
+
+    Parameters:
+        conn (sqlite3.Connection): an open metrics store (see open_aggregates).
+        table (string): the metrics table the rows are written to.
+        metric_cols (list): the columns to aggregate (ex. the six rms columns).
+        rows_df (DataFrame): cell_name, metric_cols, rig_field and date_patch (or jem-date_patch).
+    """
+
+    if not len(rows_df):
+        return
+    cell_names = rows_df["cell_name"].tolist()
+    old_rows = []
+    for i in range(0, len(cell_names), 500):
+        batch = cell_names[i:i + 500]
+        placeholders = ", ".join("?" * len(batch))
+        old_rows += conn.execute(
+            "SELECT m.cell_name, m.rig, m.day, {} FROM metric_aggregate_cells m JOIN {} t ON t.cell_name = m.cell_name "
+            "WHERE m.table_name = ? AND m.cell_name IN ({})".format(", ".join("t." + _quote(col) for col in metric_cols), _quote(table), placeholders),
+            [table] + batch).fetchall()
+    if old_rows:
+        old_df = pd.DataFrame(old_rows, columns=["cell_name", "rig", "day"] + list(metric_cols))
+        _apply(conn, table, _batch_summaries(old_df, metric_cols), -1)
+
+    new_df = pd.concat([rows_df[["cell_name"] + list(metric_cols)].reset_index(drop=True),
+                        _rig_day(rows_df).reset_index(drop=True)], axis=1)
+    _apply(conn, table, _batch_summaries(new_df, metric_cols), 1)
+    conn.executemany("INSERT OR REPLACE INTO metric_aggregate_cells VALUES (?, ?, ?, ?)",
+                     ((table, cell_name, rig, day) for cell_name, rig, day in new_df[["cell_name", "rig", "day"]].itertuples(index=False, name=None)))
+
+
+def rebuild_aggregates(conn, table, metric_cols, jem_df):
+    """
+    Recomputes a table's aggregates from every row in the store (ex. after the
+    store was seeded from a csv). The rig comes from jem_df.
+
+    Parameters:
+        conn (sqlite3.Connection): an open metrics store.
+        table (string): the metrics table.
+        metric_cols (list): the columns to aggregate.
+        jem_df (DataFrame): JEM metadata with jem-id_cell_specimen and rig_field.
+
+    Returns:
+        count (int): the number of rows aggregated.
+    """
+
+    open_aggregates(conn)
+    query = "SELECT cell_name, {}, {} FROM {}".format(_quote("jem-date_patch"), ", ".join(_quote(col) for col in metric_cols), _quote(table))
+    store_df = pd.read_sql_query(query, conn)
+    rig_df = jem_df[["jem-id_cell_specimen"] + ([rig_field] if rig_field in jem_df else [])].drop_duplicates(subset=["jem-id_cell_specimen"])
+    store_df = pd.merge(store_df, rig_df, how="left", left_on="cell_name", right_on="jem-id_cell_specimen")
+    with conn:
+        conn.execute("DELETE FROM metric_aggregates WHERE table_name = ?", (table,))
+        conn.execute("DELETE FROM metric_aggregate_cells WHERE table_name = ?", (table,))
+        update_aggregates(conn, table, metric_cols, store_df)
+    return len(store_df)
+
+
+def has_aggregates(conn, table):
+    """
+    Returns True if any row of a table has been aggregated.
+    """
+
+    open_aggregates(conn)
+    return conn.execute("SELECT 1 FROM metric_aggregate_cells WHERE table_name = ? LIMIT 1", (table,)).fetchone() is not None
+
+
+def query_aggregates(conn, table, metric, by=("rig", "day"), rigs=None, start_day=None, end_day=None, quantiles=(0.5, 0.9)):
+    """
+    Noise trends from the aggregates alone (no metric rows are read): the stored
+    per rig, per day summaries are combined into the requested grouping.
+
+    Parameters:
+        conn (sqlite3.Connection): an open metrics store.
+        table (string): the metrics table (ex. "noise_metrics").
+        metric (string): the aggregated column (ex. "breakin_long_rms").
+        by (tuple): group by "rig", "day", both or neither.
+        rigs (list): keep these rigs only (optional).
+        start_day (date): the first day (optional).
+        end_day (date): the last day (optional).
+        quantiles (tuple): the quantiles to estimate from the sketches.
+
+    Returns:
+        trend_df (DataFrame): the by columns, n, mean, std and one column per quantile (ex. q50).
+    """
+
+    where = ["table_name = ?", "metric = ?"]
+    params = [table, metric]
+    if rigs:
+        where.append("rig IN ({})".format(", ".join("?" * len(rigs))))
+        params += [str(rig) for rig in rigs]
+    if start_day is not None:
+        where.append("day >= ?")
+        params.append(start_day.strftime("%Y-%m-%d"))
+    if end_day is not None:
+        where.append("day <= ?")
+        params.append(end_day.strftime("%Y-%m-%d"))
+    rows = conn.execute("SELECT rig, day, n, mean, m2, sketch FROM metric_aggregates WHERE {} ORDER BY day, rig".format(" AND ".join(where)), params)
+
+    by = list(by)
+    groups = {}
+    for rig, day, n, mean, m2, sketch in rows:
+        key = tuple({"rig": rig, "day": day}[col] for col in by)
+        if key not in groups:
+            groups[key] = [0, 0.0, 0.0, {}]
+        group = groups[key]
+        group[0], group[1], group[2] = _combine(group[0], group[1], group[2], n, mean, m2)
+        sketch_merge(group[3], json.loads(sketch))
+
+    trend_rows = []
+    for key, (n, mean, m2, sketch) in groups.items():
+        row = dict(zip(by, key))
+        row.update({"n": n, "mean": mean, "std": math.sqrt(m2 / n) if n else None})
+        for q in quantiles:
+            row[f"q{round(q * 100):d}"] = sketch_quantile(sketch, q)
+        trend_rows.append(row)
+    return pd.DataFrame(trend_rows, columns=by + ["n", "mean", "std"] + [f"q{round(q * 100):d}" for q in quantiles])
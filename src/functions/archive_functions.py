@@ -0,0 +1,278 @@
+"""
+-----------------------------------------------------------------------
+File name: archive_functions.py
+Maintainer: Ramkumar Rajanbabu
+-----------------------------------------------------------------------
+Developer: Ramkumar Rajanbabu
+Date/time created: 10/17/2026
+Description: Local baseline archive: the voltage clamp baselines of each
+cell saved once as float32, read back through a memory map
+-----------------------------------------------------------------------
+"""
+
+
+#-----Imports-----#
+# General imports
+import numpy as np
+import os
+import pandas as pd
+import sqlite3
+# File imports
+from functions.general_functions import find_cell_nwb, vs_stim_names
+from functions.nwb_functions import NwbFile, get_sweep_numbers_h5
+from functions.rms_functions import baseline_windows, find_baseline_epoch, sweep_types
+from functions.runlog_functions import failure, timed
+
+
+# Directories
+default_archive_dir = os.path.join(os.path.expanduser("~"), ".ephys-noise-analysis", "baseline_archive")
+
+# Settings
+sample_dtype = np.dtype("<f4") # pA, little endian so the file reads the same everywhere
+data_name = "baselines.f32" # Samples of every segment, back to back (only ever appended to)
+index_name = "index.sqlite" # Where each segment starts in the data file
+
+index_schema = """CREATE TABLE IF NOT EXISTS baseline_index (
+    cell_name TEXT NOT NULL,
+    sweep_type TEXT,
+    sweep_number INTEGER NOT NULL,
+    last INTEGER,
+    rate REAL,
+    test_end INTEGER,
+    bl_end INTEGER,
+    first_sample INTEGER,
+    num_samples INTEGER,
+    PRIMARY KEY (cell_name, sweep_number)
+)"""
+index_cols = ["cell_name", "sweep_type", "sweep_number", "last", "rate", "test_end", "bl_end", "first_sample", "num_samples"]
+
+
+# Functions
+def read_cell_baselines_h5(h5file, sweep_table):
+    """
+    Reads the baseline (test pulse end to stimulus onset) of every voltage clamp
+    repetition of the inbath, cellatt and breakin stimuli.
+
+    Parameters:
+        h5file (h5py.File): an open NWB v2 file.
+        sweep_table (dict): the output of read_sweep_table_h5.
+
+    Returns:
+        sweeps (list): (sweep_type, sweep_number, last, rate, test_end, bl_end, segment) per sweep,
+            where last is True for the sweep calculate_std_vs uses and segment is float32 pA
+            ending at bl_end (it starts earlier than test_end if the short window does).
+    """
+
+    sweeps = []
+    for sweep_type, stim_names in zip(sweep_types, vs_stim_names):
+        sweep_nums = get_sweep_numbers_h5(sweep_table, stim_names)
+        for sweep_num in sweep_nums:
+            sweep = sweep_table.get(sweep_num)
+            if not sweep or sweep.get("clamp_mode") != "VoltageClamp" or "stimulus" not in sweep:
+                continue
+            response = h5file[sweep["acquisition"]]
+            rate = float(response["starting_time"].attrs["rate"])
+            epoch = find_baseline_epoch(h5file[sweep["stimulus"]]["data"], rate)
+            if epoch is None:
+                continue
+            test_end, bl_end = epoch
+            start = max(min(test_end, baseline_windows(test_end, bl_end, rate)[1]), 0)
+
+            data = response["data"]
+            with timed("h5_read", sweep=int(sweep_num)) as info:
+                segment = data[start:bl_end]
+                info["bytes"] = segment.nbytes
+            # Scaled to pA like ipfx (A * 1e12)
+            segment = (segment.astype(np.float64) * float(data.attrs.get("conversion", 1.0)) * 1e12).astype(sample_dtype)
+            sweeps.append((sweep_type, int(sweep_num), sweep_num == sweep_nums[-1], rate, test_end, bl_end, segment))
+    return sweeps
+
+
+def extract_cell_baselines(cell_name, path, nwb_index_path=None):
+    """
+    Reads the baselines of one cell for the archive (see read_cell_baselines_h5).
+
+    Parameters:
+        cell_name (string): a string specifying the cell name.
+        path (string): a string specifying the storage directory (None if not in LIMS).
+        nwb_index_path (string): a string specifying the NWB index (None to always walk the directory).
+
+    Returns:
+        sweeps (list): the output of read_cell_baselines_h5 (None if the file can't be found or
+            read, or has no voltage clamp baseline).
+    """
+
+    nwb2_filepath = find_cell_nwb(cell_name, path, nwb_index_path, keep_open=True)
+    if not nwb2_filepath:
+        return None
+    try:
+        with NwbFile(nwb2_filepath, cell_name) as nwb:
+            sweeps = read_cell_baselines_h5(nwb.h5file, nwb.sweep_table)
+    except (OSError, KeyError, ValueError) as e:
+        print(f"can't read {cell_name}: {e!r}")
+        failure(cell_name, "unreadable_nwb", repr(e))
+        return None
+    if not sweeps:
+        failure(cell_name, "no_voltage_sweep")
+        return None
+    return sweeps
+
+
+class BaselineArchive:
+    """
+    Append-only archive of baseline segments: one file of float32 samples and an
+    sqlite index of where each (cell, sweep) segment starts. Segments are views of
+    a memory map of the file, so reading them copies nothing.
+
+    Ex.
+        with BaselineArchive(archive_dir) as archive:
+            for sweep, segment in archive.segments(cells):
+                long_rms, short_rms = segment_rms(segment, sweep.rate, sweep.test_end, sweep.bl_end)
+    """
+
+    def __init__(self, archive_dir=default_archive_dir):
+        os.makedirs(archive_dir, exist_ok=True)
+        self.data_path = os.path.join(archive_dir, data_name)
+        self.conn = sqlite3.connect(os.path.join(archive_dir, index_name), timeout=60)
+        self.conn.execute(index_schema)
+        self.conn.commit()
+        self._samples = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self._samples = None
+        self.conn.close()
+
+    def cells(self):
+        """
+        Returns the set of archived cells.
+        """
+
+        return {row[0] for row in self.conn.execute("SELECT DISTINCT cell_name FROM baseline_index")}
+
+    def append(self, cell_name, sweeps):
+        """
+        Appends one cell's segments (the output of read_cell_baselines_h5). The samples
+        are on disk before the index points at them, so a crash leaves at most some
+        unindexed samples at the end of the file.
+
+        Returns:
+            count (int): the number of samples written.
+        """
+
+        rows = []
+        with open(self.data_path, "ab") as f:
+            size = f.seek(0, os.SEEK_END)
+            if size % sample_dtype.itemsize:
+                # A write cut short: pad to the next sample so the offsets stay aligned
+                f.write(b"\0" * (sample_dtype.itemsize - size % sample_dtype.itemsize))
+                size = f.tell()
+            first_sample = size // sample_dtype.itemsize
+            for sweep_type, sweep_num, last, rate, test_end, bl_end, segment in sweeps:
+                segment = np.ascontiguousarray(segment, dtype=sample_dtype)
+                f.write(segment.tobytes())
+                rows.append((cell_name, sweep_type, sweep_num, int(last), rate, test_end, bl_end, first_sample, len(segment)))
+                first_sample += len(segment)
+            f.flush()
+            os.fsync(f.fileno())
+        with self.conn:
+            # A cell archived again points at its new samples
+            self.conn.execute("DELETE FROM baseline_index WHERE cell_name = ?", (cell_name,))
+            self.conn.executemany("INSERT INTO baseline_index VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        self._samples = None
+        return sum(row[-1] for row in rows)
+
+    @property
+    def samples(self):
+        """
+        The whole data file as a read-only memory map (remapped after an append).
+        """
+
+        if self._samples is None:
+            if os.path.exists(self.data_path) and os.path.getsize(self.data_path) >= sample_dtype.itemsize:
+                self._samples = np.memmap(self.data_path, dtype=sample_dtype, mode="r")
+            else:
+                self._samples = np.empty(0, dtype=sample_dtype)
+        return self._samples
+
+    def index(self, cells=None):
+        """
+        Returns the index as a dataframe (index_cols), in file order.
+        """
+
+        index_df = pd.read_sql_query("SELECT * FROM baseline_index ORDER BY first_sample", self.conn)
+        if cells is not None:
+            index_df = index_df[index_df["cell_name"].isin(set(cells))]
+        return index_df
+
+    def segments(self, cells=None):
+        """
+        Yields (index row, segment view) per archived sweep, in file order, so the
+        file is scanned front to back.
+        """
+
+        samples = self.samples
+        for sweep in self.index(cells).itertuples(index=False):
+            yield sweep, samples[sweep.first_sample:sweep.first_sample + sweep.num_samples]
+
+
+def segment_rms(segment, rate, test_end, bl_end):
+    """
+    Long and short baseline rms of an archived segment, with the windows of calculate_std_vs.
+
+    Returns:
+        long_rms, short_rms (float): the rounded rms values (nan for an empty window).
+    """
+
+    long_start, short_start, _ = baseline_windows(test_end, bl_end, rate)
+    start = bl_end - len(segment)
+    values = []
+    for window in (segment[max(long_start - start, 0):], segment[max(short_start - start, 0):]):
+        values.append(float(np.std(window, dtype=np.float64).round(3)) if len(window) else np.nan)
+    return tuple(values)
+
+
+def archive_metrics(archive, metric=segment_rms, columns=("long_rms", "short_rms"), cells=None):
+    """
+    Runs a metric over every archived sweep (no NWB file is opened).
+
+    Parameters:
+        archive (BaselineArchive): an open archive.
+        metric (function): called as metric(segment, rate, test_end, bl_end), returning one value per column.
+        columns (tuple): the names of the metric's values.
+        cells (list): these cells only (optional).
+
+    Returns:
+        metrics_df (DataFrame): cell_name, sweep_type, sweep_number, last and the metric columns, one row per sweep.
+    """
+
+    rows = []
+    with timed("archive_scan", metric=getattr(metric, "__name__", str(metric))) as info:
+        for sweep, segment in archive.segments(cells):
+            rows.append((sweep.cell_name, sweep.sweep_type, sweep.sweep_number, bool(sweep.last))
+                        + tuple(metric(segment, sweep.rate, sweep.test_end, sweep.bl_end)))
+        info["sweeps"] = len(rows)
+    return pd.DataFrame(rows, columns=["cell_name", "sweep_type", "sweep_number", "last"] + list(columns))
+
+
+def archive_noise_rows(archive, cells=None):
+    """
+    Recomputes the noise rows (sweep_cols of the rig noise scripts) from the archive:
+    the long/short rms of the last inbath, cellatt and breakin sweep of each cell.
+
+    Returns:
+        noise_df (DataFrame): cell_name and the 6 rms columns (cells missing a voltage sweep are left out).
+    """
+
+    metrics_df = archive_metrics(archive, cells=cells)
+    metrics_df = metrics_df[metrics_df["last"]]
+    noise_df = metrics_df.pivot_table(index="cell_name", columns="sweep_type", values=["long_rms", "short_rms"], aggfunc="last")
+    noise_cols = [(window, sweep_type) for sweep_type in sweep_types for window in ("long_rms", "short_rms")]
+    noise_df = noise_df.reindex(columns=noise_cols).dropna()
+    noise_df.columns = [f"{sweep_type}_{window}" for window, sweep_type in noise_cols]
+    return noise_df.reset_index()
@@ -0,0 +1,156 @@
+"""
+-----------------------------------------------------------------------
+File name: backfill_functions.py
+Maintainer: Ramkumar Rajanbabu
+-----------------------------------------------------------------------
+Developer: Ramkumar Rajanbabu
+Date/time created: 10/17/2026
+Description: Date chunks, resumable checkpoints and memory checks for
+multi-year backfills
+-----------------------------------------------------------------------
+"""
+
+
+#-----Imports-----#
+# General imports
+import os
+import sys
+import time
+from datetime import timedelta
+
+
+checkpoint_schema = """CREATE TABLE IF NOT EXISTS backfill_chunks (
+    job TEXT NOT NULL,
+    start_date TEXT NOT NULL,
+    end_date TEXT NOT NULL,
+    cells INTEGER,
+    written INTEGER,
+    finished REAL,
+    PRIMARY KEY (job, start_date, end_date)
+)"""
+
+
+# Functions
+def date_chunks(start_date, end_date, chunk_days=30):
+    """
+    Splits a date range into consecutive chunks, oldest first.
+
+    Parameters:
+        start_date (date): the first day.
+        end_date (date): the last day (included).
+        chunk_days (int): the number of days per chunk.
+
+    Returns:
+        chunks (list): (first day, last day) of each chunk.
+    """
+
+    chunks = []
+    chunk_start = start_date
+    while chunk_start <= end_date:
+        chunk_end = min(chunk_start + timedelta(days=chunk_days - 1), end_date)
+        chunks.append((chunk_start, chunk_end))
+        chunk_start = chunk_end + timedelta(days=1)
+    return chunks
+
+
+def current_rss_mb():
+    """
+    Returns the resident memory of this process (MB), or None where it can't be read.
+    """
+
+    if sys.platform.startswith("linux"):
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024**2
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+
+        class ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                        ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                        ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        handle = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(handle, ctypes.byref(counters), counters.cb):
+            return counters.WorkingSetSize / 1024**2
+        return None
+    try:
+        import resource
+    except ImportError:
+        return None
+    # Peak rather than current, but the best there is (KB on most platforms, bytes on macOS)
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / 1024**2 if sys.platform == "darwin" else max_rss / 1024
+
+
+def with_rss(worker, *task):
+    """
+    Runs worker(*task) and returns its result with the resident memory of the process
+    it ran in, so a parent can see how much its worker processes hold
+    (ex. run_cells(functools.partial(with_rss, worker), tasks, isolate=True)).
+
+    Returns:
+        result, rss_mb (float): what the worker returned, and current_rss_mb() after it.
+    """
+
+    result = worker(*task)
+    return result, current_rss_mb()
+
+
+def process_seconds():
+    """
+    Returns the seconds since this process started (interpreter start up and
+    imports included), or None where it can't be read.
+    """
+
+    if sys.platform.startswith("linux"):
+        with open("/proc/self/stat") as f:
+            # The fields after the command name; the 20th is the start time (clock ticks since boot)
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+
+        creation, exit_time, kernel_time, user_time = (wintypes.FILETIME() for _ in range(4))
+        handle = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.kernel32.GetProcessTimes(handle, ctypes.byref(creation), ctypes.byref(exit_time),
+                                                   ctypes.byref(kernel_time), ctypes.byref(user_time)):
+            # 100 ns intervals since 1601
+            created = ((creation.dwHighDateTime << 32) + creation.dwLowDateTime) / 1e7 - 11644473600
+            return time.time() - created
+    return None
+
+
+def open_checkpoints(conn):
+    """
+    Creates the backfill checkpoint table in a metrics store if needed.
+    """
+
+    conn.execute(checkpoint_schema)
+    conn.commit()
+
+
+def finished_chunks(conn, job):
+    """
+    Returns the (start_date, end_date) iso strings of every finished chunk of a job.
+    """
+
+    return {(start, end) for start, end in conn.execute(
+        "SELECT start_date, end_date FROM backfill_chunks WHERE job = ? AND finished IS NOT NULL", (job,))}
+
+
+def mark_chunk_finished(conn, job, chunk, cells, written):
+    """
+    Records that every cell of a chunk has been through the job, so a resumed run skips it.
+    """
+
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO backfill_chunks VALUES (?, ?, ?, ?, ?, ?)",
+                     (job, chunk[0].isoformat(), chunk[1].isoformat(), cells, written, time.time()))
@@ -0,0 +1,231 @@
+"""
+-----------------------------------------------------------------------
+File name: cache_functions.py
+Maintainer: Ramkumar Rajanbabu
+-----------------------------------------------------------------------
+Developer: Ramkumar Rajanbabu
+Date/time created: 10/17/2026
+Description: Local cache of per-cell metrics keyed on the NWB file and
+metric version
+-----------------------------------------------------------------------
+"""
+
+
+#-----Imports-----#
+# General imports
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+# Directories
+default_cache_dir = os.path.join(os.path.expanduser("~"), ".ephys-noise-analysis", "metric_cache.sqlite")
+
+cache_schema = """CREATE TABLE IF NOT EXISTS metric_cache (
+    cache_key TEXT PRIMARY KEY,
+    nwb_path TEXT NOT NULL,
+    file_size INTEGER,
+    mtime REAL,
+    content_hash TEXT,
+    metrics_version TEXT,
+    value TEXT,
+    nbytes INTEGER,
+    last_used REAL
+)"""
+
+# Running entry and byte counts, so a put doesn't count the whole cache
+totals_schema = """CREATE TABLE IF NOT EXISTS metric_cache_totals (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    entries INTEGER NOT NULL,
+    nbytes INTEGER NOT NULL
+)"""
+
+# Eviction limits (least recently used entries go first)
+max_cache_entries = 200000
+max_cache_bytes = 2 * 1024**3
+evict_to = 0.9 # Fraction of each limit an eviction goes down to, so a full cache isn't evicted again on every put
+last_used_batch = 100 # Cache hits whose last_used is written in one transaction
+
+# Open cache connections (one per cache file per thread, since sqlite connections can't be shared across threads)
+_cache_conns = {}
+# Connection -> {cache_key: time} of the hits whose last_used isn't written yet
+_pending_use = {}
+
+
+# Functions
+def open_metric_cache(cache_path=default_cache_dir):
+    """
+    Opens (and creates if needed) the metric cache.
+
+    Parameters:
+        cache_path (string): a string specifying the sqlite file.
+
+    Returns:
+        conn (sqlite3.Connection): an open connection to the cache.
+    """
+
+    conn_key = (cache_path, threading.get_ident())
+    if conn_key not in _cache_conns:
+        if cache_path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+        # Worker processes share the file, so wait on locks instead of failing
+        conn = sqlite3.connect(cache_path, timeout=60)
+        if cache_path != ":memory:":
+            conn.execute("PRAGMA journal_mode=WAL")
+        # Under the write lock, so the totals of a cache made before they were kept are counted once
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(cache_schema)
+        conn.execute(totals_schema)
+        conn.execute("CREATE INDEX IF NOT EXISTS metric_cache_path ON metric_cache (nwb_path)")
+        conn.execute("CREATE INDEX IF NOT EXISTS metric_cache_last_used ON metric_cache (last_used)")
+        conn.execute("INSERT OR IGNORE INTO metric_cache_totals SELECT 0, COUNT(*), COALESCE(SUM(nbytes), 0) FROM metric_cache")
+        conn.commit()
+        _cache_conns[conn_key] = conn
+    return _cache_conns[conn_key]
+
+
+def _content_hash(nwb_path, chunk_size=1024**2):
+    """
+    Returns the sha256 of a file (this reads the whole file).
+    """
+
+    digest = hashlib.sha256()
+    with open(nwb_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def metric_cache_key(nwb_path, metrics_version, hash_content=False):
+    """
+    Builds the cache key of an NWB file: its path, size and mtime (or, with
+    hash_content, its sha256) plus the version of the metric code.
+
+    Parameters:
+        nwb_path (string): a string specifying the NWB file path.
+        metrics_version (string): the version of the code that computes the metrics.
+        hash_content (bool): key on the file contents instead of its mtime (reads the whole file).
+
+    Returns:
+        key (dict): the cache key and the file details it was built from (None if the
+            file can't be read).
+    """
+
+    try:
+        stat = os.stat(nwb_path)
+        content_hash = _content_hash(nwb_path) if hash_content else None
+    except OSError:
+        return None
+
+    file_id = content_hash if hash_content else stat.st_mtime
+    cache_key = hashlib.sha1("|".join(map(str, (nwb_path, stat.st_size, file_id, metrics_version))).encode("utf-8")).hexdigest()
+    return {"cache_key": cache_key, "nwb_path": nwb_path, "file_size": stat.st_size, "mtime": stat.st_mtime,
+            "content_hash": content_hash, "metrics_version": str(metrics_version)}
+
+
+def get_cached_metrics(conn, key):
+    """
+    Returns the cached metrics for a key (None on a miss) and marks the entry as used.
+    The marks are written last_used_batch at a time (or with the next put), so a hit
+    doesn't wait on the write lock the other workers hold.
+    """
+
+    if key is None:
+        return None
+    row = conn.execute("SELECT value FROM metric_cache WHERE cache_key = ?", (key["cache_key"],)).fetchone()
+    if row is None:
+        return None
+    pending = _pending_use.setdefault(conn, {})
+    pending[key["cache_key"]] = time.time()
+    if len(pending) >= last_used_batch:
+        with conn:
+            _write_pending_use(conn)
+    return json.loads(row[0])
+
+
+def _write_pending_use(conn):
+    """
+    Writes the last_used marks of the hits so far, in the caller's transaction.
+    """
+
+    pending = _pending_use.pop(conn, None)
+    if pending:
+        conn.executemany("UPDATE metric_cache SET last_used = ? WHERE cache_key = ?",
+                         [(last_used, cache_key) for cache_key, last_used in pending.items()])
+
+
+def has_cached_metrics(conn, key):
+    """
+    Returns True if the key is cached (without marking the entry as used).
+    """
+
+    if key is None:
+        return False
+    return conn.execute("SELECT 1 FROM metric_cache WHERE cache_key = ?", (key["cache_key"],)).fetchone() is not None
+
+
+def put_cached_metrics(conn, key, value, max_entries=max_cache_entries, max_bytes=max_cache_bytes):
+    """
+    Caches the metrics of a file (anything json can hold). Older entries for the same
+    path are dropped, since the file or the metric code has changed since.
+
+    Parameters:
+        conn (sqlite3.Connection): an open connection to the cache.
+        key (dict): the output of metric_cache_key.
+        value: the metrics to cache.
+        max_entries (int): the most entries to keep.
+        max_bytes (int): the most bytes of cached values to keep.
+    """
+
+    if key is None:
+        return
+    value = json.dumps(value)
+    with conn:
+        # The write lock first, so the totals see the same rows as the delete
+        conn.execute("BEGIN IMMEDIATE")
+        _write_pending_use(conn)
+        # Every entry of the path goes (the same key is written again below)
+        removed_entries, removed_bytes = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(nbytes), 0) FROM metric_cache WHERE nwb_path = ?", (key["nwb_path"],)).fetchone()
+        conn.execute("DELETE FROM metric_cache WHERE nwb_path = ?", (key["nwb_path"],))
+        conn.execute(
+            "INSERT INTO metric_cache VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (key["cache_key"], key["nwb_path"], key["file_size"], key["mtime"], key["content_hash"],
+             key["metrics_version"], value, len(value), time.time()))
+        conn.execute("UPDATE metric_cache_totals SET entries = entries + ?, nbytes = nbytes + ?",
+                     (1 - removed_entries, len(value) - removed_bytes))
+        num_entries, num_bytes = conn.execute("SELECT entries, nbytes FROM metric_cache_totals").fetchone()
+    if num_entries > max_entries or num_bytes > max_bytes:
+        evict_metric_cache(conn, max_entries, max_bytes)
+
+
+def evict_metric_cache(conn, max_entries=max_cache_entries, max_bytes=max_cache_bytes):
+    """
+    If the cache is over either limit, drops the least recently used entries until
+    it is within evict_to of both.
+
+    Returns:
+        count (int): the number of entries dropped.
+    """
+
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        _write_pending_use(conn)
+        num_entries, num_bytes = conn.execute("SELECT entries, nbytes FROM metric_cache_totals").fetchone()
+        if num_entries <= max_entries and num_bytes <= max_bytes:
+            return 0
+
+        target_entries, target_bytes = int(max_entries * evict_to), int(max_bytes * evict_to)
+        drop_keys, drop_bytes = [], 0
+        # Oldest first through the last_used index, reading only the entries that go
+        for cache_key, nbytes in conn.execute("SELECT cache_key, nbytes FROM metric_cache ORDER BY last_used"):
+            if num_entries - len(drop_keys) <= target_entries and num_bytes - drop_bytes <= target_bytes:
+                break
+            drop_keys.append((cache_key,))
+            drop_bytes += nbytes
+        conn.executemany("DELETE FROM metric_cache WHERE cache_key = ?", drop_keys)
+        conn.execute("UPDATE metric_cache_totals SET entries = entries - ?, nbytes = nbytes - ?", (len(drop_keys), drop_bytes))
+    return len(drop_keys)
@@ -0,0 +1,98 @@
+"""
+-----------------------------------------------------------------------
+File name: collector_functions.py
+Maintainer: Ramkumar Rajanbabu
+-----------------------------------------------------------------------
+Developer: Ramkumar Rajanbabu
+Date/time created: 10/17/2026
+Description: Buffers per-cell metric rows and writes them in batches
+-----------------------------------------------------------------------
+"""
+
+
+#-----Imports-----#
+# General imports
+import pandas as pd
+# File imports
+from functions.aggregate_functions import open_aggregates, rig_field, update_aggregates
+from functions.store_functions import upsert_metrics
+
+
+class MetricsCollector:
+    """
+    Gathers metric rows column by column and writes them to a metrics store in
+    batches. Each batch gets the JEM columns with one merge and is committed on
+    its own, so a crash loses at most the batch being filled (the store is the
+    checkpoint: cells already in it are skipped on the next run).
+
+    Parameters:
+        store_conn (sqlite3.Connection): an open metrics store.
+        table (string): a string specifying the store table.
+        row_cols (list): the columns of each added row (ex. sweep_cols).
+        out_cols (list): the columns written to the store (ex. noise_cols).
+        jem_df (DataFrame): the JEM metadata, merged on cell_name = jem-id_cell_specimen.
+        batch_size (int): the number of rows buffered before they are written.
+        aggregate_cols (list): columns whose per rig, per day aggregates are updated
+            with each batch (optional, see update_aggregates).
+        key (string): the store key (a list of columns for a table with several rows per cell).
+    """
+
+    def __init__(self, store_conn, table, row_cols, out_cols, jem_df, batch_size=50, aggregate_cols=None, key="cell_name"):
+        self.store_conn = store_conn
+        self.table = table
+        self.row_cols = list(row_cols)
+        self.out_cols = list(out_cols)
+        # Only the JEM columns that end up in the store are kept for the merge
+        jem_cols = ["jem-id_cell_specimen"] + [col for col in self.out_cols if col in jem_df.columns and col not in self.row_cols]
+        self.aggregate_cols = list(aggregate_cols or [])
+        if self.aggregate_cols:
+            # The aggregates are keyed on rig and day
+            jem_cols += [col for col in (rig_field, "date_patch") if col in jem_df.columns and col not in jem_cols]
+            open_aggregates(store_conn)
+        self.jem_df = jem_df[jem_cols].drop_duplicates(subset=["jem-id_cell_specimen"])
+        self.batch_size = batch_size
+        self.key = key
+        self.buffer = {col: [] for col in self.row_cols}
+        self.num_written = 0
+
+    def __len__(self):
+        return len(self.buffer[self.row_cols[0]])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Keep whatever finished before an error or Ctrl+C
+        self.flush()
+        return False
+
+    def add(self, row):
+        """
+        Adds one row (values in row_cols order), writing the batch once it is full.
+        """
+
+        for col, value in zip(self.row_cols, row):
+            self.buffer[col].append(value)
+        if len(self) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Merges the buffered rows with the JEM columns and writes them to the store.
+
+        Returns:
+            count (int): the number of rows written.
+        """
+
+        if not len(self):
+            return 0
+        batch_df = pd.DataFrame(self.buffer, columns=self.row_cols)
+        df = pd.merge(left=batch_df, right=self.jem_df, how="left", left_on="cell_name", right_on="jem-id_cell_specimen")
+        with self.store_conn:
+            # Same transaction as the rows, so the aggregates always match the store
+            if self.aggregate_cols:
+                update_aggregates(self.store_conn, self.table, self.aggregate_cols, df)
+            count = upsert_metrics(self.store_conn, self.table, self.out_cols, df[self.out_cols].itertuples(index=False, name=None), key=self.key)
+        self.buffer = {col: [] for col in self.row_cols}
+        self.num_written += count
+        return count
@@ -0,0 +1,160 @@
+"""
+-----------------------------------------------------------------------
+File name: experiment_functions.py
+Maintainer: Ramkumar Rajanbabu
+-----------------------------------------------------------------------
+Developer: Ramkumar Rajanbabu
+Date/time created: 10/17/2026
+Description: Per-sweep experiment details as typed parquet partitioned
+by patch date
+-----------------------------------------------------------------------
+"""
+
+
+#-----Imports-----#
+# General imports
+import glob
+import os
+import pandas as pd
+import time
+import uuid
+# File imports
+from functions.general_functions import close_dataset, find_cell_nwb, make_dataset
+from functions.runlog_functions import failure, timed
+
+
+# Columns and their stored types (categoricals are dictionary encoded in parquet)
+experiment_dtypes = {
+    "cell_name": "category",
+    "sweep_number": "uint16",
+    "stimulus_units": "category",
+    "bridge_balance_mohm": "float32",
+    "leak_pa": "float32",
+    "stimulus_scale_factor": "float32",
+    "stimulus_code": "category",
+    "stimulus_code_ext": "category",
+    "clamp_mode": "category",
+    "stimulus_name": "category",
+}
+experiment_cols = list(experiment_dtypes)
+partition_col = "date" # Hive style partitions (<out_dir>/date=YYYY-MM-DD/)
+
+
+# Functions
+def typed_experiment_details(df):
+    """
+    Returns the experiment detail columns with their stored types.
+    """
+
+    df = df[experiment_cols].copy()
+    for col, dtype in experiment_dtypes.items():
+        if dtype == "category":
+            df[col] = df[col].astype("string").astype("category")
+        else:
+            df[col] = pd.to_numeric(df[col], errors="coerce").astype(dtype)
+    return df
+
+
+def extract_sweep_details(cell_name, path, nwb_index_path=None):
+    """
+    Reads the ipfx sweep table of one cell.
+
+    Parameters:
+        cell_name (string): a string specifying the cell name.
+        path (string): a string specifying the storage directory (None if not in LIMS).
+        nwb_index_path (string): a string specifying the NWB index (None to always walk the directory).
+
+    Returns:
+        sweep_df (DataFrame): experiment_cols, one row per sweep (None if the file can't be found or read).
+    """
+
+    nwb2_filepath = find_cell_nwb(cell_name, path, nwb_index_path)
+    if not nwb2_filepath:
+        return None
+    dataset = make_dataset(cell_name, nwb2_filepath)
+    if dataset is None:
+        return None
+    try:
+        sweep_df = dataset.sweep_table.copy()
+    finally:
+        close_dataset(dataset)
+    sweep_df["cell_name"] = cell_name
+    missing = [col for col in experiment_cols if col not in sweep_df.columns]
+    if missing:
+        failure(cell_name, "sweep_table_columns", ", ".join(missing))
+        return None
+    return sweep_df[experiment_cols]
+
+
+def write_experiment_partitions(details_df, dates, out_dir):
+    """
+    Writes a batch of sweep rows to one new parquet file per patch date, so earlier
+    files are never rewritten. Each batch gets its own file name (uuid4), and each
+    file is written under a temporary name that readers skip ("_" prefix) and then
+    renamed, so a reader never sees half a file.
+
+    Parameters:
+        details_df (DataFrame): experiment_cols rows (ex. several cells concatenated).
+        dates (Series): the patch date (YYYY-MM-DD) of each row.
+        out_dir (string): a string specifying the dataset directory.
+
+    Returns:
+        paths (list): the files written.
+    """
+
+    details_df = typed_experiment_details(details_df)
+    paths = []
+    part_name = "part-{}-{}.parquet".format(time.strftime("%Y%m%d%H%M%S"), uuid.uuid4().hex)
+    for day, day_df in details_df.groupby(dates.to_numpy(), sort=True):
+        partition_dir = os.path.join(out_dir, f"{partition_col}={day}")
+        os.makedirs(partition_dir, exist_ok=True)
+        path = os.path.join(partition_dir, part_name)
+        tmp_path = os.path.join(partition_dir, "_" + part_name + ".tmp")
+        with timed("parquet_write", rows=len(day_df)) as info:
+            try:
+                # Unused categories would be stored in each file's dictionary
+                day_df = day_df.assign(cell_name=day_df["cell_name"].cat.remove_unused_categories())
+                day_df.to_parquet(tmp_path, engine="pyarrow", index=False, compression="zstd")
+                os.replace(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            info["bytes"] = os.path.getsize(path)
+        paths.append(path)
+    return paths
+
+
+def stored_experiment_cells(out_dir):
+    """
+    Returns the set of cells already in the dataset (only the cell_name column is read).
+    """
+
+    if not glob.glob(os.path.join(out_dir, f"{partition_col}=*", "*.parquet")):
+        return set()
+    return set(pd.read_parquet(out_dir, engine="pyarrow", columns=["cell_name"])["cell_name"].astype(str))
+
+
+def read_experiment_details(out_dir, stimulus_codes=None, start_date=None, end_date=None, columns=None):
+    """
+    Reads the experiment details, filtered in the parquet reader (only the matching
+    partitions and row groups are read).
+
+    Parameters:
+        out_dir (string): a string specifying the dataset directory.
+        stimulus_codes (list): keep these stimulus codes only (optional).
+        start_date (date): the first patch date (optional).
+        end_date (date): the last patch date (optional).
+        columns (list): the columns to read (default: all, plus the date).
+
+    Returns:
+        details_df (DataFrame): the matching sweeps.
+    """
+
+    filters = []
+    if stimulus_codes:
+        filters.append(("stimulus_code", "in", list(stimulus_codes)))
+    if start_date is not None:
+        filters.append((partition_col, ">=", start_date.strftime("%Y-%m-%d")))
+    if end_date is not None:
+        filters.append((partition_col, "<=", end_date.strftime("%Y-%m-%d")))
+    return pd.read_parquet(out_dir, engine="pyarrow", columns=columns, filters=filters or None)
@@ -0,0 +1,217 @@
+"""
+-----------------------------------------------------------------------
+File name: fixture_functions.py
+Maintainer: Ramkumar Rajanbabu
+-----------------------------------------------------------------------
+Developer: Ramkumar Rajanbabu
+Date/time created: 10/17/2026
+Description: Synthetic NWB v2 files and a local LIMS stand-in for
+benchmarking without the share or limsdb2
+-----------------------------------------------------------------------
+"""
+
+
+#-----Imports-----#
+# General imports
+import h5py
+import numpy as np
+import os
+import shutil
+import sqlite3
+# File imports
+from functions.power_functions import last_nb_layer, power_60hz_key
+
+
+# Stimulus codes of the 3 voltage sweeps (newest stimulus set)
+vs_stimulus_codes = ["EXTPINBATH180424", "EXTPCllATT180424", "EXTPBREAKN180424"]
+# Stimulus code of every other sweep
+cc_stimulus_code = "X1PS_SubThresh"
+
+
+# Functions
+def _command_waveform(num_samples, rate, test_pulse, stim_onset, vs_sweep, first_sample=None):
+    """
+    Returns a command waveform: a test pulse, then a baseline, then a step at stim_onset
+    (first_sample sets the first sample, ex. a DA that starts off its holding level).
+    """
+
+    waveform = np.zeros(num_samples, dtype=np.float32)
+    tp_start, tp_end = int(test_pulse[0] * rate), int(test_pulse[1] * rate)
+    waveform[tp_start:tp_end] = -5.0 if vs_sweep else -20.0
+    waveform[int(stim_onset * rate):] = 10.0 if vs_sweep else 50.0
+    if first_sample is not None:
+        waveform[0] = first_sample
+    return waveform
+
+
+def write_synthetic_nwb(nwb_path, sweep_count=10, rate=50000.0, sweep_duration=1.0, noise_pa=(2.0, 4.0, 8.0),
+                        test_pulse=(0.005, 0.015), stim_onset=0.5, power_60hz_rows=4, results_cols=12, seed=0,
+                        first_sample=None):
+    """
+    Writes a small NWB v2 file with the layout the noise scripts read: an
+    acquisition and a stimulus series per sweep (sweep_number, stimulus_description
+    and neurodata_type attributes), and MIES textualResultsKeys/Values tables with
+    a power60HzRatio column.
+
+    The first three sweeps are the inbath, cellatt and breakin voltage sweeps with
+    gaussian noise of noise_pa[0], noise_pa[1] and noise_pa[2] pA. The rest are current clamp.
+
+    Parameters:
+        nwb_path (string): a string specifying the file to write.
+        sweep_count (int): the number of sweeps (at least 3).
+        rate (float): the sampling rate (Hz).
+        sweep_duration (float): the length of each sweep (s).
+        noise_pa (tuple): the noise of the 3 voltage sweeps (pA).
+        test_pulse (tuple): the start and end of the test pulse (s).
+        stim_onset (float): the start of the stimulus step (s).
+        power_60hz_rows (int): the number of power60HzRatio results.
+        results_cols (int): the number of textualResults columns.
+        seed (int): the random seed of the noise.
+        first_sample (float): the first sample of every command waveform (None for the holding level).
+    """
+
+    rng = np.random.default_rng(seed)
+    num_samples = int(sweep_duration * rate)
+    with h5py.File(nwb_path, "w") as h5file:
+        h5file.attrs["nwb_version"] = "2.2.4"
+        h5file.attrs["neurodata_type"] = "NWBFile"
+        acquisition = h5file.create_group("acquisition")
+        presentation = h5file.create_group("stimulus/presentation")
+
+        for sweep_number in range(sweep_count):
+            vs_sweep = sweep_number < len(vs_stimulus_codes)
+            code = vs_stimulus_codes[sweep_number] if vs_sweep else cc_stimulus_code
+            description = f"{code}_DA_0"
+
+            response = acquisition.create_group(f"data_{sweep_number:05d}_AD0")
+            response.attrs["sweep_number"] = np.uint64(sweep_number)
+            response.attrs["stimulus_description"] = description
+            response.attrs["neurodata_type"] = "VoltageClampSeries" if vs_sweep else "CurrentClampSeries"
+            # Stored in pA with a conversion to A, like MIES
+            scale = noise_pa[sweep_number] if vs_sweep else 1.0
+            data = response.create_dataset("data", data=rng.normal(0.0, scale, num_samples).astype(np.float32))
+            data.attrs["conversion"] = 1e-12
+            response.create_dataset("starting_time", data=0.0).attrs["rate"] = rate
+
+            stimulus = presentation.create_group(f"data_{sweep_number:05d}_DA0")
+            stimulus.attrs["sweep_number"] = np.uint64(sweep_number)
+            stimulus.attrs["stimulus_description"] = description
+            stimulus.attrs["neurodata_type"] = "VoltageClampStimulusSeries" if vs_sweep else "CurrentClampStimulusSeries"
+            stimulus.create_dataset("data", data=_command_waveform(num_samples, rate, test_pulse, stim_onset, vs_sweep,
+                                                                            first_sample))
+            stimulus.create_dataset("starting_time", data=0.0).attrs["rate"] = rate
+
+        # Keys: name/unit/tolerance rows; values: one row per result, 9 layers (last one is INDEP_HEADSTAGE)
+        string_dtype = h5py.string_dtype()
+        keys = np.full((3, results_cols), "", dtype=object)
+        keys[0] = [f"Sweep Formula store [result{col}]" for col in range(results_cols)]
+        keys[0, results_cols // 2] = power_60hz_key
+        values = np.full((2 * power_60hz_rows, results_cols, last_nb_layer + 1), "", dtype=object)
+        for row in range(power_60hz_rows):
+            values[2 * row, results_cols // 2, last_nb_layer] = f"{rng.uniform(0.0, 1.0):.6f};"
+        results = h5file.create_group("general/results")
+        results.create_dataset("textualResultsKeys", data=keys, dtype=string_dtype)
+        results.create_dataset("textualResultsValues", data=values, dtype=string_dtype)
+
+
+def reference_noise_row(cell_name, nwb_path):
+    """
+    Calculates the noise row of a synthetic file the slow, plain way: whole sweeps
+    are read, the epochs follow ipfx (get_test_epoch skips a change at the first
+    sample, get_stim_epoch drops the first two changes) and each window goes through
+    np.std like calculate_std_vs. It shares no code with rms_functions, so it checks
+    the h5py kernel on files ipfx can't open.
+
+    Parameters:
+        cell_name (string): a string specifying the cell name.
+        nwb_path (string): a string specifying a file from write_synthetic_nwb.
+
+    Returns:
+        row (tuple): cell_name followed by the long/short rms of the inbath, cellatt and
+            breakin sweeps (None if a sweep has no test pulse and stimulus).
+    """
+
+    row = [cell_name]
+    with h5py.File(nwb_path, "r") as h5file:
+        for sweep_number in range(len(vs_stimulus_codes)):
+            response = h5file[f"acquisition/data_{sweep_number:05d}_AD0"]
+            rate = float(response["starting_time"].attrs["rate"])
+            current = response["data"][()].astype(np.float64) * float(response["data"].attrs["conversion"]) * 1e12
+            changes = np.flatnonzero(np.diff(h5file[f"stimulus/presentation/data_{sweep_number:05d}_DA0/data"][()]))
+            if len(changes) < 3:
+                return None
+            test_changes = changes[1:] if changes[0] == 0 else changes
+            test_end = test_changes[1] + test_changes[0] + 1
+            bl_end = changes[2] + 1
+            bl_short_start = int(((bl_end / rate) - 0.0015) * rate)
+            for window in (current[int(test_end + rate * 0.015):bl_end], current[bl_short_start:bl_end]):
+                # np.std of an empty window is nan (with a warning)
+                row.append(np.std(window).round(3) if len(window) else np.nan)
+    return tuple(float(value) if i else value for i, value in enumerate(row))
+
+
+def build_fixture_tree(root, num_cells, unique_files=10, **nwb_kwargs):
+    """
+    Builds num_cells storage directories under root, each with one NWB v2 file.
+    Only unique_files files are written; the other directories get hard links to
+    them (or copies where links aren't supported), so 10k cells don't take 10k
+    files of disk space.
+
+    Parameters:
+        root (string): a string specifying the fixture directory.
+        num_cells (int): the number of cells.
+        unique_files (int): the number of distinct files written.
+        nwb_kwargs: passed to write_synthetic_nwb.
+
+    Returns:
+        cell_dirs (dict): cell name -> storage directory (with a trailing separator, like LIMS).
+    """
+
+    source_dir = os.path.join(root, "source")
+    os.makedirs(source_dir, exist_ok=True)
+    sources = []
+    for i in range(min(unique_files, num_cells)):
+        source_path = os.path.join(source_dir, f"synthetic_{i:03d}.nwb")
+        if not os.path.exists(source_path):
+            write_synthetic_nwb(source_path, seed=i, **nwb_kwargs)
+        sources.append(source_path)
+
+    cell_dirs = {}
+    for i in range(num_cells):
+        cell_name = f"Synthetic-Cre;Ai14-{i:06d}.01.01.01"
+        cell_dir = os.path.join(os.path.abspath(root), "cells", f"{i:06d}") + os.sep
+        nwb_path = os.path.join(cell_dir, f"{i:06d}.nwb")
+        if not os.path.exists(nwb_path):
+            os.makedirs(cell_dir, exist_ok=True)
+            try:
+                os.link(sources[i % len(sources)], nwb_path)
+            except OSError:
+                shutil.copyfile(sources[i % len(sources)], nwb_path)
+        cell_dirs[cell_name] = cell_dir
+    return cell_dirs
+
+
+def make_lims_stand_in(db_path, cell_dirs):
+    """
+    Writes a sqlite database with the LIMS tables that cell_path_query reads, so
+    generate_cell_paths(cells, conn=sqlite3.connect(db_path)) runs without limsdb2.
+
+    Parameters:
+        db_path (string): a string specifying the sqlite file.
+        cell_dirs (dict): cell name -> storage directory.
+    """
+
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    conn = sqlite3.connect(db_path)
+    try:
+        with conn:
+            conn.execute("CREATE TABLE specimens (id INTEGER PRIMARY KEY, name TEXT, ephys_roi_result_id INTEGER)")
+            conn.execute("CREATE TABLE ephys_roi_results (id INTEGER PRIMARY KEY, storage_directory TEXT)")
+            conn.execute("CREATE INDEX specimens_name ON specimens (name)")
+            # LIMS paths start with one "/" and generate_cell_paths adds the other
+            conn.executemany("INSERT INTO ephys_roi_results VALUES (?, ?)",
+                             ((i, cell_dir[1:] if cell_dir.startswith("/") else cell_dir) for i, cell_dir in enumerate(cell_dirs.values())))
+            conn.executemany("INSERT INTO specimens VALUES (?, ?, ?)", ((i, cell_name, i) for i, cell_name in enumerate(cell_dirs)))
+    finally:
+        conn.close()
@@ -0,0 +1,285 @@
+"""
+-----------------------------------------------------------------------
+File name: general_functions.py
+Maintainer: Ramkumar Rajanbabu
+-----------------------------------------------------------------------
+Developer: Ramkumar Rajanbabu
+Date/time created: 10/17/2026
+Description: NWB helpers shared by the generate_* scripts
+-----------------------------------------------------------------------
+"""
+
+
+#-----Imports-----#
+# General imports
+import importlib.util
+import numpy as np
+import os
+import sys
+# File imports
+from functions.nwb_functions import get_nwb_major_version
+from functions.runlog_functions import count, failure, timed
+
+
+# Functions
+def probe_nwb_v2(path, keep_open=False):
+    """
+    Finds the NWB v2 file in a cell's storage directory, and says whether the
+    directory could be listed and every .nwb file in it opened.
+
+    Parameters:
+        path (string): a string specifying the storage directory.
+        keep_open (bool): leave the NWB v2 file open for the NwbFile that reads it next
+            (see get_nwb_major_version).
+
+    Returns:
+        nwb2_file (string): a string specifying the NWB v2 file path (None if not found).
+        complete (bool): False if a listing or version probe raised OSError (ex. a share
+            hiccup), so a None nwb2_file doesn't mean the cell has no NWB v2 file.
+    """
+
+    nwb2_file = None
+    errors = []
+    for root, dirs, files in os.walk(path, onerror=errors.append):
+        for fil in files:
+            if fil.endswith(".nwb"):
+                test_nwb_name = os.path.join(path, fil)
+                try:
+                    # Root metadata only (ipfx's get_nwb_version opens with the default cache)
+                    nwb_version = get_nwb_major_version(test_nwb_name, keep_open=keep_open)
+                    if nwb_version == 2:
+                        nwb2_file = path + fil
+                except OSError as e:
+                    errors.append(e)
+        break
+    return nwb2_file, not errors
+
+
+def find_nwb_v2(path, keep_open=False):
+    """
+    Finds the NWB v2 file in a cell's storage directory.
+
+    Parameters:
+        path (string): a string specifying the storage directory.
+        keep_open (bool): leave the file open for the NwbFile that reads it next.
+
+    Returns:
+        nwb2_file (string): a string specifying the NWB v2 file path (None if not found).
+    """
+
+    return probe_nwb_v2(path, keep_open)[0]
+
+
+def close_dataset(dataset):
+    """
+    Closes the NWB file behind an ipfx dataset now, instead of whenever the garbage
+    collector gets to it (pynwb containers hold reference cycles).
+    """
+
+    nwb = getattr(getattr(dataset, "_data", None), "nwb", None)
+    read_io = getattr(nwb, "read_io", None)
+    if read_io is not None:
+        try:
+            read_io.close()
+        except (OSError, ValueError):
+            pass
+
+
+def require_ipfx():
+    """
+    Checks that ipfx is installed, without importing it, before a run hands cells to
+    a worker that needs it. A missing package then stops the run instead of failing
+    (and backing off) every cell.
+    """
+
+    if "ipfx" not in sys.modules and importlib.util.find_spec("ipfx") is None:
+        raise ModuleNotFoundError("ipfx isn't installed (the h5py kernel doesn't need it: --kernel h5py)", name="ipfx")
+
+
+def _create_ephys_data_set():
+    """
+    Returns ipfx's create_ephys_data_set, importing ipfx the first time. ipfx pulls
+    in pynwb, hdmf and scipy, so it is only loaded once a cell needs a dataset: a
+    run with nothing to do, or one using the h5py kernels, never pays for it.
+    """
+
+    if "ipfx.dataset.create" not in sys.modules:
+        with timed("import_ipfx"):
+            import ipfx.dataset.create
+    return sys.modules["ipfx.dataset.create"].create_ephys_data_set
+
+
+def make_dataset(cellname, nwb_path):
+    """
+    Creates an ipfx dataset from an NWB file.
+
+    Parameters:
+        cellname (string): a string specifying the cell name.
+        nwb_path (string): a string specifying the NWB file path.
+
+    Returns:
+        dataset (EphysDataSet): an ipfx dataset (None if it can't be made).
+    """
+
+    create_ephys_data_set = _create_ephys_data_set()
+    with timed("make_dataset", cellname) as info:
+        try:
+            dataset = create_ephys_data_set(nwb_file=nwb_path)
+        except (ValueError, OSError, TypeError) as e:
+            print("can't make dataset for ", cellname)
+            info["error"] = type(e).__name__
+            failure(cellname, "make_dataset", repr(e))
+            dataset = None
+
+    return dataset
+
+
+# Use the 3 voltage sweep names and use startswith (column=stimulus_code)
+vs_inbath_stim_names = ["EXTPINBATH141203", "EXTPINBATH180424"]
+vs_cellatt_stim_names = ["EXTPCllATT141203", "EXTPCllATT180424"]
+vs_breakin_stim_names = ["EXTPBREAKN141203", "EXTPBREAKN180424"]
+vs_stim_names = [vs_inbath_stim_names, vs_cellatt_stim_names, vs_breakin_stim_names]
+
+
+def calculate_std_vs(dataset, vs_swp_num_lst):
+    """
+    Calculates the long and short baseline rms of the last voltage clamp sweep.
+
+    Parameters:
+        dataset (EphysDataSet): an ipfx dataset.
+        vs_swp_num_lst (list): a list of sweep numbers.
+
+    Returns:
+        long_rms, short_rms (float): the rounded rms values (None if not in voltage clamp).
+    """
+
+    try:
+        # -1 calls the last sweep in the list
+        sweepnum = vs_swp_num_lst[-1]
+        # Create a sweep table dataframe
+        swp_df = dataset.sweep_table
+        # Select row with the specified sweepnum
+        swp_row_df = swp_df.loc[swp_df["sweep_number"] == sweepnum]
+        # Runs only if the sweep is in voltage clamp
+        if "VoltageClamp" in list(swp_row_df['clamp_mode']):
+            with timed("dataset_sweep", sweep=int(sweepnum)) as info:
+                sweep = dataset.sweep(sweepnum)
+                info["bytes"] = sweep.i.nbytes + sweep.v.nbytes
+            epochs = sweep.epochs
+            samp_rate = sweep.sampling_rate
+
+            test_epoch = epochs["test"]
+            stim_epoch = epochs["stim"]
+
+            bl_short_duration = 0.0015 # 1.5 ms short baseline duration
+            bl_end = int(stim_epoch[0]) # same baseline end can be used for both long and short baselines
+            bl_short_start = int(((bl_end / samp_rate) - bl_short_duration) * samp_rate)
+
+            with timed("rms", sweep=int(sweepnum)):
+                # Old method works for older stim sets
+                buffer2 = samp_rate * 0.015
+                bl_long = sweep.i[(int(test_epoch[1]+buffer2)):stim_epoch[0]]
+                long_rms = np.std(bl_long).round(3)
+
+                # New method that works for old and new stim sets
+                bl_short = sweep.i[bl_short_start : bl_end]
+                short_rms = np.std(bl_short).round(3)
+
+            return long_rms, short_rms
+
+    except (NameError, TypeError, AttributeError, IndexError) as e:
+        print("NameError")
+        return None
+
+
+def find_cell_nwb(cell_name, path, nwb_index_path=None, keep_open=False):
+    """
+    Finds a cell's NWB v2 file, through the NWB index if one is given.
+
+    Parameters:
+        cell_name (string): a string specifying the cell name.
+        path (string): a string specifying the storage directory (None if not in LIMS).
+        nwb_index_path (string): a string specifying the NWB index (None to always walk the directory).
+        keep_open (bool): if the directory is probed, leave the file open for the NwbFile
+            that reads it next, so it is opened once.
+
+    Returns:
+        nwb2_filepath (string): a string specifying the NWB v2 file path (None if not found).
+    """
+
+    if not path:
+        failure(cell_name, "no_storage_directory")
+        return None
+    with timed("find_nwb_v2", cell_name) as info:
+        if nwb_index_path:
+            # Imported here since index_functions imports from this module
+            from functions.index_functions import find_nwb_v2_indexed
+            nwb2_filepath = find_nwb_v2_indexed(cell_name, path, nwb_index_path, keep_open)
+        else:
+            nwb2_filepath = find_nwb_v2(path, keep_open)
+        info["found"] = nwb2_filepath is not None
+    if not nwb2_filepath:
+        failure(cell_name, "no_nwb_v2")
+    # Terminal print statements
+    print(f"Cell name: {cell_name}")
+    print(f"File path: {nwb2_filepath}")
+    return nwb2_filepath
+
+
+def noise_from_nwb(cell_name, nwb2_filepath):
+    """
+    Calculates a cell's noise row from its NWB v2 file with ipfx.
+
+    Parameters:
+        cell_name (string): a string specifying the cell name.
+        nwb2_filepath (string): a string specifying the NWB v2 file path.
+
+    Returns:
+        row (tuple): cell_name followed by the long/short rms of the inbath, cellatt and
+            breakin sweeps (None if the cell is missing a voltage sweep).
+    """
+
+    dataset = make_dataset(cell_name, nwb2_filepath)
+    if dataset is None:
+        return None
+
+    try:
+        # Returns the sweep number (column=sweep_number)
+        try:
+            vs_sweep_nums = [dataset.get_sweep_numbers(stimuli=stim_names) for stim_names in vs_stim_names]
+        except (IndexError) as e:
+            print(f"{cell_name} does not contain a voltage sweep.")
+            failure(cell_name, "no_voltage_sweep")
+            return None
+
+        row = [cell_name]
+        for sweep_nums in vs_sweep_nums:
+            rms = calculate_std_vs(dataset, sweep_nums)
+            if rms is None:
+                failure(cell_name, "no_voltage_sweep")
+                return None
+            row.extend(float(value) for value in rms)
+        return tuple(row)
+    finally:
+        close_dataset(dataset)
+
+
+def extract_cell_noise(cell_name, path, nwb_index_path=None):
+    """
+    Extracts the noise metrics of one cell. Everything the cell needs is opened
+    here, so it can run in a worker process without sharing state.
+
+    Parameters:
+        cell_name (string): a string specifying the cell name.
+        path (string): a string specifying the storage directory (None if not in LIMS).
+        nwb_index_path (string): a string specifying the NWB index (None to always walk the directory).
+
+    Returns:
+        row (tuple): cell_name followed by the long/short rms of the inbath, cellatt and
+            breakin sweeps (None if the cell is missing a voltage sweep).
+    """
+
+    nwb2_filepath = find_cell_nwb(cell_name, path, nwb_index_path)
+    if not nwb2_filepath:
+        return None
+    return noise_from_nwb(cell_name, nwb2_filepath)
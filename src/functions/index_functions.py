@@ -0,0 +1,175 @@
+"""
+-----------------------------------------------------------------------
+File name: index_functions.py
+Maintainer: Ramkumar Rajanbabu
+-----------------------------------------------------------------------
+Developer: Ramkumar Rajanbabu
+Date/time created: 10/17/2026
+Description: Local sqlite index of each cell's NWB v2 file
+-----------------------------------------------------------------------
+"""
+
+
+#-----Imports-----#
+# General imports
+import os
+import sqlite3
+import threading
+# File imports
+from functions.general_functions import probe_nwb_v2
+from functions.runlog_functions import count
+
+
+# Directories
+default_index_dir = os.path.join(os.path.expanduser("~"), ".ephys-noise-analysis", "nwb_index.sqlite")
+
+index_schema = """CREATE TABLE IF NOT EXISTS nwb_index (
+    cell_name TEXT PRIMARY KEY,
+    storage_directory TEXT NOT NULL,
+    dir_mtime REAL,
+    nwb_path TEXT,
+    nwb_major INTEGER,
+    file_size INTEGER,
+    mtime REAL
+)"""
+
+# Open index connections (one per index file per thread, since sqlite connections can't be shared across threads)
+_index_conns = {}
+
+
+# Functions
+def open_nwb_index(index_path=default_index_dir):
+    """
+    Opens (and creates if needed) the NWB index.
+
+    Parameters:
+        index_path (string): a string specifying the sqlite file.
+
+    Returns:
+        conn (sqlite3.Connection): an open connection to the index.
+    """
+
+    conn_key = (index_path, threading.get_ident())
+    if conn_key not in _index_conns:
+        if index_path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
+        # Worker processes share the file, so wait on locks instead of failing
+        conn = sqlite3.connect(index_path, timeout=60)
+        if index_path != ":memory:":
+            conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(index_schema)
+        conn.commit()
+        _index_conns[conn_key] = conn
+    return _index_conns[conn_key]
+
+
+def stat_path(path):
+    """
+    Returns (size, mtime) of a path, or (None, None) if it can't be read.
+    """
+
+    try:
+        stat = os.stat(path)
+    except (OSError, TypeError):
+        return None, None
+    return stat.st_size, stat.st_mtime
+
+
+def _indexed_nwb(conn, cell_name, path, dir_mtime):
+    """
+    Reads a cell's index entry, without changing the index. The entry is current if
+    it is for this storage directory, the directory hasn't changed since it was
+    probed, and the indexed file (if any) has the same size and mtime.
+
+    Returns:
+        known (bool): True if the entry is current.
+        nwb2_file (string): the indexed NWB v2 file path (None if there is none, or not known).
+    """
+
+    row = conn.execute(
+        "SELECT storage_directory, dir_mtime, nwb_path, file_size, mtime FROM nwb_index WHERE cell_name = ?",
+        (cell_name,)).fetchone()
+    if row is None:
+        return False, None
+    storage_directory, indexed_dir_mtime, nwb_path, file_size, mtime = row
+    if storage_directory != path or indexed_dir_mtime != dir_mtime:
+        return False, None
+    if nwb_path is None:
+        return True, None
+    if stat_path(nwb_path) == (file_size, mtime):
+        return True, nwb_path
+    return False, None
+
+
+def peek_nwb_index(cell_name, path, index_path=default_index_dir):
+    """
+    Looks a cell up in the index without walking its directory or opening any NWB
+    file (only the directory and file are stat'ed), and without updating the index.
+
+    Returns:
+        known (bool): True if the entry is current.
+        nwb2_file (string): the indexed NWB v2 file path (None if there is none, or not known).
+    """
+
+    dir_size, dir_mtime = stat_path(path)
+    if dir_mtime is None:
+        return False, None
+    return _indexed_nwb(open_nwb_index(index_path), cell_name, path, dir_mtime)
+
+
+def indexed_file_sizes(index_path=default_index_dir):
+    """
+    Returns the size of every indexed NWB v2 file, without stat'ing anything.
+
+    Returns:
+        sizes (dict): cell name -> file size (bytes).
+    """
+
+    if index_path != ":memory:" and not os.path.exists(index_path):
+        return {}
+    return dict(open_nwb_index(index_path).execute("SELECT cell_name, file_size FROM nwb_index WHERE file_size IS NOT NULL"))
+
+
+def find_nwb_v2_indexed(cell_name, path, index_path=default_index_dir, keep_open=False):
+    """
+    Finds the NWB v2 file in a cell's storage directory, using the index when the
+    directory and file haven't changed since they were last probed. Only a changed
+    (or new) entry costs a directory walk and NWB version checks.
+
+    Parameters:
+        cell_name (string): a string specifying the cell name.
+        path (string): a string specifying the storage directory.
+        index_path (string): a string specifying the sqlite file.
+        keep_open (bool): if the directory is probed, leave the file open for the NwbFile
+            that reads it next (see get_nwb_major_version).
+
+    Returns:
+        nwb2_file (string): a string specifying the NWB v2 file path (None if not found).
+    """
+
+    conn = open_nwb_index(index_path)
+    dir_size, dir_mtime = stat_path(path)
+    if dir_mtime is None:
+        # Storage directory is missing or unreachable, so there is nothing to index
+        return None
+
+    known, nwb_path = _indexed_nwb(conn, cell_name, path, dir_mtime)
+    if known:
+        count("nwb_index_hit", cell_name)
+        return nwb_path
+
+    count("nwb_index_miss", cell_name)
+    nwb_path, complete = probe_nwb_v2(path, keep_open)
+    if nwb_path is None and not complete:
+        # A listing or probe failed (ex. a share hiccup): probe again next time instead
+        # of keeping "no NWB v2" until the directory changes
+        count("nwb_probe_error", cell_name)
+        return None
+    file_size, mtime = stat_path(nwb_path)
+    nwb_major = 2 if nwb_path else None
+    conn.execute(
+        "INSERT OR REPLACE INTO nwb_index VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (cell_name, path, dir_mtime, nwb_path, nwb_major, file_size, mtime))
+    conn.commit()
+
+    return nwb_path
@@ -0,0 +1,194 @@
+"""
+-----------------------------------------------------------------------
+File name: jem_functions.py
+Maintainer: Ramkumar Rajanbabu
+-----------------------------------------------------------------------
+Developer: Ramkumar Rajanbabu
+Date/time created: 10/17/2026
+Description: Filtered JEM metadata from a local snapshot of the csv
+-----------------------------------------------------------------------
+"""
+
+
+#-----Imports-----#
+# General imports
+import os
+import pandas as pd
+import sqlite3
+from datetime import timedelta
+
+
+# Directories
+snapshot_root = os.path.join(os.path.expanduser("~"), ".ephys-noise-analysis")
+
+# Settings
+rig_field = "jem-id_rig_number" # JEM column --rig filters on
+
+# Lists
+jem_fields = ["jem-date_patch", "jem-date_patch_y", "jem-date_patch_m", "jem-date_patch_d", "jem-id_cell_specimen", "jem-id_patched_cell_container", "jem-status_success_failure"]
+
+
+# Functions
+def _quote(name):
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+def default_snapshot_path(source_path):
+    """
+    Returns the local snapshot file of a metadata csv (ex. jem_lims_metadata.sqlite).
+    """
+
+    return os.path.join(snapshot_root, os.path.splitext(os.path.basename(source_path))[0] + ".sqlite")
+
+
+def parse_patch_dates(date_patch):
+    """
+    Parses the jem-date_patch column (ex. "10/20/2022 14:33:00 -0700") to datetimes.
+    The date part is parsed with a fixed format; anything else falls back to pandas.
+    """
+
+    date_patch = date_patch.astype("string")
+    dates = pd.to_datetime(date_patch.str[:10], format="%m/%d/%Y", errors="coerce")
+    missing = dates.isna() & date_patch.notna()
+    if missing.any():
+        dates[missing] = pd.to_datetime(date_patch[missing], errors="coerce")
+    return dates
+
+
+def _snapshot_is_current(conn, source_info, fields):
+    """
+    Returns True if the snapshot was taken from the csv as it is now (same size and
+    mtime) and has every field.
+    """
+
+    snapshot_info = conn.execute("SELECT * FROM snapshot_info").fetchone()
+    return bool(snapshot_info) and snapshot_info[:3] == source_info[:3] and set(fields) <= set(snapshot_info[3].split(","))
+
+
+def refresh_jem_snapshot(source_path, snapshot_path=None, fields=jem_fields):
+    """
+    Rebuilds the local snapshot of a metadata csv if the csv has changed (size or
+    mtime) since the snapshot was taken, or is missing one of the fields. Only the
+    given fields are read.
+
+    Parameters:
+        source_path (string): a string specifying the metadata csv.
+        snapshot_path (string): a string specifying the sqlite snapshot (default: next to the other local files).
+        fields (list): the columns to keep.
+
+    Returns:
+        refreshed (bool): True if the csv was read again.
+    """
+
+    snapshot_path = snapshot_path or default_snapshot_path(source_path)
+    os.makedirs(os.path.dirname(os.path.abspath(snapshot_path)), exist_ok=True)
+    conn = sqlite3.connect(snapshot_path, timeout=60)
+    try:
+        conn.execute("CREATE TABLE IF NOT EXISTS snapshot_info (source_path TEXT, file_size INTEGER, mtime REAL, fields TEXT)")
+        try:
+            stat = os.stat(source_path)
+        except OSError as e:
+            if conn.execute("SELECT 1 FROM snapshot_info").fetchone():
+                print(f"can't reach {source_path} ({e!r}), using the last snapshot.")
+                return False
+            raise
+
+        source_info = (source_path, stat.st_size, stat.st_mtime, ",".join(fields))
+        if _snapshot_is_current(conn, source_info, fields):
+            return False
+
+        jem_df = pd.read_csv(source_path, usecols=lambda col: col in fields, low_memory=False)
+        missing = [field for field in fields if field not in jem_df.columns]
+        if missing:
+            print(f"{source_path} has no {', '.join(missing)} column, left empty.")
+            for field in missing:
+                jem_df[field] = None
+        # Sortable ISO dates so date ranges can be filtered in the query
+        jem_df["date_patch"] = parse_patch_dates(jem_df["jem-date_patch"]).dt.strftime("%Y-%m-%d %H:%M:%S")
+        # The table is rebuilt in one transaction (to_sql commits after creating it, so a
+        # reader could find it empty), under the write lock taken before looking again:
+        # of several shards started together one rebuilds the snapshot, the others use it
+        jem_df = jem_df.rename_axis("row_num").reset_index()
+        rows = [tuple(None if pd.isna(value) else value.item() if hasattr(value, "item") else value for value in row)
+                for row in jem_df.itertuples(index=False, name=None)]
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if _snapshot_is_current(conn, source_info, fields):
+                conn.rollback()
+                return False
+            conn.execute("DROP TABLE IF EXISTS jem")
+            conn.execute(pd.io.sql.get_schema(jem_df, "jem", con=conn))
+            conn.executemany("INSERT INTO jem VALUES ({})".format(", ".join("?" * len(jem_df.columns))), rows)
+            conn.execute("CREATE INDEX jem_date_patch ON jem (date_patch)")
+            conn.execute("DELETE FROM snapshot_info")
+            conn.execute("INSERT INTO snapshot_info VALUES (?, ?, ?, ?)", source_info)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return True
+    finally:
+        conn.close()
+
+
+def load_jem_metadata(source_path, snapshot_path=None, year=None, start_date=None, end_date=None, status="SUCCESS", fields=jem_fields, cells=None,
+                      rigs=None):
+    """
+    Loads the JEM rows of the experiments to process: one row per cell, filtered
+    in the snapshot query, sorted by patch date.
+
+    Parameters:
+        source_path (string): a string specifying the metadata csv.
+        snapshot_path (string): a string specifying the sqlite snapshot (default: next to the other local files).
+        year (int): keep this jem-date_patch_y only (optional).
+        start_date (date): keep patch dates on or after this day (optional).
+        end_date (date): keep patch dates on or before this day (optional).
+        status (string): keep this jem-status_success_failure only (None for all).
+        fields (list): the columns to keep.
+        cells (list): keep these jem-id_cell_specimen only (optional).
+        rigs (list): keep these jem-id_rig_number only (optional).
+
+    Returns:
+        jem_df (DataFrame): the filtered metadata, with the parsed dates in "date_patch".
+    """
+
+    snapshot_path = snapshot_path or default_snapshot_path(source_path)
+    # The rig column is kept in the snapshot whenever a rig is filtered on
+    refresh_jem_snapshot(source_path, snapshot_path, fields + [rig_field] if rigs and rig_field not in fields else fields)
+
+    where = []
+    params = []
+    if status is not None:
+        where.append('"jem-status_success_failure" = ?')
+        params.append(status)
+    if year is not None:
+        where.append('"jem-date_patch_y" = ?')
+        params.append(int(year))
+    if start_date is not None:
+        where.append("date_patch >= ?")
+        params.append(start_date.strftime("%Y-%m-%d"))
+    if end_date is not None:
+        where.append("date_patch < ?")
+        params.append((end_date + timedelta(days=1)).strftime("%Y-%m-%d"))
+    if rigs:
+        # Text, so it matches rig numbers stored as numbers (the column's affinity applies) or as text
+        where.append("{} IN ({})".format(_quote(rig_field), ", ".join("?" * len(rigs))))
+        params.extend(str(rig) for rig in rigs)
+
+    query = "SELECT {}, date_patch FROM jem{} ORDER BY row_num".format(
+        ", ".join(_quote(field) for field in fields), " WHERE " + " AND ".join(where) if where else "")
+    conn = sqlite3.connect(snapshot_path, timeout=60)
+    try:
+        jem_df = pd.read_sql_query(query, conn, params=params)
+    finally:
+        conn.close()
+
+    # Clean column of duplicates and NAs
+    jem_df.drop_duplicates(subset=["jem-id_cell_specimen"], inplace=True)
+    jem_df.dropna(subset=["jem-id_cell_specimen"], inplace=True)
+    if cells is not None:
+        jem_df = jem_df[jem_df["jem-id_cell_specimen"].isin(set(cells))].copy()
+    # Sort values by date
+    jem_df["date_patch"] = pd.to_datetime(jem_df["date_patch"])
+    jem_df.sort_values(by=["date_patch"], ascending=True, inplace=True, kind="stable")
+    return jem_df.reset_index(drop=True)
@@ -0,0 +1,206 @@
+"""
+-----------------------------------------------------------------------
+File name: ledger_functions.py
+Maintainer: Ramkumar Rajanbabu
+-----------------------------------------------------------------------
+Developer: Ramkumar Rajanbabu
+Date/time created: 10/17/2026
+Description: Failure ledger: why each cell failed, how often, and when it
+is worth retrying (exponential backoff)
+-----------------------------------------------------------------------
+"""
+
+
+#-----Imports-----#
+# General imports
+import os
+import pandas as pd
+import sqlite3
+import time
+# File imports
+from functions.runlog_functions import failure_reasons
+
+
+# Directories
+default_ledger_dir = os.path.join(os.path.expanduser("~"), ".ephys-noise-analysis", "failure_ledger.sqlite")
+
+# Settings
+retry_base_days = 1 # Wait after the first failure; doubled after each further failure
+max_backoff_days = 32 # Longest wait between retries
+max_attempts = 6 # Failures after which a cell is skipped for good (until it is reset)
+
+ledger_schema = """CREATE TABLE IF NOT EXISTS failure_ledger (
+    job TEXT NOT NULL,
+    cell_name TEXT NOT NULL,
+    reason TEXT,
+    detail TEXT,
+    attempts INTEGER,
+    first_failed REAL,
+    last_failed REAL,
+    retry_after REAL,
+    PRIMARY KEY (job, cell_name)
+)"""
+
+
+# Functions
+def open_failure_ledger(ledger_path=default_ledger_dir):
+    """
+    Opens (and creates if needed) the failure ledger.
+
+    Parameters:
+        ledger_path (string): a string specifying the sqlite file.
+
+    Returns:
+        conn (sqlite3.Connection): an open connection to the ledger.
+    """
+
+    if ledger_path != ":memory:":
+        os.makedirs(os.path.dirname(os.path.abspath(ledger_path)), exist_ok=True)
+    conn = sqlite3.connect(ledger_path, timeout=60)
+    conn.execute(ledger_schema)
+    conn.commit()
+    return conn
+
+
+def retry_delay(attempts):
+    """
+    Returns the seconds to wait before retrying a cell that has failed attempts
+    times (None once it is skipped for good).
+    """
+
+    if attempts >= max_attempts:
+        return None
+    return min(retry_base_days * 2 ** (attempts - 1), max_backoff_days) * 86400
+
+
+def skipped_cells(conn, job, now=None):
+    """
+    Returns the cells of a job that aren't due for a retry yet (or never will be).
+
+    Returns:
+        skipped (dict): cell name -> reason.
+    """
+
+    now = time.time() if now is None else now
+    return dict(conn.execute(
+        "SELECT cell_name, reason FROM failure_ledger WHERE job = ? AND (retry_after IS NULL OR retry_after > ?)", (job, now)))
+
+
+def failed_cell_names(conn, job):
+    """
+    Returns the set of cells of a job that are in the ledger.
+    """
+
+    return {row[0] for row in conn.execute("SELECT cell_name FROM failure_ledger WHERE job = ?", (job,))}
+
+
+def due_cells(conn, job, cell_list):
+    """
+    Drops the cells that aren't due for a retry yet, so known-bad files aren't
+    looked up and opened again every run.
+
+    Returns:
+        due (list): the cells of cell_list to try, in order.
+    """
+
+    skipped = skipped_cells(conn, job)
+    due = [cell_name for cell_name in cell_list if cell_name not in skipped]
+    if len(due) < len(cell_list):
+        print(f"{len(cell_list) - len(due)} cells failed before and aren't due for a retry yet.")
+    return due
+
+
+def pending_cells(conn, job, cell_list):
+    """
+    Returns the cells of cell_list that failed and will be retried (now or later),
+    leaving out the ones skipped for good.
+
+    Returns:
+        pending (list): the pending cells of cell_list, in order.
+    """
+
+    pending = {row[0] for row in conn.execute("SELECT cell_name FROM failure_ledger WHERE job = ? AND retry_after IS NOT NULL", (job,))}
+    return [cell_name for cell_name in cell_list if cell_name in pending]
+
+
+def record_run_failures(conn, job, attempted, succeeded, reasons=None, log_path=None, now=None):
+    """
+    Updates the ledger after a run: cells that succeeded are cleared, and every
+    other attempted cell gets one more attempt and a later retry date. The reason
+    is the one given in reasons, else the last failure the run logged for the cell
+    ("no_result" if there is neither, ex. no run log was started).
+
+    Parameters:
+        conn (sqlite3.Connection): an open ledger.
+        job (string): the ledger key (ex. the metrics table).
+        attempted (list): the cells the run tried.
+        succeeded (set): the cells whose metrics were written.
+        reasons (dict): cell name -> (reason, detail) (default: read from the run log).
+        log_path (string): the run log to read the reasons from (default: the current run's).
+        now (float): the time of the run (default: now).
+
+    Returns:
+        num_failed (int): the cells recorded as failed.
+    """
+
+    now = time.time() if now is None else now
+    if reasons is None:
+        reasons = failure_reasons(log_path)
+
+    failed = [cell_name for cell_name in attempted if cell_name not in succeeded]
+    with conn:
+        conn.executemany("DELETE FROM failure_ledger WHERE job = ? AND cell_name = ?",
+                         ((job, cell_name) for cell_name in attempted if cell_name in succeeded))
+        for cell_name in failed:
+            reason, detail = reasons.get(cell_name, ("no_result", None))
+            row = conn.execute("SELECT attempts, first_failed FROM failure_ledger WHERE job = ? AND cell_name = ?", (job, cell_name)).fetchone()
+            attempts, first_failed = (row[0] + 1, row[1]) if row else (1, now)
+            delay = retry_delay(attempts)
+            conn.execute("INSERT OR REPLACE INTO failure_ledger VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                         (job, cell_name, reason, detail, attempts, first_failed, now, None if delay is None else now + delay))
+    return len(failed)
+
+
+def reset_failures(conn, job=None, cells=None):
+    """
+    Clears ledger entries (ex. after a file was fixed), so the cells are tried on the next run
+    (every entry of the job if cells is None, none if it is empty).
+
+    Returns:
+        count (int): the number of entries cleared.
+    """
+
+    if cells is not None and not len(cells):
+        return 0
+    where, params = [], []
+    if job:
+        where.append("job = ?")
+        params.append(job)
+    if cells:
+        where.append("cell_name IN ({})".format(", ".join("?" * len(cells))))
+        params += list(cells)
+    with conn:
+        cursor = conn.execute("DELETE FROM failure_ledger" + (" WHERE " + " AND ".join(where) if where else ""), params)
+    return cursor.rowcount
+
+
+def failure_report(conn, job=None, permanent_only=True):
+    """
+    Returns the ledger as a dataframe: the permanently skipped cells, or every entry.
+
+    Returns:
+        report_df (DataFrame): job, cell_name, reason, detail, attempts and the first/last
+            failure and next retry as datetimes (NaT for permanently skipped cells).
+    """
+
+    where, params = [], []
+    if job:
+        where.append("job = ?")
+        params.append(job)
+    if permanent_only:
+        where.append("retry_after IS NULL")
+    query = "SELECT * FROM failure_ledger" + (" WHERE " + " AND ".join(where) if where else "") + " ORDER BY job, reason, cell_name"
+    report_df = pd.read_sql_query(query, conn, params=params)
+    for col in ("first_failed", "last_failed", "retry_after"):
+        report_df[col] = pd.to_datetime(report_df[col], unit="s").dt.floor("s")
+    return report_df
@@ -0,0 +1,126 @@
+"""
+-----------------------------------------------------------------------
+File name: lims_functions.py
+Maintainer: Ramkumar Rajanbabu
+-----------------------------------------------------------------------
+Developer: Ramkumar Rajanbabu
+Date/time created: 10/17/2026
+Description: Batched cell name to storage directory lookups in LIMS
+-----------------------------------------------------------------------
+"""
+
+
+#-----Imports-----#
+# General imports
+import atexit
+import sys
+# File imports
+from functions.runlog_functions import timed
+
+
+# LIMS connection settings
+lims_settings = {"user": "limsreader", "host": "limsdb2", "database": "lims2", "password": "limsro", "port": 5432}
+
+# Storage directory query (name filter is filled in by _name_filter)
+cell_path_query = """SELECT cell.name, err.storage_directory AS path
+FROM specimens cell
+JOIN ephys_roi_results err ON err.id = cell.ephys_roi_result_id
+WHERE cell.name {}
+"""
+
+# Pooled connection shared by every lookup in this process
+_lims_conn = None
+
+
+# Functions
+def get_lims_connection():
+    """
+    Returns the pooled LIMS connection, opening it on first use.
+
+    Returns:
+        conn (pg8000.Connection): an open connection to limsdb2.
+    """
+
+    global _lims_conn
+    if _lims_conn is None:
+        import pg8000
+        _lims_conn = pg8000.connect(**lims_settings)
+    return _lims_conn
+
+
+@atexit.register
+def close_lims_connection():
+    """
+    Closes the pooled LIMS connection (if one is open).
+    """
+
+    global _lims_conn
+    if _lims_conn is not None:
+        try:
+            _lims_conn.close()
+        except Exception:
+            pass
+        _lims_conn = None
+
+
+def _name_filter(conn, names):
+    """
+    Builds the parameterized WHERE clause and its parameters for a batch of
+    cell names, matching the paramstyle of the connection's driver.
+
+    Parameters:
+        conn (DB-API connection): pg8000 for LIMS, sqlite3 for local stand-ins.
+        names (list): a list of cell names.
+
+    Returns:
+        clause (string): the filter to append after "WHERE cell.name".
+        params (tuple): the query parameters.
+    """
+
+    driver = sys.modules.get(type(conn).__module__.split(".")[0])
+    paramstyle = getattr(driver, "paramstyle", "format")
+    if paramstyle == "qmark":
+        # sqlite3 has no arrays, so expand to IN (?, ?, ...)
+        return "IN ({})".format(", ".join("?" * len(names))), tuple(names)
+    return "= ANY(%s)", (list(names),)
+
+
+def generate_cell_paths(cell_list, conn=None, batch_size=500):
+    """
+    Generates file paths for a list of cell names (ex. "Vip-IRES-Cre;Ai14-366688.04.01.01")
+    using a few bulk queries over a single connection.
+
+    Parameters:
+        cell_list (list): a list of strings specifying cell names.
+        conn (DB-API connection): an open connection (default: the pooled LIMS connection).
+        batch_size (int): the number of cell names resolved per query.
+
+    Returns:
+        cell_paths (dict): cell name -> storage directory ('//allen/...'). Cells without
+            a storage directory are left out.
+    """
+
+    if conn is None:
+        conn = get_lims_connection()
+
+    # Drop duplicates and NAs but keep the original order
+    names = list(dict.fromkeys(name for name in cell_list if isinstance(name, str)))
+
+    cell_paths = {}
+    cur = conn.cursor()
+    try:
+        for i in range(0, len(names), batch_size):
+            batch = names[i : i + batch_size]
+            clause, params = _name_filter(conn, batch)
+            with timed("lims_query", cells=len(batch)) as info:
+                cur.execute(cell_path_query.format(clause), params)
+                rows = cur.fetchall()
+                info["rows"] = len(rows)
+            for name, path in rows:
+                if path and name not in cell_paths:
+                    # '/' + '/allen...' = '//allen...'
+                    cell_paths[name] = "/" + path
+    finally:
+        cur.close()
+
+    return cell_paths
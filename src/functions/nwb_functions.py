@@ -0,0 +1,305 @@
+"""
+-----------------------------------------------------------------------
+File name: nwb_functions.py
+Maintainer: Ramkumar Rajanbabu
+-----------------------------------------------------------------------
+Developer: Ramkumar Rajanbabu
+Date/time created: 10/17/2026
+Description: NWB access layer: one h5py open per file with a tuned chunk
+cache (a file found by a version probe is read through the probe's handle),
+sweep table read from that handle, bytes read counted on request
+-----------------------------------------------------------------------
+"""
+
+
+#-----Imports-----#
+# General imports
+import h5py
+import io
+import os
+import re
+import time
+# File imports
+from functions.runlog_functions import log_event
+
+
+# h5py settings (the files are read once, front to back, over SMB)
+rdcc_nbytes = 32 * 1024**2 # Chunk cache per dataset (h5py's default is 1 MB)
+rdcc_nslots = 10007 # Chunk cache hash slots (a prime ~100x the chunks that fit in the cache)
+rdcc_w0 = 1.0 # Evict fully read chunks first, since nothing is read twice
+page_buf_size = 4 * 1024**2 # Page buffer, so metadata comes in a few large reads instead of many small ones
+
+count_bytes = False # Count the bytes read per file (every read then goes through Python, so it is slower)
+
+# Page buffering needs HDF5 1.10.1+; switched off for the rest of the run if a file can't be opened with it
+_page_buffering = True
+
+# The NWB v2 file the last kept version probe found, (path, h5py.File), left open for the NwbFile that reads it next
+_probed = None
+
+# NWB neurodata types -> ipfx clamp modes
+clamp_modes = {"VoltageClampSeries": "VoltageClamp", "CurrentClampSeries": "CurrentClamp", "IZeroClampSeries": "CurrentClamp"}
+
+
+# Functions
+def _attr_str(value):
+    """
+    Returns an HDF5 attribute as a string (h5py gives bytes for some files).
+    """
+
+    if isinstance(value, bytes):
+        return value.decode("utf-8")
+    return str(value)
+
+
+def _stimulus_code(description):
+    """
+    Strips the MIES suffixes from a stimulus description, the way ipfx builds its
+    stimulus_code column (ex. "EXTPINBATH180424_DA_0[2]" -> "EXTPINBATH180424").
+    """
+
+    code = _attr_str(description).split("[")[0]
+    return re.sub(r"_DA_\d+$", "", code)
+
+
+class CountingReader(io.RawIOBase):
+    """
+    Read-only file that counts the bytes and reads that go through it, for
+    h5py's fileobj driver (used when count_bytes is on).
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        self._file = open(path, "rb", buffering=0)
+        self.bytes_read = 0
+        self.reads = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        num_bytes = self._file.readinto(buffer)
+        self.bytes_read += num_bytes or 0
+        self.reads += 1
+        return num_bytes
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self._file.seek(offset, whence)
+
+    def tell(self):
+        return self._file.tell()
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+
+def open_h5(file, **kwargs):
+    """
+    Opens an HDF5 file read-only with the tuned chunk cache and page buffer.
+
+    Parameters:
+        file: a path or a file object (ex. a CountingReader).
+        kwargs: passed to h5py.File (ex. rdcc_nbytes=0 for a metadata-only probe).
+
+    Returns:
+        h5file (h5py.File): the open file.
+    """
+
+    global _page_buffering
+    settings = {"rdcc_nbytes": rdcc_nbytes, "rdcc_nslots": rdcc_nslots, "rdcc_w0": rdcc_w0}
+    settings.update(kwargs)
+    if _page_buffering and page_buf_size:
+        try:
+            return h5py.File(file, "r", page_buf_size=page_buf_size, **settings)
+        except (OSError, TypeError, ValueError):
+            if hasattr(file, "seek"):
+                file.seek(0)
+            h5file = h5py.File(file, "r", **settings)
+            # It opens without: older HDF5 (or h5py) can't page buffer a file that wasn't written with paged aggregation
+            _page_buffering = False
+            return h5file
+    return h5py.File(file, "r", **settings)
+
+
+def read_nwb_version(h5file):
+    """
+    Reads the NWB version from an open file (same result as ipfx's get_nwb_version).
+
+    Returns:
+        version (dict): "major" (1, 2 or None) and "full" (the version string).
+    """
+
+    if "nwb_version" in h5file:
+        # NWB v1: a dataset
+        value = h5file["nwb_version"][()]
+        value = _attr_str(value.flat[0] if hasattr(value, "flat") else value)
+        if re.match("^NWB-1", value):
+            return {"major": 1, "full": value}
+    elif "nwb_version" in h5file.attrs:
+        # NWB v2: a root attribute
+        value = _attr_str(h5file.attrs["nwb_version"])
+        if re.match("^2", value) or re.match("^NWB-2", value):
+            return {"major": 2, "full": value}
+    return {"major": None, "full": None}
+
+
+def get_nwb_major_version(nwb_path, keep_open=False):
+    """
+    Probes an NWB file's major version, reading only the root metadata.
+
+    Parameters:
+        nwb_path (string): a string specifying the NWB file path.
+        keep_open (bool): leave an NWB v2 file open for the NwbFile that reads it next,
+            so the file is opened once (closed by the next probe otherwise).
+
+    Returns:
+        major (int): 1, 2 or None.
+    """
+
+    global _probed
+    release_probed_file()
+    # No chunk cache unless the handle is kept for reading the data
+    h5file = open_h5(nwb_path) if keep_open else open_h5(nwb_path, rdcc_nbytes=0)
+    try:
+        major = read_nwb_version(h5file)["major"]
+    except Exception:
+        h5file.close()
+        raise
+    if keep_open and major == 2:
+        _probed = (nwb_path, h5file)
+    else:
+        h5file.close()
+    return major
+
+
+def take_probed_file(nwb_path):
+    """
+    Returns the h5py handle the last kept version probe left open for nwb_path (None if
+    there isn't one). The caller closes it.
+    """
+
+    global _probed
+    if _probed is None:
+        return None
+    if os.path.normpath(_probed[0]) != os.path.normpath(nwb_path):
+        release_probed_file()
+        return None
+    h5file = _probed[1]
+    _probed = None
+    return h5file
+
+
+def release_probed_file():
+    """
+    Closes the handle the last kept version probe left open, if nothing took it.
+    """
+
+    global _probed
+    if _probed is not None:
+        _probed[1].close()
+        _probed = None
+
+
+def read_sweep_table_h5(h5file):
+    """
+    Reads the sweep table from the series attributes, without loading any data.
+
+    Parameters:
+        h5file (h5py.File): an open NWB v2 file.
+
+    Returns:
+        sweep_table (dict): sweep number -> dict with the "acquisition" and "stimulus"
+            series paths, "stimulus_code" and "clamp_mode".
+    """
+
+    sweep_table = {}
+    for group_name, key in (("acquisition", "acquisition"), ("stimulus/presentation", "stimulus")):
+        if group_name not in h5file:
+            continue
+        for series in h5file[group_name].values():
+            if "sweep_number" not in series.attrs:
+                continue
+            sweep = sweep_table.setdefault(int(series.attrs["sweep_number"]), {})
+            sweep[key] = series.name
+            if "stimulus_description" in series.attrs:
+                sweep.setdefault("stimulus_code", _stimulus_code(series.attrs["stimulus_description"]))
+            if key == "acquisition":
+                sweep["clamp_mode"] = clamp_modes.get(_attr_str(series.attrs.get("neurodata_type", "")))
+
+    return sweep_table
+
+
+def get_sweep_numbers_h5(sweep_table, stimuli):
+    """
+    Returns the sorted sweep numbers whose stimulus code is in stimuli
+    (same as dataset.get_sweep_numbers(stimuli=stimuli)).
+    """
+
+    return sorted(num for num, sweep in sweep_table.items() if sweep.get("stimulus_code") in stimuli)
+
+
+class NwbFile:
+    """
+    One open NWB file: the h5py handle (the version probe's, if it kept the file
+    open) and its sweep table, read once from that handle. The time the file was
+    open (and, with count_bytes, the bytes and reads) is logged as the "nwb_file"
+    stage on close.
+
+    Ex.
+        with NwbFile(nwb_path, cell_name) as nwb:
+            baselines = read_baselines_h5(nwb.h5file, vs_sweep_nums, nwb.sweep_table)
+    """
+
+    def __init__(self, nwb_path, cell_name=None):
+        self.nwb_path = nwb_path
+        self.cell_name = cell_name
+        self.h5file = None
+        self._reader = None
+        self._sweep_table = None
+        self._start = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(error=exc_type.__name__ if exc_type else None)
+
+    def open(self):
+        self._start = time.perf_counter()
+        if not count_bytes:
+            self.h5file = take_probed_file(self.nwb_path)
+            if self.h5file is None:
+                self.h5file = open_h5(self.nwb_path)
+            return
+        # The probe's handle doesn't count, so the file is opened again
+        release_probed_file()
+        self._reader = CountingReader(self.nwb_path)
+        try:
+            self.h5file = open_h5(self._reader)
+        except Exception:
+            self._reader.close()
+            raise
+
+    def close(self, error=None):
+        if self.h5file is None:
+            return
+        self.h5file.close()
+        self.h5file = None
+        fields = {}
+        if self._reader is not None:
+            self._reader.close()
+            fields = {"bytes": self._reader.bytes_read, "reads": self._reader.reads}
+        if error:
+            fields["error"] = error
+        log_event("stage", stage="nwb_file", cell=self.cell_name, seconds=round(time.perf_counter() - self._start, 6), **fields)
+
+    @property
+    def sweep_table(self):
+        if self._sweep_table is None:
+            self._sweep_table = read_sweep_table_h5(self.h5file)
+        return self._sweep_table
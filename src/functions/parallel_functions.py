@@ -0,0 +1,145 @@
+"""
+-----------------------------------------------------------------------
+File name: parallel_functions.py
+Maintainer: Ramkumar Rajanbabu
+-----------------------------------------------------------------------
+Developer: Ramkumar Rajanbabu
+Date/time created: 10/17/2026
+Description: Process pool for running per-cell work with timeouts
+-----------------------------------------------------------------------
+"""
+
+
+#-----Imports-----#
+# General imports
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+# File imports
+from functions.runlog_functions import failure, timed
+
+
+# Functions
+def _run_task(worker, task):
+    """
+    Runs worker(*task), printing and swallowing any error so one bad cell
+    can't take down the run.
+    """
+
+    try:
+        with timed("cell", task[0]):
+            return worker(*task)
+    except Exception as e:
+        print(f"{task[0]} failed: {e!r}")
+        failure(task[0], type(e).__name__, repr(e))
+        return None
+
+
+def _deadline(timeout):
+    if timeout is None:
+        return None
+    return time.monotonic() + timeout
+
+
+def _stop_pool(executor, futures):
+    """
+    Stops a pool without waiting on its running tasks. ProcessPoolExecutor has
+    no public way to stop a running task, so its worker processes are terminated.
+    """
+
+    for future in futures:
+        future.cancel()
+    for process in list((getattr(executor, "_processes", None) or {}).values()):
+        process.terminate()
+    executor.shutdown(wait=False)
+
+
+def run_cells(worker, tasks, workers=1, timeout=None, isolate=False):
+    """
+    Runs worker(*task) for every task and yields the results in task order, so
+    a single writer sees the same sequence as a serial loop.
+
+    Parameters:
+        worker (function): a module-level function (it must be picklable).
+        tasks (list): a list of argument tuples, the first item being the cell name.
+        workers (int): the number of worker processes (1 runs in this process).
+        timeout (float): seconds a task may run before it is given up on (None for no limit).
+        isolate (bool): use worker processes even for 1 worker, so whatever the tasks leave
+            in memory is freed when the pool closes.
+
+    Yields:
+        task (tuple), result: the task and what the worker returned (None on error or timeout).
+    """
+
+    tasks = list(tasks)
+    if workers <= 1 and not isolate:
+        for task in tasks:
+            yield task, _run_task(worker, task)
+        return
+
+    results = {}
+    inflight = {} # task index -> (future, deadline)
+    suspects = [] # task indexes waiting to be retried on their own
+    retried = set()
+    next_submit = 0
+    next_yield = 0
+    workers = max(workers, 1)
+    executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        while next_yield < len(tasks):
+            if suspects:
+                # Rerun tasks from a broken pool on their own to find the one that broke it
+                if not inflight:
+                    index = suspects.pop(0)
+                    inflight[index] = (executor.submit(_run_task, worker, tasks[index]), _deadline(timeout))
+            else:
+                # Keep one task per worker so a deadline starts close to when the task does
+                while next_submit < len(tasks) and len(inflight) < workers:
+                    future = executor.submit(_run_task, worker, tasks[next_submit])
+                    inflight[next_submit] = (future, _deadline(timeout))
+                    next_submit += 1
+
+            deadlines = [deadline for future, deadline in inflight.values() if deadline is not None]
+            wait_time = max(0, min(deadlines) - time.monotonic()) if deadlines else None
+            done, not_done = wait([future for future, deadline in inflight.values()], timeout=wait_time, return_when=FIRST_COMPLETED)
+
+            restart = False
+            for index, (future, deadline) in list(inflight.items()):
+                if future in done:
+                    del inflight[index]
+                    try:
+                        results[index] = future.result()
+                    except Exception as e:
+                        # A worker process died (ex. a crash inside HDF5), which breaks every
+                        # task in the pool, so each one is retried on its own
+                        restart = True
+                        if index in retried:
+                            print(f"{tasks[index][0]} failed: {e!r}")
+                            failure(tasks[index][0], "worker_crash", repr(e))
+                            results[index] = None
+                        else:
+                            retried.add(index)
+                            suspects.append(index)
+                elif deadline is not None and deadline <= time.monotonic():
+                    del inflight[index]
+                    print(f"{tasks[index][0]} timed out after {timeout} seconds.")
+                    failure(tasks[index][0], "timeout")
+                    results[index] = None
+                    restart = True
+
+            if restart:
+                # Replace the pool and resubmit whatever was still running in it
+                _stop_pool(executor, [future for future, deadline in inflight.values()])
+                executor = ProcessPoolExecutor(max_workers=workers)
+                for index in inflight:
+                    future = executor.submit(_run_task, worker, tasks[index])
+                    inflight[index] = (future, _deadline(timeout))
+                suspects.sort()
+
+            while next_yield in results:
+                yield tasks[next_yield], results.pop(next_yield)
+                next_yield += 1
+    finally:
+        if inflight:
+            _stop_pool(executor, [future for future, deadline in inflight.values()])
+        else:
+            executor.shutdown()
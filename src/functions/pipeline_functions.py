@@ -0,0 +1,107 @@
+"""
+-----------------------------------------------------------------------
+File name: pipeline_functions.py
+Maintainer: Ramkumar Rajanbabu
+-----------------------------------------------------------------------
+Developer: Ramkumar Rajanbabu
+Date/time created: 10/17/2026
+Description: Single pass over a cell's NWB file for every metric
+-----------------------------------------------------------------------
+"""
+
+
+#-----Imports-----#
+# General imports
+# File imports
+from functions.cache_functions import get_cached_metrics, metric_cache_key, open_metric_cache, put_cached_metrics
+from functions.general_functions import find_cell_nwb
+from functions.nwb_functions import NwbFile, release_probed_file
+from functions.power_functions import read_power_60hz, read_power_60hz_file
+from functions.rms_functions import calculate_cell_noise_h5, calculate_cell_psd_h5, read_vs_baselines_h5
+from functions.runlog_functions import count, failure
+
+
+# Bump when a change to the metric code should recompute every cached cell
+metrics_version = "2"
+
+
+# Functions
+def extract_cell_metrics(cell_name, path, nwb_index_path=None, cache_path=None):
+    """
+    Opens a cell's NWB v2 file once and extracts the noise row, the noise spectrum
+    row and the power60HzRatio values from that one handle (the rms and the spectra
+    share one read of each baseline). With a metric cache, a file that
+    hasn't changed since it was cached (same size, mtime and metrics_version)
+    isn't opened at all.
+
+    Parameters:
+        cell_name (string): a string specifying the cell name.
+        path (string): a string specifying the storage directory (None if not in LIMS).
+        nwb_index_path (string): a string specifying the NWB index (None to always walk the directory).
+        cache_path (string): a string specifying the metric cache (None to always compute).
+
+    Returns:
+        result (tuple): noise_row, power_60hz_values and psd_row (None if the file can't be found or read).
+            noise_row (tuple): cell_name followed by the six rms values (None if missing a voltage sweep).
+            power_60hz_values (list): every power60HzRatio value in file order (None if there aren't any).
+            psd_row (tuple): cell_name followed by the band powers and broadband rms of each sweep
+                (None if there are no voltage sweeps).
+    """
+
+    nwb2_filepath = find_cell_nwb(cell_name, path, nwb_index_path, keep_open=True)
+    if not nwb2_filepath:
+        return None
+
+    if cache_path:
+        cache_conn = open_metric_cache(cache_path)
+        key = metric_cache_key(nwb2_filepath, metrics_version)
+        cached = get_cached_metrics(cache_conn, key)
+        count("metric_cache_hit" if cached is not None else "metric_cache_miss", cell_name)
+        if cached is not None:
+            release_probed_file()
+            noise_row, power_60hz_values, psd_row = cached
+            return (tuple(noise_row) if noise_row else None), power_60hz_values, (tuple(psd_row) if psd_row else None)
+
+    try:
+        with NwbFile(nwb2_filepath, cell_name) as nwb:
+            baselines = read_vs_baselines_h5(nwb.h5file, nwb.sweep_table)
+            noise_row = calculate_cell_noise_h5(cell_name, nwb.h5file, baselines)
+            psd_row = calculate_cell_psd_h5(cell_name, nwb.h5file, baselines)
+            power_60hz_values = read_power_60hz(nwb.h5file)
+    except (OSError, KeyError, ValueError) as e:
+        print(f"can't read {cell_name}: {e!r}")
+        failure(cell_name, "unreadable_nwb", repr(e))
+        return None
+
+    if power_60hz_values is not None:
+        power_60hz_values = power_60hz_values.tolist()
+    if cache_path:
+        put_cached_metrics(cache_conn, key, [noise_row, power_60hz_values, psd_row])
+    return noise_row, power_60hz_values, psd_row
+
+
+def extract_cell_power_60hz(cell_name, path, nwb_index_path=None):
+    """
+    Reads the last power60HzRatio value of a cell's NWB v2 file.
+
+    Parameters:
+        cell_name (string): a string specifying the cell name.
+        path (string): a string specifying the storage directory (None if not in LIMS).
+        nwb_index_path (string): a string specifying the NWB index (None to always walk the directory).
+
+    Returns:
+        row (tuple): cell_name and the last power60HzRatio value (None if the file has none),
+            or None if the file can't be found or read.
+    """
+
+    nwb2_filepath = find_cell_nwb(cell_name, path, nwb_index_path, keep_open=True)
+    if not nwb2_filepath:
+        return None
+    try:
+        # Every power60HzRatio value in the file, in one read
+        power_60hz_values = read_power_60hz_file(nwb2_filepath, cell_name)
+    except (KeyError, OSError, ValueError) as e:
+        print(f"can't read {nwb2_filepath}: {e!r}")
+        failure(cell_name, "unreadable_nwb", repr(e))
+        return None
+    return cell_name, (float(power_60hz_values[-1]) if power_60hz_values is not None and len(power_60hz_values) else None)
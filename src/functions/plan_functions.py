@@ -0,0 +1,87 @@
+"""
+-----------------------------------------------------------------------
+File name: plan_functions.py
+Maintainer: Ramkumar Rajanbabu
+-----------------------------------------------------------------------
+Developer: Ramkumar Rajanbabu
+Date/time created: 10/17/2026
+Description: Dry-run planner: what a run would do with each cell, worked
+out without opening any NWB file
+-----------------------------------------------------------------------
+"""
+
+
+#-----Imports-----#
+# General imports
+import pandas as pd
+# File imports
+from functions.cache_functions import has_cached_metrics, metric_cache_key, open_metric_cache
+from functions.index_functions import peek_nwb_index
+from functions.lims_functions import generate_cell_paths
+
+
+# Lists
+plan_statuses = ["stored", "cached", "new", "retry", "backing_off", "no_storage_directory", "no_nwb_v2"]
+
+
+# Functions
+def plan_cells(cell_list, done_cells, nwb_index_path=None, cache_path=None, metrics_version=None, failed_cells=None, skipped_cells=None):
+    """
+    Sorts the cells of a run by what would happen to them. Only LIMS, the NWB index
+    and the metric cache are read (plus a stat of each indexed directory and file).
+
+    Parameters:
+        cell_list (list): the cells of the run.
+        done_cells (set): the cells already in the store.
+        nwb_index_path (string): a string specifying the NWB index (None if the run doesn't use one).
+        cache_path (string): a string specifying the metric cache (None if the run doesn't use one).
+        metrics_version (string): the metrics_version the cache is keyed on.
+        failed_cells (set): the cells in the failure ledger (optional).
+        skipped_cells (set): the ledger cells that aren't due for a retry yet (optional).
+
+    Returns:
+        plan_df (DataFrame): cell_name, status (one of plan_statuses) and the indexed nwb_path.
+    """
+
+    failed_cells = failed_cells or set()
+    skipped_cells = skipped_cells or set()
+    new_cells = [cell_name for cell_name in cell_list if cell_name not in done_cells and cell_name not in skipped_cells]
+    cell_paths = generate_cell_paths(new_cells) if new_cells else {}
+    cache_conn = open_metric_cache(cache_path) if cache_path else None
+
+    rows = []
+    for cell_name in cell_list:
+        nwb_path = None
+        if cell_name in done_cells:
+            status = "stored"
+        elif cell_name in skipped_cells:
+            status = "backing_off"
+        elif not cell_paths.get(cell_name):
+            status = "no_storage_directory"
+        else:
+            known = False
+            if nwb_index_path:
+                known, nwb_path = peek_nwb_index(cell_name, cell_paths[cell_name], nwb_index_path)
+            if known and nwb_path is None:
+                status = "no_nwb_v2"
+            elif nwb_path and cache_conn is not None and has_cached_metrics(cache_conn, metric_cache_key(nwb_path, metrics_version)):
+                status = "cached"
+            elif cell_name in failed_cells:
+                status = "retry"
+            else:
+                status = "new"
+        rows.append((cell_name, status, nwb_path))
+    return pd.DataFrame(rows, columns=["cell_name", "status", "nwb_path"])
+
+
+def print_plan(plan_df, job):
+    """
+    Prints how many cells of a planned run are in each status.
+    """
+
+    counts = plan_df["status"].value_counts()
+    print(f"Plan for {job}: {len(plan_df)} cells")
+    for status in plan_statuses:
+        print(f"  {status:<22}{int(counts.get(status, 0))}")
+    to_open = int(counts.get("new", 0) + counts.get("retry", 0))
+    print(f"{to_open} NWB files would be opened.")
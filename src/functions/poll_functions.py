@@ -0,0 +1,178 @@
+"""
+-----------------------------------------------------------------------
+File name: poll_functions.py
+Maintainer: Ramkumar Rajanbabu
+-----------------------------------------------------------------------
+Developer: Ramkumar Rajanbabu
+Date/time created: 10/17/2026
+Description: Change detection for the poller: which cells are new in the
+JEM metadata, or have a new or changed NWB file, since the last poll
+-----------------------------------------------------------------------
+"""
+
+
+#-----Imports-----#
+# General imports
+import os
+import pandas as pd
+import sqlite3
+import time
+from datetime import date, timedelta
+# File imports
+from functions.general_functions import find_nwb_v2
+from functions.index_functions import find_nwb_v2_indexed, stat_path
+from functions.lims_functions import generate_cell_paths
+
+
+# Directories
+default_poll_state_dir = os.path.join(os.path.expanduser("~"), ".ephys-noise-analysis", "poll_state.sqlite")
+
+# Settings
+lookback_days = 30 # Known cells patched this recently have their directory and file checked each poll
+
+poll_schema = ["""CREATE TABLE IF NOT EXISTS poll_marks (
+    job TEXT PRIMARY KEY,
+    jem_size INTEGER,
+    jem_mtime REAL,
+    last_date_patch TEXT,
+    last_poll REAL
+)""", """CREATE TABLE IF NOT EXISTS poll_cells (
+    job TEXT NOT NULL,
+    cell_name TEXT NOT NULL,
+    storage_directory TEXT,
+    dir_mtime REAL,
+    nwb_path TEXT,
+    nwb_size INTEGER,
+    nwb_mtime REAL,
+    done INTEGER,
+    PRIMARY KEY (job, cell_name)
+)"""]
+
+
+# Functions
+def open_poll_state(state_path=default_poll_state_dir):
+    """
+    Opens (and creates if needed) the poll state.
+
+    Returns:
+        conn (sqlite3.Connection): an open connection to the poll state.
+    """
+
+    if state_path != ":memory:":
+        os.makedirs(os.path.dirname(os.path.abspath(state_path)), exist_ok=True)
+    conn = sqlite3.connect(state_path, timeout=60)
+    for schema in poll_schema:
+        conn.execute(schema)
+    conn.commit()
+    return conn
+
+
+def read_poll_mark(conn, job):
+    """
+    Returns the high-water mark of the last poll (None before the first poll).
+
+    Returns:
+        mark (dict): jem_size, jem_mtime, last_date_patch and last_poll.
+    """
+
+    row = conn.execute("SELECT jem_size, jem_mtime, last_date_patch, last_poll FROM poll_marks WHERE job = ?", (job,)).fetchone()
+    return dict(zip(["jem_size", "jem_mtime", "last_date_patch", "last_poll"], row)) if row else None
+
+
+def find_changed_cells(conn, job, jem_df, done_cells, lookback=lookback_days, today=None):
+    """
+    Diffs the JEM metadata and the storage directories against the last poll. Only
+    the candidate cells are looked up and stat'ed (no directory is walked and no
+    NWB file is opened):
+      - cells new in the JEM metadata since the last poll, whatever their patch date
+        (the first poll only takes the cells patched in the last lookback days)
+      - known cells patched in the last lookback days
+
+    A candidate is queued if it isn't processed yet and is new or its storage directory
+    changed (ex. the NWB file was uploaded), or if it is processed and its NWB file
+    changed (re-uploaded). A known cell patched before the lookback is left to the
+    full-year runs.
+
+    Parameters:
+        conn (sqlite3.Connection): an open poll state.
+        job (string): the poller's job name.
+        jem_df (DataFrame): the JEM metadata (jem-id_cell_specimen and date_patch).
+        done_cells (set): the cells already processed (ex. in the store).
+        lookback (int): the days of known cells to check again.
+        today (date): the day of the poll (default: today).
+
+    Returns:
+        queue (list): (cell_name, storage_directory, reason) to process, reason "new", "uploaded" or "changed".
+        polled (dict): cell name -> (storage_directory, dir_mtime) of every candidate, for record_polled_cells.
+    """
+
+    today = today or date.today()
+    window_start = pd.Timestamp(today - timedelta(days=lookback))
+    first_poll = read_poll_mark(conn, job) is None
+    known = {row[0]: row[1:] for row in conn.execute(
+        "SELECT cell_name, storage_directory, dir_mtime, nwb_path, nwb_size, nwb_mtime, done FROM poll_cells WHERE job = ?", (job,))}
+
+    recent = (jem_df["date_patch"] >= window_start).to_numpy()
+    candidates = [cell_name for cell_name, is_recent in zip(jem_df["jem-id_cell_specimen"], recent)
+                  if is_recent or (cell_name not in known and not first_poll)]
+
+    # Directories found on an earlier poll aren't looked up again
+    lookup = [cell_name for cell_name in candidates if not (cell_name in known and known[cell_name][0])]
+    cell_paths = generate_cell_paths(lookup) if lookup else {}
+
+    queue = []
+    polled = {}
+    for cell_name in candidates:
+        record = known.get(cell_name)
+        path = record[0] if record and record[0] else cell_paths.get(cell_name)
+        dir_mtime = stat_path(path)[1] if path else None
+        polled[cell_name] = (path, dir_mtime)
+        if cell_name in done_cells:
+            nwb_path = record[2] if record else None
+            if nwb_path and stat_path(nwb_path) != (record[3], record[4]):
+                queue.append((cell_name, path, "changed"))
+        elif record is None:
+            queue.append((cell_name, path, "new"))
+        elif path and (record[0] != path or record[1] != dir_mtime):
+            queue.append((cell_name, path, "uploaded"))
+    return queue, polled
+
+
+def record_polled_cells(conn, job, jem_path, jem_df, polled, done_cells, index_path=None):
+    """
+    Saves the poll: the directory of every candidate as it was before processing (so
+    a change during the run is seen next time), the NWB file of each processed cell,
+    and the new high-water mark. The first poll also records the older JEM cells, so
+    they aren't taken as new next time.
+
+    Parameters:
+        conn (sqlite3.Connection): an open poll state.
+        job (string): the poller's job name.
+        jem_path (string): a string specifying the JEM csv.
+        jem_df (DataFrame): the JEM metadata of the poll.
+        polled (dict): the output of find_changed_cells.
+        done_cells (set): the cells processed after the run.
+        index_path (string): a string specifying the NWB index (None to probe the directories).
+    """
+
+    rows = []
+    for cell_name, (path, dir_mtime) in polled.items():
+        nwb_path, nwb_size, nwb_mtime = None, None, None
+        done = cell_name in done_cells
+        if done and path:
+            # Probed if the index doesn't have it (ex. processed by a run without the index),
+            # so a processed cell always has its file recorded and a re-upload is seen
+            nwb_path = find_nwb_v2_indexed(cell_name, path, index_path) if index_path else find_nwb_v2(path)
+            nwb_size, nwb_mtime = stat_path(nwb_path)
+        rows.append((job, cell_name, path, dir_mtime, nwb_path, nwb_size, nwb_mtime, int(done)))
+
+    jem_size, jem_mtime = stat_path(jem_path)
+    last_date_patch = jem_df["date_patch"].max()
+    with conn:
+        if read_poll_mark(conn, job) is None:
+            conn.executemany("INSERT OR IGNORE INTO poll_cells (job, cell_name, done) VALUES (?, ?, ?)",
+                             ((job, cell_name, int(cell_name in done_cells)) for cell_name in jem_df["jem-id_cell_specimen"]
+                              if cell_name not in polled))
+        conn.executemany("INSERT OR REPLACE INTO poll_cells VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        conn.execute("INSERT OR REPLACE INTO poll_marks VALUES (?, ?, ?, ?, ?)",
+                     (job, jem_size, jem_mtime, None if pd.isna(last_date_patch) else str(last_date_patch.date()), time.time()))
@@ -0,0 +1,84 @@
+"""
+-----------------------------------------------------------------------
+File name: power_functions.py
+Maintainer: Ramkumar Rajanbabu
+-----------------------------------------------------------------------
+Developer: Ramkumar Rajanbabu
+Date/time created: 10/17/2026
+Description: Reads the MIES power60HzRatio results from NWB v2 files
+-----------------------------------------------------------------------
+"""
+
+
+#-----Imports-----#
+# General imports
+import numpy as np
+# File imports
+from functions.nwb_functions import NwbFile
+
+
+# Sweep Formula result written by MIES, in the INDEP_HEADSTAGE layer
+power_60hz_key = "Sweep Formula store [power60HzRatio]"
+last_nb_layer = 8
+
+
+# Functions
+def _read_str(dataset, selection):
+    """
+    Reads a selection of an HDF5 string dataset as a str array, decoded by h5py in
+    one pass (h5py 3 gives bytes for variable length strings).
+    """
+
+    try:
+        values = dataset.asstr()[selection]
+    except TypeError:
+        # Not a string datatype
+        values = dataset[selection]
+    return np.asarray(values).astype(str)
+
+
+def read_power_60hz(h5file):
+    """
+    Reads every power60HzRatio value of a file with one read of its results column.
+
+    Parameters:
+        h5file (h5py.File): an open NWB v2 file.
+
+    Returns:
+        power_60hz_values (np.ndarray): the values in file order (None if the file has no
+            power60HzRatio results).
+    """
+
+    try:
+        textual_results_keys = h5file["general/results/textualResultsKeys"]
+        textual_results_values = h5file["general/results/textualResultsValues"]
+    except KeyError:
+        return None
+
+    keys = _read_str(textual_results_keys, 0)
+    matches = np.flatnonzero(keys == power_60hz_key)
+    if not len(matches):
+        return None
+    power60idx = int(matches[0])
+
+    # One hyperslab: every row of the power60HzRatio column in the last layer
+    values = _read_str(textual_results_values, np.s_[:, power60idx, last_nb_layer])
+    values = values[np.char.str_len(values) > 0]
+    # Remove the trailing ";" and convert to float
+    return np.char.rstrip(values, ";").astype(float)
+
+
+def read_power_60hz_file(nwb_path, cell_name=None):
+    """
+    Opens an NWB v2 file and reads its power60HzRatio values (see read_power_60hz).
+
+    Parameters:
+        nwb_path (string): a string specifying the NWB file path.
+        cell_name (string): the cell the bytes read are logged under (optional).
+
+    Returns:
+        power_60hz_values (np.ndarray): the values in file order (None if there aren't any).
+    """
+
+    with NwbFile(nwb_path, cell_name) as nwb:
+        return read_power_60hz(nwb.h5file)
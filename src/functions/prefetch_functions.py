@@ -0,0 +1,285 @@
+"""
+-----------------------------------------------------------------------
+File name: prefetch_functions.py
+Maintainer: Ramkumar Rajanbabu
+-----------------------------------------------------------------------
+Developer: Ramkumar Rajanbabu
+Date/time created: 10/17/2026
+Description: Streaming pipeline that resolves, prefetches and computes
+cells at the same time
+-----------------------------------------------------------------------
+"""
+
+
+#-----Imports-----#
+# General imports
+import asyncio
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+# File imports
+from functions.general_functions import find_cell_nwb
+from functions.lims_functions import generate_cell_paths
+from functions.runlog_functions import failure, timed
+
+
+class StageStats:
+    """
+    Counts the work done by one pipeline stage.
+    """
+
+    def __init__(self, name, concurrency):
+        self.name = name
+        self.concurrency = concurrency
+        self.count = 0
+        self.failed = 0
+        self.busy = 0.0
+        self.num_bytes = 0
+
+    def report(self, wall_time):
+        wall_time = max(wall_time, 1e-9)
+        line = "{:<10}{:>8} cells{:>6} failed{:>10.1f} cells/s{:>8.0%} busy".format(
+            self.name, self.count, self.failed, self.count / wall_time, self.busy / (wall_time * self.concurrency))
+        if self.num_bytes:
+            line += "{:>10.1f} MB/s".format(self.num_bytes / wall_time / 1024**2)
+        return line
+
+
+def _fetch_nwb(cell_name, path, nwb_index_path, scratch_dir):
+    """
+    Finds a cell's NWB v2 file and copies it to scratch_dir.
+
+    Returns:
+        local_path (string), num_bytes (int): the local copy and its size (None, 0 if
+            there is no file or it can't be copied).
+    """
+
+    local_path = None
+    try:
+        nwb2_filepath = find_cell_nwb(cell_name, path, nwb_index_path)
+        if not nwb2_filepath:
+            return None, 0
+        local_path = os.path.join(scratch_dir, f"{cell_name}_{os.path.basename(nwb2_filepath)}")
+        with timed("prefetch_copy", cell_name) as info:
+            shutil.copyfile(nwb2_filepath, local_path)
+            info["bytes"] = os.path.getsize(local_path)
+    except Exception as e:
+        print(f"{cell_name} prefetch failed: {e!r}")
+        failure(cell_name, "prefetch", repr(e))
+        if local_path and os.path.exists(local_path):
+            os.remove(local_path)
+        return None, 0
+    return local_path, os.path.getsize(local_path)
+
+
+def _compute_local(compute, cell_name, local_path):
+    """
+    Runs compute on a local copy (in a worker process).
+    """
+
+    try:
+        with timed("cell", cell_name):
+            return compute(cell_name, local_path)
+    except Exception as e:
+        print(f"{cell_name} failed: {e!r}")
+        failure(cell_name, type(e).__name__, repr(e))
+        return None
+
+
+async def _resolve_stage(loop, executor, cells, out_queue, stats, batch_size):
+    """
+    Stage 1: looks up storage directories in bulk LIMS queries, one batch at a time.
+    """
+
+    for i in range(0, len(cells), batch_size):
+        batch = cells[i:i + batch_size]
+        start = time.monotonic()
+        try:
+            cell_paths = await loop.run_in_executor(executor, generate_cell_paths, [cell_name for index, cell_name in batch])
+        except Exception as e:
+            print(f"LIMS lookup failed: {e!r}")
+            cell_paths = {}
+        stats.busy += time.monotonic() - start
+        for index, cell_name in batch:
+            path = cell_paths.get(cell_name)
+            stats.count += 1
+            stats.failed += path is None
+            # Waits here while the prefetch stage is behind
+            await out_queue.put((index, cell_name, path))
+
+
+async def _prefetch_stage(loop, executor, in_queue, out_queue, stats, nwb_index_path, scratch_dir):
+    """
+    Stage 2: copies each cell's NWB file from the share to local scratch.
+    """
+
+    while True:
+        item = await in_queue.get()
+        if item is None:
+            return
+        index, cell_name, path = item
+        local_path, num_bytes = None, 0
+        if path:
+            start = time.monotonic()
+            local_path, num_bytes = await loop.run_in_executor(executor, _fetch_nwb, cell_name, path, nwb_index_path, scratch_dir)
+            stats.busy += time.monotonic() - start
+        else:
+            failure(cell_name, "no_storage_directory")
+        stats.count += 1
+        stats.failed += local_path is None
+        stats.num_bytes += num_bytes
+        # Waits here while the compute stage is behind, which bounds the files in scratch
+        await out_queue.put((index, cell_name, local_path))
+
+
+class ComputePool:
+    """
+    The worker processes of the compute stage. A worker that dies (ex. a crash inside
+    HDF5) breaks every task in the pool, so the pool is replaced and each of those
+    tasks is retried on its own, like run_cells.
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+        self.retry_lock = asyncio.Lock()
+
+    async def run(self, loop, compute, cell_name, local_path):
+        """
+        Computes a local copy in a worker process, then deletes the copy.
+        """
+
+        executor = self.executor
+        try:
+            return await loop.run_in_executor(executor, _compute_local, compute, cell_name, local_path)
+        except BrokenProcessPool:
+            # The first task to see the broken pool replaces it
+            if executor is self.executor:
+                executor.shutdown(wait=False)
+                self.executor = ProcessPoolExecutor(max_workers=self.workers)
+            async with self.retry_lock:
+                retry_executor = ProcessPoolExecutor(max_workers=1)
+                try:
+                    return await loop.run_in_executor(retry_executor, _compute_local, compute, cell_name, local_path)
+                except BrokenProcessPool as e:
+                    print(f"{cell_name} failed: {e!r}")
+                    failure(cell_name, "worker_crash", repr(e))
+                    return None
+                finally:
+                    retry_executor.shutdown(wait=False)
+        finally:
+            os.remove(local_path)
+
+    def shutdown(self):
+        self.executor.shutdown()
+
+
+async def _compute_stage(loop, pool, in_queue, stats, compute, results):
+    """
+    Stage 3: computes the metrics of each local copy as it arrives, in a worker process.
+    """
+
+    while True:
+        item = await in_queue.get()
+        if item is None:
+            return
+        index, cell_name, local_path = item
+        result = None
+        if local_path:
+            start = time.monotonic()
+            result = await pool.run(loop, compute, cell_name, local_path)
+            stats.busy += time.monotonic() - start
+        stats.count += 1
+        stats.failed += result is None
+        results(index, cell_name, result)
+
+
+async def _run_pipeline(cells, compute, on_result, scratch_dir, nwb_index_path, resolve_batch, prefetch_limit, compute_limit, queue_size):
+    loop = asyncio.get_running_loop()
+    resolve_stats = StageStats("resolve", 1)
+    prefetch_stats = StageStats("prefetch", prefetch_limit)
+    compute_stats = StageStats("compute", compute_limit)
+
+    # Bounded queues, so a fast stage waits for a slow one instead of running ahead
+    resolved = asyncio.Queue(maxsize=queue_size)
+    fetched = asyncio.Queue(maxsize=queue_size)
+
+    # Results arrive in completion order and are handed on in cell order
+    pending = {}
+    next_index = [0]
+
+    def results(index, cell_name, result):
+        pending[index] = (cell_name, result)
+        while next_index[0] in pending:
+            on_result(*pending.pop(next_index[0]))
+            next_index[0] += 1
+
+    io_executor = ThreadPoolExecutor(max_workers=prefetch_limit + 1)
+    compute_pool = ComputePool(compute_limit)
+    start = time.monotonic()
+    try:
+        compute_tasks = [asyncio.ensure_future(_compute_stage(loop, compute_pool, fetched, compute_stats, compute, results))
+                         for _ in range(compute_limit)]
+        prefetch_tasks = [asyncio.ensure_future(_prefetch_stage(loop, io_executor, resolved, fetched, prefetch_stats, nwb_index_path, scratch_dir))
+                          for _ in range(prefetch_limit)]
+
+        async def feed():
+            await _resolve_stage(loop, io_executor, list(enumerate(cells)), resolved, resolve_stats, resolve_batch)
+            for _ in prefetch_tasks:
+                await resolved.put(None)
+            await asyncio.gather(*prefetch_tasks)
+            for _ in compute_tasks:
+                await fetched.put(None)
+
+        # Gathered together, so an error in any stage stops the run instead of leaving the others waiting
+        await asyncio.gather(feed(), *compute_tasks)
+    finally:
+        # Remove copies that were never computed (only after an error)
+        while not fetched.empty():
+            item = fetched.get_nowait()
+            if item and item[2] and os.path.exists(item[2]):
+                os.remove(item[2])
+        io_executor.shutdown()
+        compute_pool.shutdown()
+
+    wall_time = time.monotonic() - start
+    print(f"\nPipeline throughput ({len(cells)} cells in {wall_time:.1f} s):")
+    for stats in (resolve_stats, prefetch_stats, compute_stats):
+        print(stats.report(wall_time))
+    return [resolve_stats, prefetch_stats, compute_stats]
+
+
+def run_prefetch_pipeline(cells, compute, on_result, scratch_dir, nwb_index_path=None, resolve_batch=100,
+                          prefetch_limit=4, compute_limit=1, queue_size=8):
+    """
+    Runs cells through three overlapping stages, so the share and the CPU are
+    busy at the same time instead of taking turns:
+        1. resolve: storage directories from LIMS, resolve_batch cells per query.
+        2. prefetch: each NWB v2 file is copied to scratch_dir, prefetch_limit at a time.
+        3. compute: compute(cell_name, local_path) runs on each copy as it lands, in
+           compute_limit worker processes, and the copy is deleted afterwards.
+    The queues between stages hold at most queue_size cells, so at most
+    queue_size + prefetch_limit + compute_limit copies are in scratch_dir at once.
+
+    Parameters:
+        cells (list): a list of cell names.
+        compute (function): computes a cell's result from (cell_name, nwb_path) (a
+            module-level function, it must be picklable).
+        on_result (function): called with (cell_name, result) in cell order, from
+            this thread (result is None if the cell failed at any stage).
+        scratch_dir (string): a string specifying the local directory for the copies.
+        nwb_index_path (string): a string specifying the NWB index (None to always walk the directory).
+        resolve_batch (int): the number of cells per LIMS query.
+        prefetch_limit (int): the number of files copied at the same time.
+        compute_limit (int): the number of worker processes computing cells.
+        queue_size (int): the number of cells each queue holds before the stage feeding it waits.
+
+    Returns:
+        stats (list): a StageStats for each stage.
+    """
+
+    os.makedirs(scratch_dir, exist_ok=True)
+    return asyncio.run(_run_pipeline(list(cells), compute, on_result, scratch_dir, nwb_index_path,
+                                     resolve_batch, prefetch_limit, compute_limit, queue_size))
@@ -0,0 +1,147 @@
+"""
+-----------------------------------------------------------------------
+File name: psd_functions.py
+Maintainer: Ramkumar Rajanbabu
+-----------------------------------------------------------------------
+Developer: Ramkumar Rajanbabu
+Date/time created: 10/17/2026
+Description: Welch noise spectra of baseline windows, with band power
+at the mains harmonics
+-----------------------------------------------------------------------
+"""
+
+
+#-----Imports-----#
+# General imports
+import numpy as np
+
+
+# Welch settings
+psd_segment_duration = 0.1 # 100 ms segments (10 Hz resolution), so a 500 ms baseline averages ~9 segments
+psd_chunk_frames = 512 # Segments transformed per FFT call (bounds memory)
+
+# Bands
+mains_harmonics = [60, 120, 180] # Hz
+mains_band_width = 30.0 # Hz around each harmonic (the bin and its neighbours, where the Hann window spreads a tone)
+psd_metrics = [f"psd_{freq}hz" for freq in mains_harmonics] + ["broadband_rms"]
+
+
+# Functions
+def _frames(segment, nperseg):
+    """
+    Returns the 50% overlapping frames of a segment as a (num_frames, nperseg) view.
+    """
+
+    return np.lib.stride_tricks.sliding_window_view(segment, nperseg)[::nperseg - nperseg // 2]
+
+
+def welch_psd(segments, rates, segment_duration=psd_segment_duration, chunk_frames=psd_chunk_frames):
+    """
+    Welch power spectral density (Hann window, 50% overlap, mean removed per segment,
+    one-sided density like scipy.signal.welch) of each 1-D segment. Frames of segments
+    with the same length and rate are transformed together, at most chunk_frames at a
+    time, so memory stays bounded however many sweeps are passed in.
+
+    Parameters:
+        segments (list): a list of 1-D arrays (ex. long baselines in pA).
+        rates (list): the sampling rate of each segment (Hz).
+        segment_duration (float): the Welch segment length (s); shorter segments use their full length.
+        chunk_frames (int): the most frames per FFT call.
+
+    Returns:
+        spectra (list): (freqs, psd) per segment, in pA^2/Hz for pA input (None for segments
+            shorter than 2 samples).
+    """
+
+    spectra = [None] * len(segments)
+    groups = {}
+    for i, (segment, rate) in enumerate(zip(segments, rates)):
+        if segment is None or len(segment) < 2:
+            continue
+        nperseg = min(int(rate * segment_duration), len(segment))
+        groups.setdefault((float(rate), nperseg), []).append(i)
+
+    for (rate, nperseg), indexes in groups.items():
+        window = np.hanning(nperseg + 1)[:-1] if nperseg > 1 else np.ones(1) # periodic Hann, as in scipy
+        scale = 1.0 / (rate * (window * window).sum())
+        freqs = np.fft.rfftfreq(nperseg, 1.0 / rate)
+        sums = {i: np.zeros(len(freqs)) for i in indexes}
+        counts = {i: 0 for i in indexes}
+
+        # Queue of (segment index, frame view), transformed chunk_frames frames at a time
+        pending = []
+        num_pending = 0
+
+        def transform():
+            frames = np.concatenate([view for i, view in pending]).astype(np.float64)
+            frames -= frames.mean(axis=1, keepdims=True)
+            power = np.abs(np.fft.rfft(frames * window, axis=1)) ** 2
+            row = 0
+            for i, view in pending:
+                sums[i] += power[row:row + len(view)].sum(axis=0)
+                counts[i] += len(view)
+                row += len(view)
+
+        for i in indexes:
+            frames = _frames(np.asarray(segments[i]), nperseg)
+            for start in range(0, len(frames), chunk_frames):
+                view = frames[start:start + chunk_frames]
+                if num_pending + len(view) > chunk_frames and pending:
+                    transform()
+                    pending, num_pending = [], 0
+                pending.append((i, view))
+                num_pending += len(view)
+        if pending:
+            transform()
+
+        for i in indexes:
+            psd = sums[i] / counts[i] * scale
+            # One-sided: double everything but DC (and Nyquist for even lengths)
+            psd[1:len(psd) - (nperseg % 2 == 0)] *= 2
+            spectra[i] = (freqs, psd)
+    return spectra
+
+
+def band_powers(freqs, psd, harmonics=mains_harmonics, band_width=mains_band_width):
+    """
+    Integrates a PSD around each harmonic and over the whole band.
+
+    Parameters:
+        freqs (np.ndarray): the PSD frequencies (Hz).
+        psd (np.ndarray): the PSD (pA^2/Hz).
+        harmonics (list): the centre of each band (Hz).
+        band_width (float): the width of each band (Hz).
+
+    Returns:
+        metrics (list): the power in each band (pA^2, nan past Nyquist), then the broadband
+            rms (pA) from the first bin above DC to Nyquist.
+    """
+
+    df = freqs[1] - freqs[0] if len(freqs) > 1 else 0.0
+    metrics = []
+    for freq in harmonics:
+        band = np.abs(freqs - freq) <= band_width / 2
+        metrics.append(float(psd[band].sum() * df) if band.any() else np.nan)
+    metrics.append(float(np.sqrt(psd[1:].sum() * df)))
+    return metrics
+
+
+def baseline_psd_metrics(segments, rates):
+    """
+    Band power at the mains harmonics and broadband rms of each baseline.
+
+    Parameters:
+        segments (list): a list of 1-D baselines in pA (None where a sweep is missing).
+        rates (list): the sampling rate of each baseline (Hz).
+
+    Returns:
+        metrics (list): psd_metrics values per baseline, rounded to 6 places (None where missing).
+    """
+
+    metrics = []
+    for spectrum in welch_psd(segments, rates):
+        if spectrum is None:
+            metrics.append(None)
+        else:
+            metrics.append([round(value, 6) for value in band_powers(*spectrum)])
+    return metrics
@@ -0,0 +1,460 @@
+"""
+-----------------------------------------------------------------------
+File name: rms_functions.py
+Maintainer: Ramkumar Rajanbabu
+-----------------------------------------------------------------------
+Developer: Ramkumar Rajanbabu
+Date/time created: 10/17/2026
+Description: Baseline rms read straight from the NWB (h5py) sweep arrays
+-----------------------------------------------------------------------
+"""
+
+
+#-----Imports-----#
+# General imports
+import numpy as np
+# File imports
+from functions.general_functions import find_cell_nwb, vs_stim_names
+from functions.nwb_functions import NwbFile, get_sweep_numbers_h5, read_sweep_table_h5
+from functions.psd_functions import baseline_psd_metrics, psd_metrics
+from functions.runlog_functions import failure, timed
+
+
+# Baseline windows (same as calculate_std_vs)
+bl_short_duration = 0.0015 # 1.5 ms short baseline duration
+bl_long_buffer = 0.015 # 15 ms after the test pulse epoch
+
+# Lists
+sweep_types = ["inbath", "cellatt", "breakin"] # Same order as vs_stim_names
+rep_stats = ["median", "min", "max"] # Across the repetitions of each stimulus
+
+
+# Functions
+def find_baseline_epoch(stimulus, rate):
+    """
+    Finds the baseline between the test pulse and the stimulus onset from the command
+    waveform, reading only as much of it as it takes to see them.
+
+    The epochs follow ipfx: the test epoch ends one pulse-onset length after the end
+    of the test pulse, and the stim epoch starts after the first two changes. Like
+    get_test_epoch, a change at the first sample is skipped for the test epoch only;
+    get_stim_epoch still counts it, so such a sweep gets ipfx's (empty) long baseline.
+
+    Parameters:
+        stimulus (h5py.Dataset): the stimulus data of the sweep.
+        rate (float): the sampling rate (Hz).
+
+    Returns:
+        test_end, bl_end (int): sample indexes (None if no test pulse and stimulus).
+    """
+
+    num_samples = len(stimulus)
+    stop = min(int(rate), num_samples)
+    while True:
+        changes = np.flatnonzero(np.diff(stimulus[:stop]))
+        if len(changes) >= 3 or stop == num_samples:
+            break
+        stop = min(stop * 4, num_samples)
+
+    # Test pulse (2 changes) then the stimulus onset (3rd change)
+    if len(changes) < 3:
+        return None
+    test_changes = changes[1:] if changes[0] == 0 else changes
+    return int(test_changes[1]) + int(test_changes[0]) + 1, int(changes[2]) + 1
+
+
+def baseline_windows(test_end, bl_end, rate):
+    """
+    Returns the long and short baseline windows (same as calculate_std_vs).
+
+    Returns:
+        long_start, short_start, bl_end (int): sample indexes.
+    """
+
+    long_start = int(test_end + rate * bl_long_buffer)
+    short_start = int(((bl_end / rate) - bl_short_duration) * rate)
+    return long_start, short_start, bl_end
+
+
+def find_baseline_windows(stimulus, rate):
+    """
+    Finds the long and short baseline windows from the command waveform (see find_baseline_epoch).
+
+    Returns:
+        long_start, short_start, bl_end (int): sample indexes (None if no test pulse and stimulus).
+    """
+
+    epoch = find_baseline_epoch(stimulus, rate)
+    if epoch is None:
+        return None
+    return baseline_windows(epoch[0], epoch[1], rate)
+
+
+def batched_std(segments):
+    """
+    Standard deviation of each 1-D segment, computed in one pass over all of them.
+
+    Parameters:
+        segments (list): a list of 1-D arrays.
+
+    Returns:
+        stds (np.ndarray): one value per segment (nan for empty segments).
+    """
+
+    lengths = np.array([len(segment) for segment in segments])
+    stds = np.full(len(segments), np.nan)
+    keep = lengths > 0
+    if not keep.any():
+        return stds
+
+    values = np.concatenate([segment for segment in segments if len(segment)]).astype(np.float64)
+    lengths = lengths[keep]
+    offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+
+    means = np.add.reduceat(values, offsets) / lengths
+    deviations = values - np.repeat(means, lengths)
+    stds[keep] = np.sqrt(np.add.reduceat(deviations * deviations, offsets) / lengths)
+    return stds
+
+
+def masked_std(values, mask):
+    """
+    Standard deviation of the masked values of each row (nan for a row with none).
+    """
+
+    counts = mask.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = np.where(mask, values, 0.0).sum(axis=1) / counts
+        deviations = np.where(mask, values - means[:, None], 0.0)
+        return np.sqrt((deviations * deviations).sum(axis=1) / counts)
+
+
+def read_baselines_h5(h5file, vs_swp_num_lsts, sweep_table=None):
+    """
+    Reads the baseline of the last sweep of each list. Only the baseline range of
+    each current trace is read from the file, in one hyperslab per sweep.
+
+    Parameters:
+        h5file (h5py.File): an open NWB v2 file.
+        vs_swp_num_lsts (list): a list of sweep number lists (ex. inbath, cellatt, breakin).
+        sweep_table (dict): the output of read_sweep_table_h5 (read if not given).
+
+    Returns:
+        baselines (list): (rate, long baseline, short baseline) per sweep list, in pA (None
+            where the sweep is missing or not in voltage clamp).
+    """
+
+    if sweep_table is None:
+        sweep_table = read_sweep_table_h5(h5file)
+
+    baselines = []
+    for vs_swp_num_lst in vs_swp_num_lsts:
+        sweep = sweep_table.get(vs_swp_num_lst[-1]) if len(vs_swp_num_lst) else None
+        if not sweep or sweep.get("clamp_mode") != "VoltageClamp" or "stimulus" not in sweep:
+            baselines.append(None)
+            continue
+        response = h5file[sweep["acquisition"]]
+        rate = float(response["starting_time"].attrs["rate"])
+        windows = find_baseline_windows(h5file[sweep["stimulus"]]["data"], rate)
+        if windows is None:
+            baselines.append(None)
+            continue
+        long_start, short_start, bl_end = windows
+
+        # One hyperslab covering both windows, scaled to pA like ipfx (A * 1e12)
+        read_start = max(min(long_start, short_start), 0)
+        data = response["data"]
+        conversion = float(data.attrs.get("conversion", 1.0))
+        with timed("h5_read", sweep=int(vs_swp_num_lst[-1])) as info:
+            baseline = data[read_start:bl_end]
+            info["bytes"] = baseline.nbytes
+        baseline = baseline.astype(np.float64) * conversion * 1e12
+        baselines.append((rate, baseline[max(long_start - read_start, 0):], baseline[max(short_start - read_start, 0):]))
+    return baselines
+
+
+def read_vs_baselines_h5(h5file, sweep_table=None):
+    """
+    Reads the baselines of a file's inbath, cellatt and breakin sweeps (see read_baselines_h5).
+    """
+
+    if sweep_table is None:
+        sweep_table = read_sweep_table_h5(h5file)
+    vs_sweep_nums = [get_sweep_numbers_h5(sweep_table, stim_names) for stim_names in vs_stim_names]
+    return read_baselines_h5(h5file, vs_sweep_nums, sweep_table)
+
+
+def calculate_std_vs_h5(h5file, vs_swp_num_lsts, sweep_table=None):
+    """
+    Calculates the long and short baseline rms of the last sweep of each list in one
+    batch. Only the baseline range of each current trace is read from the file.
+
+    Parameters:
+        h5file (h5py.File): an open NWB v2 file.
+        vs_swp_num_lsts (list): a list of sweep number lists (ex. inbath, cellatt, breakin).
+        sweep_table (dict): the output of read_sweep_table_h5 (read if not given).
+
+    Returns:
+        rms_list (list): (long_rms, short_rms) per sweep list, rounded like calculate_std_vs
+            (None where the sweep is missing or not in voltage clamp).
+    """
+
+    return baseline_rms(read_baselines_h5(h5file, vs_swp_num_lsts, sweep_table))
+
+
+def baseline_rms(baselines):
+    """
+    Long and short rms of each baseline from read_baselines_h5, computed in one batch
+    and rounded like calculate_std_vs (None where the baseline is None).
+    """
+
+    segments = []
+    for baseline in baselines:
+        if baseline is not None:
+            segments.extend(baseline[1:])
+    with timed("rms", segments=len(segments)):
+        stds = batched_std(segments).round(3) if segments else []
+
+    rms_list = []
+    i = 0
+    for baseline in baselines:
+        if baseline is not None:
+            rms_list.append((stds[i], stds[i + 1]))
+            i += 2
+        else:
+            rms_list.append(None)
+    return rms_list
+
+
+def calculate_cell_noise_h5(cell_name, h5file, baselines=None):
+    """
+    Calculates a cell's noise row from an open NWB v2 file.
+
+    Parameters:
+        cell_name (string): a string specifying the cell name.
+        h5file (h5py.File): an open NWB v2 file.
+        baselines (list): the output of read_vs_baselines_h5 (read if not given).
+
+    Returns:
+        row (tuple): cell_name followed by the long/short rms of the inbath, cellatt and
+            breakin sweeps (None if the cell is missing a voltage sweep).
+    """
+
+    if baselines is None:
+        baselines = read_vs_baselines_h5(h5file)
+    rms_list = baseline_rms(baselines)
+
+    row = [cell_name]
+    for rms in rms_list:
+        if rms is None:
+            failure(cell_name, "no_voltage_sweep")
+            return None
+        row.extend(float(value) for value in rms)
+    return tuple(row)
+
+
+def calculate_cell_psd_h5(cell_name, h5file, baselines=None):
+    """
+    Calculates a cell's noise spectrum row from an open NWB v2 file: the band power
+    at 60/120/180 Hz and the broadband rms of the long baseline of the inbath, cellatt
+    and breakin sweeps (see baseline_psd_metrics).
+
+    Parameters:
+        cell_name (string): a string specifying the cell name.
+        h5file (h5py.File): an open NWB v2 file.
+        baselines (list): the output of read_vs_baselines_h5 (read if not given).
+
+    Returns:
+        row (tuple): cell_name followed by the psd_metrics of each sweep (None for a
+            missing sweep; None if all three are missing).
+    """
+
+    if baselines is None:
+        baselines = read_vs_baselines_h5(h5file)
+    if all(baseline is None for baseline in baselines):
+        return None
+
+    with timed("psd", cell_name):
+        metrics = baseline_psd_metrics([baseline[1] if baseline else None for baseline in baselines],
+                                       [baseline[0] if baseline else None for baseline in baselines])
+    row = [cell_name]
+    for values in metrics:
+        row.extend(values if values is not None else [None] * len(psd_metrics))
+    return tuple(row)
+
+
+def read_sweep_baselines_h5(h5file, sweep_nums, sweep_table):
+    """
+    Reads the baseline of every voltage clamp sweep in sweep_nums (ex. all repetitions
+    of EXTPINBATH) into one 2-D array. Each sweep's hyperslab is read straight into its
+    row, right aligned on the stimulus onset, so the long and short windows of all
+    sweeps are the last columns of the array.
+
+    Parameters:
+        h5file (h5py.File): an open NWB v2 file.
+        sweep_nums (list): a list of sweep numbers.
+        sweep_table (dict): the output of read_sweep_table_h5.
+
+    Returns:
+        read_nums (np.ndarray): the sweeps read, one per row (missing and current clamp sweeps are left out).
+        baselines (np.ndarray): sweeps x samples in pA, nan before each sweep's window.
+        long_lengths, short_lengths (np.ndarray): the samples in each sweep's long and short window.
+    """
+
+    windows = []
+    for sweep_num in sweep_nums:
+        sweep = sweep_table.get(sweep_num)
+        if not sweep or sweep.get("clamp_mode") != "VoltageClamp" or "stimulus" not in sweep:
+            continue
+        response = h5file[sweep["acquisition"]]
+        sweep_windows = find_baseline_windows(h5file[sweep["stimulus"]]["data"], float(response["starting_time"].attrs["rate"]))
+        if sweep_windows is not None:
+            windows.append((sweep_num, response["data"], sweep_windows))
+
+    read_nums = np.array([sweep_num for sweep_num, _, _ in windows], dtype=int)
+    bl_ends = np.array([bl_end for _, _, (_, _, bl_end) in windows], dtype=int)
+    long_lengths = np.clip(bl_ends - np.array([max(w[0], 0) for _, _, w in windows], dtype=int), 0, None)
+    short_lengths = np.clip(bl_ends - np.array([max(w[1], 0) for _, _, w in windows], dtype=int), 0, None)
+    width = int(max(long_lengths.max(), short_lengths.max())) if windows else 0
+
+    baselines = np.full((len(windows), width), np.nan)
+    with timed("h5_read", sweeps=len(windows)) as info:
+        info["bytes"] = 0
+        for i, (sweep_num, data, (long_start, short_start, bl_end)) in enumerate(windows):
+            read_start = max(min(long_start, short_start), 0)
+            if bl_end > read_start:
+                data.read_direct(baselines[i], np.s_[read_start:bl_end], np.s_[width - (bl_end - read_start):])
+                info["bytes"] += (bl_end - read_start) * data.dtype.itemsize
+                # Scaled to pA like ipfx (A * 1e12)
+                baselines[i] *= float(data.attrs.get("conversion", 1.0)) * 1e12
+    return read_nums, baselines, long_lengths, short_lengths
+
+
+def sweep_rms(baselines, long_lengths, short_lengths):
+    """
+    Long and short rms of every row of read_sweep_baselines_h5, in one vectorized pass each.
+    """
+
+    columns = np.arange(baselines.shape[1])
+    with timed("rms", sweeps=len(baselines)):
+        long_rms = masked_std(baselines, columns >= baselines.shape[1] - long_lengths[:, None])
+        short_rms = masked_std(baselines, columns >= baselines.shape[1] - short_lengths[:, None])
+    return long_rms, short_rms
+
+
+def calculate_cell_sweep_noise_h5(cell_name, h5file, sweep_table=None):
+    """
+    Calculates the rms of every repetition of the inbath, cellatt and breakin stimuli,
+    one batched read per stimulus.
+
+    Parameters:
+        cell_name (string): a string specifying the cell name.
+        h5file (h5py.File): an open NWB v2 file.
+        sweep_table (dict): the output of read_sweep_table_h5 (read if not given).
+
+    Returns:
+        row (tuple): the noise row of the last sweep of each stimulus, same as
+            calculate_cell_noise_h5 (None if the cell is missing a voltage sweep).
+        rep_row (tuple): cell_name followed by, per stimulus, the number of sweeps and the
+            median/min/max of the long and short rms across them.
+        sweep_rows (list): (cell_name, sweep_type, sweep_number, long_rms, short_rms) per sweep.
+    """
+
+    if sweep_table is None:
+        sweep_table = read_sweep_table_h5(h5file)
+
+    row = [cell_name]
+    rep_row = [cell_name]
+    sweep_rows = []
+    for sweep_type, stim_names in zip(sweep_types, vs_stim_names):
+        sweep_nums = get_sweep_numbers_h5(sweep_table, stim_names)
+        read_nums, baselines, long_lengths, short_lengths = read_sweep_baselines_h5(h5file, sweep_nums, sweep_table)
+        long_rms, short_rms = sweep_rms(baselines, long_lengths, short_lengths)
+        sweep_rows.extend((cell_name, sweep_type, int(sweep_num), float(long_value), float(short_value))
+                          for sweep_num, long_value, short_value in zip(read_nums, long_rms.round(3), short_rms.round(3)))
+
+        # The last sweep, like calculate_std_vs
+        if row is not None and len(sweep_nums) and len(read_nums) and read_nums[-1] == sweep_nums[-1]:
+            row.extend((float(long_rms[-1].round(3)), float(short_rms[-1].round(3))))
+        else:
+            row = None
+        rep_row.append(len(read_nums))
+        for values in (long_rms, short_rms):
+            values = values[~np.isnan(values)]
+            if len(values):
+                rep_row.extend(float(stat) for stat in np.round([np.median(values), values.min(), values.max()], 3))
+            else:
+                rep_row.extend([None] * len(rep_stats))
+
+    if row is None:
+        failure(cell_name, "no_voltage_sweep")
+    return (tuple(row) if row else None), tuple(rep_row), sweep_rows
+
+
+def noise_from_nwb_h5(cell_name, nwb2_filepath):
+    """
+    Opens a cell's NWB v2 file once (see NwbFile) and calculates its noise row.
+
+    Parameters:
+        cell_name (string): a string specifying the cell name.
+        nwb2_filepath (string): a string specifying the NWB v2 file path.
+
+    Returns:
+        row (tuple): cell_name followed by the long/short rms of the inbath, cellatt and
+            breakin sweeps (None if the cell is missing a voltage sweep or can't be read).
+    """
+
+    try:
+        with NwbFile(nwb2_filepath, cell_name) as nwb:
+            return calculate_cell_noise_h5(cell_name, nwb.h5file, read_vs_baselines_h5(nwb.h5file, nwb.sweep_table))
+    except (OSError, KeyError, ValueError) as e:
+        print(f"can't read {cell_name}: {e!r}")
+        failure(cell_name, "unreadable_nwb", repr(e))
+        return None
+
+
+def extract_cell_noise_h5(cell_name, path, nwb_index_path=None):
+    """
+    Same as extract_cell_noise, but reads the file with h5py and calculate_std_vs_h5
+    instead of building an ipfx dataset.
+
+    Parameters:
+        cell_name (string): a string specifying the cell name.
+        path (string): a string specifying the storage directory (None if not in LIMS).
+        nwb_index_path (string): a string specifying the NWB index (None to always walk the directory).
+
+    Returns:
+        row (tuple): cell_name followed by the long/short rms of the inbath, cellatt and
+            breakin sweeps (None if the cell is missing a voltage sweep).
+    """
+
+    nwb2_filepath = find_cell_nwb(cell_name, path, nwb_index_path, keep_open=True)
+    if not nwb2_filepath:
+        return None
+    return noise_from_nwb_h5(cell_name, nwb2_filepath)
+
+
+def extract_cell_sweep_noise_h5(cell_name, path, nwb_index_path=None):
+    """
+    Extracts the noise metrics of every repetition of the inbath, cellatt and breakin
+    stimuli of one cell (see calculate_cell_sweep_noise_h5).
+
+    Parameters:
+        cell_name (string): a string specifying the cell name.
+        path (string): a string specifying the storage directory (None if not in LIMS).
+        nwb_index_path (string): a string specifying the NWB index (None to always walk the directory).
+
+    Returns:
+        result (tuple): row, rep_row and sweep_rows (None if the file can't be found or read).
+    """
+
+    nwb2_filepath = find_cell_nwb(cell_name, path, nwb_index_path, keep_open=True)
+    if not nwb2_filepath:
+        return None
+    try:
+        with NwbFile(nwb2_filepath, cell_name) as nwb:
+            return calculate_cell_sweep_noise_h5(cell_name, nwb.h5file, nwb.sweep_table)
+    except (OSError, KeyError, ValueError) as e:
+        print(f"can't read {cell_name}: {e!r}")
+        failure(cell_name, "unreadable_nwb", repr(e))
+        return None
@@ -0,0 +1,296 @@
+"""
+-----------------------------------------------------------------------
+File name: runlog_functions.py
+Maintainer: Ramkumar Rajanbabu
+-----------------------------------------------------------------------
+Developer: Ramkumar Rajanbabu
+Date/time created: 10/17/2026
+Description: JSON-lines run log of per-stage timings, counters and
+failure reasons, with an end-of-run summary
+-----------------------------------------------------------------------
+"""
+
+
+#-----Imports-----#
+# General imports
+import atexit
+import glob
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+import numpy as np
+import pandas as pd
+# File imports
+from functions.backfill_functions import current_rss_mb, process_seconds
+
+
+# The run log is found through the environment, so worker processes (forked or
+# spawned) write to the same file as the main process
+run_log_env = "EPHYS_NOISE_RUN_LOG"
+run_id_env = "EPHYS_NOISE_RUN_ID"
+
+# Upper edges of the latency histogram (seconds)
+latency_buckets = [0.01, 0.1, 1, 10, 60]
+
+# Packages that are slow to import, reported at the start and end of each run
+heavy_modules = ["ipfx", "pynwb", "hdmf", "scipy", "allensdk", "pyarrow"]
+
+# Open log files (one per log path per process)
+_log_files = {}
+_log_lock = threading.Lock()
+
+
+# Functions
+def start_run_log(log_dir, job):
+    """
+    Starts a run log for this process and any workers it starts.
+
+    Parameters:
+        log_dir (string): a string specifying the directory of the run logs.
+        job (string): a string naming the job (ex. "rig_noise").
+
+    Returns:
+        log_path (string): the run's log file (<log_dir>/<job>_<start time>_<pid>.jsonl).
+    """
+
+    os.makedirs(log_dir, exist_ok=True)
+    # The pid keeps runs started in the same second apart (ex. the --shard i/N processes of one scheduled task)
+    run_id = f"{job}_{datetime.now():%Y%m%d_%H%M%S}_{os.getpid()}"
+    log_path = os.path.join(log_dir, run_id + ".jsonl")
+    os.environ[run_log_env] = log_path
+    os.environ[run_id_env] = run_id
+    log_event("start", job=job, **process_stats())
+    return log_path
+
+
+def process_stats():
+    """
+    Returns how long this process has been running, its resident memory and the
+    heavy packages it has imported so far (see heavy_modules).
+    """
+
+    seconds = process_seconds()
+    rss_mb = current_rss_mb()
+    return {"process_s": None if seconds is None else round(seconds, 3),
+            "rss_mb": None if rss_mb is None else round(rss_mb, 1),
+            "heavy_modules": [name for name in heavy_modules if name in sys.modules]}
+
+
+def _close_log_files():
+    for log_file in _log_files.values():
+        log_file.close()
+    _log_files.clear()
+
+
+atexit.register(_close_log_files)
+
+
+def stop_run_log():
+    """
+    Ends the run log (ex. between the polls of a long-running process), so later
+    events aren't added to it.
+    """
+
+    with _log_lock:
+        _close_log_files()
+    os.environ.pop(run_log_env, None)
+    os.environ.pop(run_id_env, None)
+
+
+def log_event(event, **fields):
+    """
+    Appends one event to the run log (nothing happens if no run log was started).
+    """
+
+    log_path = os.environ.get(run_log_env)
+    if not log_path:
+        return
+    record = {"run_id": os.environ.get(run_id_env), "time": round(time.time(), 3), "pid": os.getpid(), "event": event}
+    record.update(fields)
+    line = json.dumps(record, default=str) + "\n"
+    with _log_lock:
+        if log_path not in _log_files:
+            _log_files[log_path] = open(log_path, "a", encoding="utf-8")
+        # One write per line, so lines from different processes don't interleave
+        _log_files[log_path].write(line)
+        _log_files[log_path].flush()
+
+
+@contextmanager
+def timed(stage, cell_name=None, **fields):
+    """
+    Times a stage and logs it when the block exits. The block can add fields to
+    the yielded dict (ex. info["bytes"] = data.nbytes). An exception is logged
+    as the stage's error and raised again.
+
+    Ex.
+        with timed("make_dataset", cell_name) as info:
+            dataset = create_ephys_data_set(nwb_file=nwb_path)
+    """
+
+    info = dict(fields)
+    start = time.perf_counter()
+    try:
+        yield info
+    except Exception as e:
+        info.setdefault("error", type(e).__name__)
+        raise
+    finally:
+        log_event("stage", stage=stage, cell=cell_name, seconds=round(time.perf_counter() - start, 6), **info)
+
+
+def count(name, cell_name=None, n=1):
+    """
+    Logs a counter (ex. count("nwb_index_hit")).
+    """
+
+    log_event("count", name=name, cell=cell_name, n=n)
+
+
+def failure(cell_name, reason, detail=None):
+    """
+    Logs why a cell was skipped (ex. failure(cell_name, "no_voltage_sweep")).
+    """
+
+    log_event("failure", cell=cell_name, reason=reason, detail=detail)
+
+
+def read_run_log(log_path=None):
+    """
+    Reads a run log as a dataframe (default: the current run's log).
+    """
+
+    log_path = log_path or os.environ.get(run_log_env)
+    with open(log_path, encoding="utf-8") as f:
+        return pd.DataFrame([json.loads(line) for line in f if line.strip()])
+
+
+def failure_reasons(log_path=None):
+    """
+    Returns the last failure a run log recorded for each cell (default: the current
+    run's log; none if no run log was started).
+
+    Returns:
+        reasons (dict): cell name -> (reason, detail), detail cut to 500 characters (or None).
+    """
+
+    log_path = log_path or os.environ.get(run_log_env)
+    if not log_path or not os.path.exists(log_path):
+        return {}
+    log_df = read_run_log(log_path)
+    reasons = {}
+    if "event" in log_df:
+        failures_df = log_df.loc[log_df["event"] == "failure"].reindex(columns=["cell", "reason", "detail"])
+        for cell_name, reason, detail in failures_df.itertuples(index=False, name=None):
+            reasons[cell_name] = (reason, None if pd.isna(detail) else str(detail)[:500])
+    return reasons
+
+
+def past_stage_seconds(log_dir, job, stage="cell"):
+    """
+    Returns how long each cell's stage took in the job's earlier runs (the latest
+    run that timed the cell wins). Only the matching lines of each log are parsed.
+
+    Parameters:
+        log_dir (string): a string specifying the directory of the run logs.
+        job (string): a string naming the job (ex. "rig_noise_2023").
+        stage (string): the timed stage (default: the whole cell).
+
+    Returns:
+        seconds (dict): cell name -> seconds.
+    """
+
+    seconds = {}
+    marker = '"stage": {}'.format(json.dumps(stage))
+    # <job>_<start time>_<pid>.jsonl, so the names sort oldest first
+    for log_path in sorted(glob.glob(os.path.join(log_dir, f"{job}_*.jsonl"))):
+        with open(log_path, encoding="utf-8") as f:
+            # The pattern also matches longer job names (ex. rig_noise_2023 for rig_noise), so
+            # the job of the start event decides
+            try:
+                start = json.loads(f.readline())
+            except ValueError:
+                continue
+            if start.get("job") != job:
+                continue
+            for line in f:
+                if marker not in line:
+                    continue
+                record = json.loads(line)
+                if record.get("cell") and not record.get("error"):
+                    seconds[record["cell"]] = record["seconds"]
+    return seconds
+
+
+def summarize_run_log(log_path=None):
+    """
+    Summarizes a run log.
+
+    Parameters:
+        log_path (string): a string specifying the run log (default: the current run's log).
+
+    Returns:
+        stage_df (DataFrame): per stage, the number of calls, errors, bytes read, total
+            and percentile latencies, and a latency histogram.
+        count_df (DataFrame): the total of each counter.
+        failure_df (DataFrame): the number of cells skipped for each reason.
+    """
+
+    log_df = read_run_log(log_path)
+
+    stage_rows = []
+    stages = log_df[log_df["event"] == "stage"] if "event" in log_df else log_df.iloc[:0]
+    for stage, group in stages.groupby("stage", sort=False):
+        seconds = group["seconds"].to_numpy(dtype=float)
+        row = {"stage": stage, "calls": len(group),
+               "errors": int(group["error"].notna().sum()) if "error" in group else 0,
+               "MB": group["bytes"].sum() / 1024**2 if "bytes" in group else 0.0,
+               "total_s": seconds.sum(), "mean_s": seconds.mean(),
+               "p50_s": np.percentile(seconds, 50), "p95_s": np.percentile(seconds, 95), "max_s": seconds.max()}
+        edges = [0] + latency_buckets + [np.inf]
+        hist, _ = np.histogram(seconds, bins=edges)
+        labels = [f"<{edge:g}s" for edge in latency_buckets] + [f">={latency_buckets[-1]:g}s"]
+        row.update(zip(labels, hist.tolist()))
+        stage_rows.append(row)
+    stage_df = pd.DataFrame(stage_rows)
+
+    counts = log_df[log_df["event"] == "count"] if "event" in log_df else log_df.iloc[:0]
+    count_df = counts.groupby("name")["n"].sum().astype(int).reset_index() if len(counts) else pd.DataFrame(columns=["name", "n"])
+    failures = log_df[log_df["event"] == "failure"] if "event" in log_df else log_df.iloc[:0]
+    failure_df = failures.groupby("reason")["cell"].nunique().reset_index(name="cells") if len(failures) else pd.DataFrame(columns=["reason", "cells"])
+    return stage_df, count_df, failure_df
+
+
+def print_run_summary(log_path=None):
+    """
+    Prints the end-of-run summary table of a run log (default: the current run's log).
+    """
+
+    if not log_path:
+        # The end of the current run
+        log_event("finish", **process_stats())
+    log_path = log_path or os.environ.get(run_log_env)
+    if not log_path or not os.path.exists(log_path):
+        return
+    stage_df, count_df, failure_df = summarize_run_log(log_path)
+    print(f"\nRun summary ({log_path}):")
+    log_df = read_run_log(log_path)
+    for event, label in (("start", "Start of run"), ("finish", "End of run")):
+        rows = log_df[log_df["event"] == event] if "process_s" in log_df else log_df.iloc[:0]
+        if len(rows):
+            row = rows.iloc[-1]
+            print(f"{label}: " + (f"{row['process_s']:.2f} s after the process started, " if pd.notna(row["process_s"]) else "")
+                  + (f"{row['rss_mb']:.0f} MB resident, " if pd.notna(row["rss_mb"]) else "")
+                  + "heavy packages loaded: " + (", ".join(row["heavy_modules"]) or "none"))
+    if len(stage_df):
+        print(stage_df.to_string(index=False, float_format=lambda value: f"{value:.3f}"))
+    if len(count_df):
+        print("\nCounters:")
+        print(count_df.to_string(index=False))
+    if len(failure_df):
+        print("\nSkipped cells by reason:")
+        print(failure_df.to_string(index=False))
@@ -0,0 +1,357 @@
+"""
+-----------------------------------------------------------------------
+File name: shard_functions.py
+Maintainer: Ramkumar Rajanbabu
+-----------------------------------------------------------------------
+Developer: Ramkumar Rajanbabu
+Date/time created: 10/17/2026
+Description: Splits the cell list across machines by estimated cost, and
+merges the partial stores the shards write back into the metrics store
+-----------------------------------------------------------------------
+"""
+
+
+#-----Imports-----#
+# General imports
+import glob
+import hashlib
+import heapq
+import json
+import numpy as np
+import os
+import pandas as pd
+import socket
+import sqlite3
+import tempfile
+import time
+# File imports
+from functions.aggregate_functions import has_aggregates, open_aggregates, rig_field, update_aggregates
+from functions.index_functions import indexed_file_sizes
+from functions.runlog_functions import past_stage_seconds
+from functions.store_functions import _quote, open_metrics_store, read_metrics, upsert_metrics
+
+
+# Directories
+default_shard_dir = os.path.join(os.path.expanduser("~"), ".ephys-noise-analysis", "shards") # Partial stores (point --shard-dir at the share to merge them in one place)
+
+# Settings
+default_cell_seconds = 30.0 # Cost of a cell with no timing and no indexed file (the median of the others is used when there are any)
+default_seconds_per_mb = 0.1 # Seconds per MB of NWB file before any cell has been timed
+
+shard_schema = ["""CREATE TABLE IF NOT EXISTS shard_info (
+    job TEXT,
+    shard INTEGER,
+    num_shards INTEGER,
+    plan_id TEXT,
+    tables TEXT,
+    num_cells INTEGER,
+    cost REAL,
+    host TEXT,
+    started REAL,
+    finished REAL
+)""", """CREATE TABLE IF NOT EXISTS shard_cells (
+    cell_name TEXT PRIMARY KEY,
+    cost REAL
+)"""]
+
+
+# Functions
+def estimate_cell_costs(cell_list, index_path=None, log_dir=None, job=None):
+    """
+    Estimates the seconds each cell takes: its last timing in the job's run logs,
+    else its NWB file size (from the NWB index) times the median seconds per MB of
+    the timed cells, else the median of the other estimates.
+
+    Parameters:
+        cell_list (list): a list of cell names.
+        index_path (string): a string specifying the NWB index (optional).
+        log_dir (string): a string specifying the directory of the run logs (optional).
+        job (string): the job whose timings are used (ex. "rig_noise_2023").
+
+    Returns:
+        costs (dict): cell name -> estimated seconds.
+    """
+
+    seconds = past_stage_seconds(log_dir, job) if log_dir and job else {}
+    sizes = indexed_file_sizes(index_path) if index_path else {}
+    ratios = [seconds[cell_name] / (sizes[cell_name] / 1024**2) for cell_name in seconds if sizes.get(cell_name)]
+    seconds_per_mb = float(np.median(ratios)) if ratios else default_seconds_per_mb
+
+    costs = {}
+    for cell_name in cell_list:
+        if cell_name in seconds:
+            costs[cell_name] = seconds[cell_name]
+        elif sizes.get(cell_name):
+            costs[cell_name] = sizes[cell_name] / 1024**2 * seconds_per_mb
+    fill = float(np.median(list(costs.values()))) if costs else default_cell_seconds
+    return {cell_name: costs.get(cell_name, fill) for cell_name in cell_list}
+
+
+def assign_shards(costs, num_shards):
+    """
+    Assigns each cell to a shard (1 to num_shards) so the shards' total costs are
+    about equal: the most expensive cells first, each to the shard with the least
+    cost so far. Ties are broken by cell name, so the same costs always give the
+    same assignment.
+
+    Returns:
+        assignment (dict): cell name -> shard.
+    """
+
+    loads = [(0.0, shard) for shard in range(1, num_shards + 1)]
+    assignment = {}
+    for cell_name, cost in sorted(costs.items(), key=lambda item: (-item[1], item[0])):
+        load, shard = heapq.heappop(loads)
+        assignment[cell_name] = shard
+        heapq.heappush(loads, (load + cost, shard))
+    return assignment
+
+
+def plan_id(assignment):
+    """
+    Returns a short hash of an assignment, so partials of different plans aren't merged as one.
+    """
+
+    text = "\n".join(f"{cell_name}\t{shard}" for cell_name, shard in sorted(assignment.items()))
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:12]
+
+
+def read_shard_plan(plan_path, cell_list, num_shards):
+    """
+    Reads a shared plan and checks that it covers this run.
+
+    Parameters:
+        plan_path (string): a string specifying the plan csv.
+        cell_list (list): every cell of the run.
+        num_shards (int): the number of shards.
+
+    Returns:
+        assignment (dict): cell name -> shard.
+        costs (dict): cell name -> estimated seconds.
+    """
+
+    plan_df = pd.read_csv(plan_path)
+    if plan_df["num_shards"].iloc[0] != num_shards:
+        raise ValueError(f"{plan_path} is a plan for {plan_df['num_shards'].iloc[0]} shards, not {num_shards}")
+    missing = set(cell_list).difference(plan_df["cell_name"])
+    if missing:
+        raise ValueError(f"{len(missing)} cells of this run aren't in {plan_path} (ex. {sorted(missing)[0]}); delete it to plan again")
+    return dict(zip(plan_df["cell_name"], plan_df["shard"])), dict(zip(plan_df["cell_name"], plan_df["cost"]))
+
+
+def write_shard_plan(plan_path, assignment, costs, num_shards):
+    """
+    Saves a plan unless one is already there. The csv is written to a temp file of
+    its own and then hard linked to plan_path, which fails if the file exists, so of
+    several shards started together the first one wins and no shard ever reads a
+    half-written plan.
+
+    Parameters:
+        plan_path (string): a string specifying the plan csv.
+        assignment (dict): cell name -> shard.
+        costs (dict): cell name -> estimated seconds.
+        num_shards (int): the number of shards.
+
+    Returns:
+        written (bool): False if another run saved its plan first.
+    """
+
+    plan_df = pd.DataFrame({"cell_name": list(assignment), "cost": [round(costs[cell_name], 3) for cell_name in assignment],
+                            "shard": list(assignment.values()), "num_shards": num_shards})
+    plan_dir = os.path.dirname(os.path.abspath(plan_path))
+    os.makedirs(plan_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=plan_dir, prefix="." + os.path.basename(plan_path) + "-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", newline="") as f:
+            plan_df.to_csv(f, index=False)
+        try:
+            os.link(tmp_path, plan_path)
+        except FileExistsError:
+            return False
+        return True
+    finally:
+        os.remove(tmp_path)
+
+
+def select_shard_cells(cell_list, shard, num_shards, index_path=None, log_dir=None, job=None, plan_path=None):
+    """
+    Returns the cells of one shard. The assignment is read from plan_path if it
+    exists; otherwise it is computed from the cost estimates and saved to plan_path
+    if given (shards started together all use the first plan saved). The estimates depend on this machine's NWB index and run logs, so
+    shards run on different machines should share one plan file (write it first,
+    ex. with --plan).
+
+    Parameters:
+        cell_list (list): every cell of the run.
+        shard (int): this shard (1 to num_shards).
+        num_shards (int): the number of shards.
+        index_path (string): a string specifying the NWB index (optional).
+        log_dir (string): a string specifying the directory of the run logs (optional).
+        job (string): the job whose timings are used.
+        plan_path (string): a string specifying the shared plan csv (optional).
+
+    Returns:
+        shard_cells (list): this shard's cells, in cell_list order.
+        costs (dict): cell name -> estimated seconds, for this shard's cells.
+        plan (string): the plan id (see plan_id).
+    """
+
+    if plan_path and os.path.exists(plan_path):
+        assignment, costs = read_shard_plan(plan_path, cell_list, num_shards)
+    else:
+        costs = estimate_cell_costs(cell_list, index_path, log_dir, job)
+        assignment = assign_shards(costs, num_shards)
+        if plan_path and not write_shard_plan(plan_path, assignment, costs, num_shards):
+            # Another shard started at the same time wrote the plan first: every shard uses that one
+            assignment, costs = read_shard_plan(plan_path, cell_list, num_shards)
+
+    shard_cells = [cell_name for cell_name in cell_list if assignment[cell_name] == shard]
+    loads = pd.Series(costs).groupby(pd.Series(assignment)).sum()
+    print(f"Shard {shard}/{num_shards}: {len(shard_cells)} of {len(cell_list)} cells, about {loads.get(shard, 0) / 60:.1f} of "
+          f"{loads.sum() / 60:.1f} worker minutes (shards range from {loads.min() / 60:.1f} to {loads.max() / 60:.1f}).")
+    return shard_cells, {cell_name: costs[cell_name] for cell_name in shard_cells}, plan_id(assignment)
+
+
+def shard_partial_path(shard_dir, job, shard, num_shards):
+    """
+    Returns the partial store of one shard (ex. <shard_dir>/rig_noise_2023_shard1of4.sqlite).
+    """
+
+    return os.path.join(shard_dir, f"{job}_shard{shard}of{num_shards}.sqlite")
+
+
+def start_shard(partial_conn, job, shard, num_shards, plan, tables, costs):
+    """
+    Describes a shard in its partial store: the job, shard, plan, tables and cells.
+    A partial is self-describing, so the merge only needs the files.
+    """
+
+    with partial_conn:
+        for schema in shard_schema:
+            partial_conn.execute(schema)
+        partial_conn.execute("DELETE FROM shard_info")
+        partial_conn.execute("DELETE FROM shard_cells")
+        partial_conn.execute("INSERT INTO shard_info VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                             (job, shard, num_shards, plan, json.dumps(list(tables)), len(costs), round(sum(costs.values()), 3),
+                              socket.gethostname(), time.time(), None))
+        partial_conn.executemany("INSERT OR REPLACE INTO shard_cells VALUES (?, ?)", costs.items())
+
+
+def finish_shard(partial_conn):
+    """
+    Marks a shard's partial store as finished.
+    """
+
+    with partial_conn:
+        partial_conn.execute("UPDATE shard_info SET finished = ?", (time.time(),))
+
+
+def read_shard_info(partial_path):
+    """
+    Returns the shard_info row of a partial store as a dict (None if it isn't one).
+    """
+
+    conn = sqlite3.connect(partial_path, timeout=60)
+    try:
+        info_df = pd.read_sql_query("SELECT * FROM shard_info", conn)
+    except pd.errors.DatabaseError:
+        return None
+    finally:
+        conn.close()
+    if not len(info_df):
+        return None
+    info = info_df.iloc[0].to_dict()
+    info["tables"] = json.loads(info["tables"])
+    info["path"] = partial_path
+    return info
+
+
+def find_partials(shard_dir, job):
+    """
+    Returns the shard_info of every partial store of a job in shard_dir, checking
+    they come from one plan. Missing or unfinished shards are reported (their cells
+    are done by the next run, or by running the shard again).
+
+    Returns:
+        partials (list): shard_info dicts, oldest finished first (so the newest row of a cell wins the merge).
+    """
+
+    partials = [info for info in map(read_shard_info, sorted(glob.glob(os.path.join(shard_dir, f"{job}_shard*of*.sqlite"))))
+                if info and info["job"] == job]
+    if not partials:
+        return []
+    plans = {(info["plan_id"], info["num_shards"]) for info in partials}
+    if len(plans) > 1:
+        raise ValueError(f"the partials in {shard_dir} come from {len(plans)} different plans: " +
+                         ", ".join(f"{os.path.basename(info['path'])} ({info['plan_id']})" for info in partials))
+    num_shards = partials[0]["num_shards"]
+    missing = sorted(set(range(1, num_shards + 1)).difference(info["shard"] for info in partials))
+    if missing:
+        print(f"Shards {', '.join(map(str, missing))} of {num_shards} have no partial in {shard_dir}.")
+    for info in partials:
+        if pd.isna(info["finished"]):
+            print(f"Shard {info['shard']}/{num_shards} ({info['host']}) hasn't finished; its rows so far are merged.")
+    return sorted(partials, key=lambda info: (info["finished"] if not pd.isna(info["finished"]) else np.inf, info["shard"]))
+
+
+def _table_key(conn, table):
+    """
+    Returns the columns and the primary key of a store table.
+    """
+
+    table_info = conn.execute("PRAGMA table_info({})".format(_quote(table))).fetchall()
+    columns = [row[1] for row in table_info]
+    key = [row[1] for row in sorted(table_info, key=lambda row: row[5]) if row[5]]
+    return columns, key[0] if len(key) == 1 else key
+
+
+def _has_rigs(conn, table):
+    """
+    Returns True if a partial store has the rig of its rows (it has aggregates for the table).
+    """
+
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'metric_aggregate_cells'").fetchone():
+        return False
+    return has_aggregates(conn, table)
+
+
+def merge_partials(store_path, partials, seed_csvs=None):
+    """
+    Upserts the rows of each partial store into the metrics store, one table at a
+    time. A cell in several partials (or already in the store) keeps the row of the
+    newest shard, and the per rig, per day aggregates are updated with the rows.
+
+    Parameters:
+        store_path (string): a string specifying the metrics store.
+        partials (list): the output of find_partials.
+        seed_csvs (dict): table -> csv seeding a new store table (optional).
+
+    Returns:
+        counts (dict): table -> rows merged (cells in several partials are counted once).
+    """
+
+    seed_csvs = seed_csvs or {}
+    counts = {}
+    for info in partials:
+        partial_conn = sqlite3.connect(info["path"], timeout=60)
+        try:
+            for table in info["tables"]:
+                columns, key = _table_key(partial_conn, table)
+                if not columns:
+                    continue
+                rows_df = read_metrics(partial_conn, table, columns)
+                store_conn = open_metrics_store(store_path, table, columns, key=key, seed_csv=seed_csvs.get(table))
+                with store_conn:
+                    if _has_rigs(partial_conn, table):
+                        open_aggregates(store_conn)
+                        # The rig each row was counted under in the partial
+                        rig_df = pd.read_sql_query("SELECT cell_name, rig AS {} FROM metric_aggregate_cells WHERE table_name = ?".format(_quote(rig_field)),
+                                                   partial_conn, params=(table,))
+                        metric_cols = [col for col in columns if col not in ("cell_name", "jem-date_patch")]
+                        update_aggregates(store_conn, table, metric_cols, pd.merge(rows_df, rig_df, how="left", on="cell_name"))
+                    upsert_metrics(store_conn, table, columns, rows_df.itertuples(index=False, name=None), key=key)
+                store_conn.close()
+                counts.setdefault(table, set()).update(rows_df[key] if isinstance(key, str) else rows_df[key].itertuples(index=False, name=None))
+        finally:
+            partial_conn.close()
+    return {table: len(keys) for table, keys in counts.items()}
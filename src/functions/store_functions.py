@@ -0,0 +1,153 @@
+"""
+-----------------------------------------------------------------------
+File name: store_functions.py
+Maintainer: Ramkumar Rajanbabu
+-----------------------------------------------------------------------
+Developer: Ramkumar Rajanbabu
+Date/time created: 10/17/2026
+Description: Local sqlite store for per-cell metrics keyed on cell_name
+-----------------------------------------------------------------------
+"""
+
+
+#-----Imports-----#
+# General imports
+import os
+import pandas as pd
+import sqlite3
+# File imports
+from functions.runlog_functions import timed
+
+
+# Directories
+default_store_dir = os.path.join(os.path.expanduser("~"), ".ephys-noise-analysis", "metrics_store.sqlite")
+
+
+# Functions
+def _quote(name):
+    """
+    Quotes a column name for sqlite (ex. jem-date_patch has a "-" in it).
+    """
+
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+def open_metrics_store(store_path, table, columns, key="cell_name", seed_csv=None):
+    """
+    Opens (and creates if needed) a metrics table keyed on one column. A new table
+    is seeded from seed_csv, so the rows of the existing csv aren't recomputed.
+
+    Parameters:
+        store_path (string): a string specifying the sqlite file.
+        table (string): a string specifying the table name.
+        columns (list): a list of the table's columns, in csv order.
+        key (string): the column that identifies a row (or a list of columns, ex. cell_name and sweep_number).
+        seed_csv (string): a string specifying a csv with the same columns (optional).
+
+    Returns:
+        conn (sqlite3.Connection): an open connection to the store.
+    """
+
+    if store_path != ":memory:":
+        os.makedirs(os.path.dirname(os.path.abspath(store_path)), exist_ok=True)
+    conn = sqlite3.connect(store_path, timeout=60)
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()
+    if not exists:
+        seed_df = None
+        if seed_csv and os.path.exists(seed_csv):
+            seed_df = pd.read_csv(seed_csv)
+            seed_df = seed_df.drop_duplicates(subset=[key] if isinstance(key, str) else key, keep="last")
+        if isinstance(key, str):
+            column_defs = ", ".join(_quote(col) + (" TEXT PRIMARY KEY" if col == key else "") for col in columns)
+        else:
+            column_defs = ", ".join([_quote(col) for col in columns] + ["PRIMARY KEY ({})".format(", ".join(_quote(col) for col in key))])
+        # Shards started together open the same new store: the write lock is taken before
+        # looking again, so one of them creates and seeds the table and the others find it
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            created = not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()
+            conn.execute("CREATE TABLE IF NOT EXISTS {} ({})".format(_quote(table), column_defs))
+            if created and seed_df is not None:
+                _write_rows(conn, table, columns, seed_df[columns].itertuples(index=False, name=None), key)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            conn.close()
+            raise
+    return conn
+
+
+def stored_cell_names(conn, table, key="cell_name"):
+    """
+    Returns the set of keys in a metrics table, for O(1) membership checks.
+    """
+
+    return {row[0] for row in conn.execute("SELECT {} FROM {}".format(_quote(key), _quote(table)))}
+
+
+def upsert_metrics(conn, table, columns, rows, key="cell_name"):
+    """
+    Inserts or replaces rows in one transaction. Re-running a cell replaces its row
+    in place, so it keeps its position in the exported csv.
+
+    Parameters:
+        conn (sqlite3.Connection): an open connection to the store.
+        table (string): a string specifying the table name.
+        columns (list): a list of the table's columns, in the order of each row.
+        rows (iterable): rows as sequences of values.
+        key (string): the column that identifies a row (or a list of columns).
+
+    Returns:
+        count (int): the number of rows written.
+    """
+
+    with conn:
+        return _write_rows(conn, table, columns, rows, key)
+
+
+def _write_rows(conn, table, columns, rows, key):
+    """
+    Inserts or replaces rows in the caller's transaction (see upsert_metrics).
+    """
+
+    # numpy scalars -> python values so sqlite stores numbers, not blobs
+    rows = [tuple(value.item() if hasattr(value, "item") else value for value in row) for row in rows]
+    key_cols = [key] if isinstance(key, str) else list(key)
+    updates = ", ".join("{0} = excluded.{0}".format(_quote(col)) for col in columns if col not in key_cols)
+    query = "INSERT INTO {} ({}) VALUES ({}) ON CONFLICT({}) DO UPDATE SET {}".format(
+        _quote(table), ", ".join(_quote(col) for col in columns), ", ".join("?" * len(columns)), ", ".join(_quote(col) for col in key_cols), updates)
+    conn.executemany(query, rows)
+    return len(rows)
+
+
+def read_metrics(conn, table, columns):
+    """
+    Reads a metrics table as a dataframe, in the order rows were first added.
+    """
+
+    query = "SELECT {} FROM {} ORDER BY rowid".format(", ".join(_quote(col) for col in columns), _quote(table))
+    return pd.read_sql_query(query, conn)
+
+
+def export_metrics_csv(conn, table, columns, csv_path, dropna=None):
+    """
+    Writes a metrics table to csv in the existing layout. The file is written next
+    to csv_path first and then swapped in, so readers never see half a file.
+
+    Parameters:
+        conn (sqlite3.Connection): an open connection to the store.
+        table (string): a string specifying the table name.
+        columns (list): a list of the columns to write.
+        csv_path (string): a string specifying the csv file.
+        dropna (list): leave out rows with no value in these columns (optional).
+    """
+
+    df = read_metrics(conn, table, columns)
+    if dropna:
+        df = df.dropna(subset=dropna)
+    with timed("csv_write", table=table) as info:
+        tmp_path = csv_path + ".tmp"
+        df.to_csv(tmp_path, index=False)
+        info["bytes"] = os.path.getsize(tmp_path)
+        os.replace(tmp_path, csv_path)
+    return df
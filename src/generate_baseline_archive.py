@@ -0,0 +1,105 @@
+"""
+-----------------------------------------------------------------------
+File name: generate_baseline_archive.py
+Maintainer: Ramkumar Rajanbabu
+-----------------------------------------------------------------------
+Developer: Ramkumar Rajanbabu
+Date/time created: 10/17/2026
+Description: Saves the voltage clamp baselines of each cell to the local
+baseline archive, so new noise metrics don't have to re-read the NWB files
+-----------------------------------------------------------------------
+"""
+
+
+#-----Imports-----#
+# General imports
+import os
+# File imports
+from functions.archive_functions import BaselineArchive, default_archive_dir, extract_cell_baselines, sample_dtype
+from functions.jem_functions import load_jem_metadata
+from functions.ledger_functions import due_cells, failed_cell_names, open_failure_ledger, record_run_failures, skipped_cells
+from functions.lims_functions import generate_cell_paths
+from functions.parallel_functions import run_cells
+from functions.plan_functions import plan_cells, print_plan
+from functions.runlog_functions import print_run_summary, start_run_log
+# Test imports
+import time # To measure program execution time
+
+
+# Directories
+json_data_dir  = "//allen/programs/celltypes/workgroups/279/Patch-Seq/ivscc-data-warehouse/data-sources/jem_lims_metadata.csv"
+nwb_index_dir = os.path.join(os.path.expanduser("~"), ".ephys-noise-analysis", "nwb_index.sqlite") # Local, so it is fast to check
+run_log_dir = os.path.join(os.path.expanduser("~"), ".ephys-noise-analysis", "run_logs") # One JSON-lines file of stage timings per run
+failure_ledger_dir = os.path.join(os.path.expanduser("~"), ".ephys-noise-analysis", "failure_ledger.sqlite") # Failed cells and when to retry them
+
+# Settings
+workers = 4 # Number of worker processes (1 runs the cells one at a time in this process)
+cell_timeout = 600 # Seconds a cell may take before it is skipped
+
+# Lists
+jem_fields = ["jem-date_patch", "jem-date_patch_y", "jem-date_patch_m", "jem-date_patch_d", "jem-id_cell_specimen", "jem-id_patched_cell_container", "jem-status_success_failure"]
+job = "baseline_archive"
+
+
+def main(year=None, start_date=None, end_date=None, cells=None, rigs=None, workers=workers, archive_dir=default_archive_dir,
+         index_path=nwb_index_dir, ledger_path=failure_ledger_dir, plan=False):
+    """
+    Archives the baselines of every cell patched in the given year and date range
+    (every cell by default) that isn't in the archive yet.
+
+    Parameters:
+        year (int): keep this patch year only (None for every year).
+        start_date (date): the first patch date (optional).
+        end_date (date): the last patch date (optional).
+        cells (list): process these cells only (optional).
+        rigs (list): process the cells of these rigs only (jem-id_rig_number, optional).
+        workers (int): the number of worker processes.
+        archive_dir (string): a string specifying the baseline archive directory.
+        index_path (string): a string specifying the NWB index.
+        ledger_path (string): a string specifying the failure ledger.
+        plan (bool): only report what would be done (no NWB file is opened).
+    """
+
+    # Read the filtered data source (from a local snapshot, refreshed only when the csv changes)
+    jem_df = load_jem_metadata(json_data_dir, year=year, start_date=start_date, end_date=end_date, fields=jem_fields, cells=cells, rigs=rigs)
+
+    # Gather list of experiments based on the filtered pandas dataframe
+    cell_list = jem_df["jem-id_cell_specimen"].tolist()
+
+    with BaselineArchive(archive_dir) as archive:
+        # Cells already in the archive are skipped
+        archived_cells = archive.cells()
+        # Cells that failed before wait out their backoff
+        ledger_conn = open_failure_ledger(ledger_path)
+        if plan:
+            print_plan(plan_cells(cell_list, archived_cells, index_path, failed_cells=failed_cell_names(ledger_conn, job),
+                                  skipped_cells=set(skipped_cells(ledger_conn, job))), job)
+            return
+
+        # Log stage timings, counters and failure reasons for this run
+        start_run_log(run_log_dir, job)
+        new_cells = due_cells(ledger_conn, job, [cell_name for cell_name in cell_list if cell_name not in archived_cells])
+        # Resolve every storage directory up front in a few bulk LIMS queries
+        cell_paths = generate_cell_paths(new_cells)
+        tasks = [(cell_name, cell_paths.get(cell_name), index_path) for cell_name in new_cells]
+        print(f"{len(archived_cells.intersection(cell_list))} cells are already in the archive.")
+
+        written = set()
+        num_samples = 0
+        start = time.time()
+        # Workers return the segments, which are appended here (the archive has one writer)
+        for (cell_name, path, _), sweeps in run_cells(extract_cell_baselines, tasks, workers=workers, timeout=cell_timeout):
+            if sweeps:
+                num_samples += archive.append(cell_name, sweeps)
+                written.add(cell_name)
+
+        # Failed cells get a later retry date, archived cells leave the ledger
+        record_run_failures(ledger_conn, job, new_cells, written)
+
+    print(f"{len(written)} cells ({num_samples * sample_dtype.itemsize / 1024**2:.1f} MB) added to {archive_dir}.")
+    print("\nThe for loop was executed in", round(((time.time()-start)/60), 2), "minutes.")
+    print_run_summary()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+-----------------------------------------------------------------------
+File name: generate_cell_metrics.py
+Maintainer: Ramkumar Rajanbabu
+-----------------------------------------------------------------------
+Developer: Ramkumar Rajanbabu
+Date/time created: 10/17/2026
+Description: Template for generating noise_metrics_2023.csv,
+noise_psd_metrics_2023.csv and power_60hz_metrics_2023.csv from one pass
+over each NWB file
+-----------------------------------------------------------------------
+"""
+
+
+#-----Imports-----#
+# General imports
+import os
+import pandas as pd
+# File imports
+from functions.collector_functions import MetricsCollector
+from functions.jem_functions import load_jem_metadata
+from functions.ledger_functions import due_cells, failed_cell_names, open_failure_ledger, record_run_failures, skipped_cells
+from functions.lims_functions import generate_cell_paths
+from functions.parallel_functions import run_cells
+from functions.pipeline_functions import extract_cell_metrics, metrics_version
+from functions.plan_functions import plan_cells, print_plan
+from functions.runlog_functions import print_run_summary, start_run_log
+from functions.store_functions import export_metrics_csv, open_metrics_store, stored_cell_names
+# Test imports
+import time # To measure program execution time
+
+
+# Directories
+json_data_dir  = "//allen/programs/celltypes/workgroups/279/Patch-Seq/ivscc-data-warehouse/data-sources/jem_lims_metadata.csv"
+noise_data_dir = "//allen/programs/celltypes/workgroups/279/Patch-Seq/ivscc-data-warehouse/data-sources/noise_metrics_2023.csv"
+power_60hz_data_dir = "//allen/programs/celltypes/workgroups/279/Patch-Seq/ivscc-data-warehouse/data-sources/power_60hz_metrics_2023.csv"
+psd_data_dir = "//allen/programs/celltypes/workgroups/279/Patch-Seq/ivscc-data-warehouse/data-sources/noise_psd_metrics_2023.csv"
+nwb_index_dir = os.path.join(os.path.expanduser("~"), ".ephys-noise-analysis", "nwb_index.sqlite") # Local, so it is fast to check
+store_dir = os.path.join(os.path.expanduser("~"), ".ephys-noise-analysis", "metrics_store.sqlite") # Keyed on cell_name, exported to the csvs
+run_log_dir = os.path.join(os.path.expanduser("~"), ".ephys-noise-analysis", "run_logs") # One JSON-lines file of stage timings per run
+metric_cache_dir = os.path.join(os.path.expanduser("~"), ".ephys-noise-analysis", "metric_cache.sqlite") # Keyed on NWB file and metrics_version
+failure_ledger_dir = os.path.join(os.path.expanduser("~"), ".ephys-noise-analysis", "failure_ledger.sqlite") # Failed cells and when to retry them
+
+# Settings
+workers = 4 # Number of worker processes (1 runs the cells one at a time in this process)
+cell_timeout = 600 # Seconds a cell may take before it is skipped
+batch_size = 50 # Rows written to the store per transaction (at most this many are lost on a crash)
+reprocess = False # Recompute cells already in the store (unchanged files come from the metric cache)
+
+# Lists
+jem_fields = ["jem-date_patch", "jem-date_patch_y", "jem-date_patch_m", "jem-date_patch_d", "jem-id_cell_specimen", "jem-id_patched_cell_container", "jem-status_success_failure", "jem-id_rig_number"]
+sweep_cols= ["cell_name", "inbath_long_rms", "inbath_short_rms", "cellatt_long_rms", "cellatt_short_rms", "breakin_long_rms", "breakin_short_rms"]
+noise_cols= ["jem-date_patch", "cell_name", "inbath_long_rms", "inbath_short_rms", "cellatt_long_rms", "cellatt_short_rms", "breakin_long_rms", "breakin_short_rms"]
+power_cols = ["jem-date_patch", "cell_name", "average_power_60hz"]
+psd_sweep_cols = ["cell_name", "inbath_psd_60hz", "inbath_psd_120hz", "inbath_psd_180hz", "inbath_broadband_rms", "cellatt_psd_60hz", "cellatt_psd_120hz", "cellatt_psd_180hz", "cellatt_broadband_rms", "breakin_psd_60hz", "breakin_psd_120hz", "breakin_psd_180hz", "breakin_broadband_rms"]
+psd_cols = ["jem-date_patch"] + psd_sweep_cols
+noise_table = "noise_metrics"
+power_table = "power_60hz_metrics"
+psd_table = "noise_psd_metrics"
+job = "cell_metrics"
+
+
+def main(year=2023, start_date=None, end_date=None, cells=None, rigs=None, workers=workers, store_path=store_dir,
+         cache_path=metric_cache_dir, index_path=nwb_index_dir, ledger_path=failure_ledger_dir, reprocess=reprocess, plan=False):
+    """
+    Opens each new cell's NWB file once and writes the noise metrics, the noise
+    spectrum (60/120/180 Hz band power) metrics and the power60HzRatio metrics.
+
+    Parameters:
+        year (int): keep this patch year only (None for every year).
+        start_date (date): the first patch date (optional).
+        end_date (date): the last patch date (optional).
+        cells (list): process these cells only (optional).
+        rigs (list): process the cells of these rigs only (jem-id_rig_number, optional).
+        workers (int): the number of worker processes.
+        store_path (string): a string specifying the metrics store.
+        cache_path (string): a string specifying the metric cache (None to always compute).
+        index_path (string): a string specifying the NWB index.
+        ledger_path (string): a string specifying the failure ledger.
+        reprocess (bool): recompute cells already in the store.
+        plan (bool): only report what would be done (no NWB file is opened).
+    """
+
+    # Read the filtered data source (from a local snapshot, refreshed only when the csv changes)
+    jem_df = load_jem_metadata(json_data_dir, year=year, start_date=start_date, end_date=end_date, fields=jem_fields, cells=cells, rigs=rigs)
+
+    # Gather list of experiments based on the filtered pandas dataframe
+    cell_list = jem_df["jem-id_cell_specimen"].tolist()
+
+    # Stores keyed on cell_name (seeded from the csvs the first time)
+    store_conn = open_metrics_store(store_path, noise_table, noise_cols, seed_csv=noise_data_dir)
+    open_metrics_store(store_path, power_table, power_cols, seed_csv=power_60hz_data_dir).close()
+    open_metrics_store(store_path, psd_table, psd_cols, seed_csv=psd_data_dir).close()
+    # A cell is opened again only if one of its outputs is missing (or everything is reprocessed)
+    done_cells = set() if reprocess else (stored_cell_names(store_conn, noise_table) & stored_cell_names(store_conn, power_table)
+                                          & stored_cell_names(store_conn, psd_table))
+    # Cells that failed before wait out their backoff
+    ledger_conn = open_failure_ledger(ledger_path)
+    if plan:
+        print_plan(plan_cells(cell_list, done_cells, index_path, cache_path, metrics_version,
+                              failed_cells=failed_cell_names(ledger_conn, job), skipped_cells=set(skipped_cells(ledger_conn, job))), job)
+        return
+
+    # Log stage timings, counters and failure reasons for this run
+    start_run_log(run_log_dir, job)
+    new_cells = due_cells(ledger_conn, job, [cell_name for cell_name in cell_list if cell_name not in done_cells])
+    # Resolve every storage directory up front in a few bulk LIMS queries
+    cell_paths = generate_cell_paths(new_cells)
+    tasks = [(cell_name, cell_paths.get(cell_name), index_path, cache_path) for cell_name in new_cells]
+    print(f"{len(done_cells.intersection(cell_list))} cells are already in the store.")
+
+    num = 1
+    written = set()
+    start = time.time()
+    with MetricsCollector(store_conn, noise_table, sweep_cols, noise_cols, jem_df, batch_size=batch_size, aggregate_cols=sweep_cols[1:]) as noise_collector, \
+         MetricsCollector(store_conn, power_table, ["cell_name", "average_power_60hz"], power_cols, jem_df, batch_size=batch_size, aggregate_cols=["average_power_60hz"]) as power_collector, \
+         MetricsCollector(store_conn, psd_table, psd_sweep_cols, psd_cols, jem_df, batch_size=batch_size) as psd_collector:
+        for (cell_name, path, index_path, cache_path), result in run_cells(extract_cell_metrics, tasks, workers=workers, timeout=cell_timeout):
+            print(f"***Loop ({num})***")
+            noise_row, power_60hz_values, psd_row = result if result else (None, None, None)
+            if noise_row:
+                noise_collector.add(noise_row)
+            else:
+                print(f"{cell_name}: Missing Voltage Sweep")
+            if psd_row:
+                psd_collector.add(psd_row)
+            if result is not None:
+                # Opened cells without a power60HzRatio result are stored empty so they aren't reopened
+                power_collector.add((cell_name, power_60hz_values[-1] if power_60hz_values else None))
+            if noise_row and psd_row:
+                written.add(cell_name)
+            print()
+            num += 1
+
+    # Failed cells get a later retry date, fully written cells leave the ledger
+    record_run_failures(ledger_conn, job, new_cells, written)
+    # Rewrite the csvs from the store for downstream consumers
+    export_metrics_csv(store_conn, noise_table, noise_cols, noise_data_dir)
+    export_metrics_csv(store_conn, power_table, power_cols, power_60hz_data_dir, dropna=["average_power_60hz"])
+    export_metrics_csv(store_conn, psd_table, psd_cols, psd_data_dir)
+
+    print("\nThe for loop was executed in", round(((time.time()-start)/60), 2), "minutes.")
+    print_run_summary()
+
+
+if __name__ == "__main__":
+    main()
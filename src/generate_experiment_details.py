@@ -5,21 +5,26 @@ Maintainer: Ramkumar Rajanbabu
 -----------------------------------------------------------------------
 Developer: Ramkumar Rajanbabu
 Date/time created: 10/14/2022
-Description: Template for generating experiment-detail.csv
+Description: Template for generating the experiment details dataset
+(typed parquet partitioned by patch date)
 -----------------------------------------------------------------------
 """
 
 
 #-----Imports-----#
 # General imports
-import csv
-import numpy as np
 import os
 import pandas as pd
-import pg8000
 from datetime import datetime, date, timedelta
 # File imports
-from functions.general_functions import generate_cell_path, find_nwb_v2, make_dataset
+from functions.experiment_functions import extract_sweep_details, stored_experiment_cells, write_experiment_partitions
+from functions.general_functions import require_ipfx
+from functions.jem_functions import load_jem_metadata
+from functions.ledger_functions import due_cells, failed_cell_names, open_failure_ledger, record_run_failures, skipped_cells
+from functions.lims_functions import generate_cell_paths
+from functions.parallel_functions import run_cells
+from functions.plan_functions import plan_cells, print_plan
+from functions.runlog_functions import print_run_summary, start_run_log
 # Test imports
 import time # To measure program execution time
 
@@ -31,64 +36,99 @@ date_prev_day = date_today - timedelta(days=1) # datetime.date(2022, 10, 20)
 
 # Directories
 json_data_dir  = "//allen/programs/celltypes/workgroups/279/Patch-Seq/compiled-jem-data/formatted_data/master_jem.csv"
-exp_data_dir = "C:/Users/ramr/Documents/Github/personal_repos/allen_institute_projects/experiment-details.csv"
+exp_data_dir = "C:/Users/ramr/Documents/Github/personal_repos/allen_institute_projects/experiment-details" # Parquet dataset, one date=YYYY-MM-DD folder per patch day
+nwb_index_dir = os.path.join(os.path.expanduser("~"), ".ephys-noise-analysis", "nwb_index.sqlite") # Local, so it is fast to check
+run_log_dir = os.path.join(os.path.expanduser("~"), ".ephys-noise-analysis", "run_logs") # One JSON-lines file of stage timings per run
+failure_ledger_dir = os.path.join(os.path.expanduser("~"), ".ephys-noise-analysis", "failure_ledger.sqlite") # Failed cells and when to retry them
+
+# Settings
+workers = 4 # Number of worker processes (1 runs the cells one at a time in this process)
+cell_timeout = 600 # Seconds a cell may take before it is skipped
+batch_cells = 200 # Cells concatenated per write (one parquet file per patch day per batch)
 
 # Lists
 jem_fields = ["jem-date_patch", "jem-date_patch_y", "jem-date_patch_m", "jem-date_patch_d",
               "jem-id_cell_specimen", "jem-id_patched_cell_container", "jem-status_success_failure"]
-cols = ["cell_name", "sweep_number", "stimulus_units", "bridge_balance_mohm", "leak_pa",
-        "stimulus_scale_factor", "stimulus_code", "stimulus_code_ext",
-        "clamp_mode", "stimulus_name"]
-
-# Read data source as a pandas dataframe
-jem_df = pd.read_csv(json_data_dir, usecols=jem_fields, low_memory=False)
-# Filters
-jem_df = jem_df.loc[jem_df["jem-status_success_failure"] == "SUCCESS"]
-#jem_df = jem_df.loc[jem_df["jem-status_patch_tube"] == "Patch Tube"]
-jem_df = jem_df.loc[jem_df["jem-date_patch_y"] == 2022]
-# Clean column of duplicates and NAs
-jem_df.drop_duplicates(subset=["jem-id_cell_specimen"], inplace=True)
-jem_df.dropna(subset=["jem-id_cell_specimen"], inplace=True)
-
-# Filters dataframe to user specified date
-jem_df = jem_df[jem_df["jem-date_patch"].str.contains(date_prev_day.strftime("%m/%d/%Y"))]
-
-# Gather list of experiments based on the filtered pandas dataframe
-cell_list = jem_df["jem-id_cell_specimen"].tolist()
-len(cell_list)
-
-
-exp_details_df = pd.read_csv(exp_data_dir)
-
-num = 1
-start = time.time()
-
-for cell_name in cell_list:
-    if cell_name not in list(exp_details_df["cell_name"]):
-        print(f"***Loop ({num})***")
-        path = generate_cell_path(cell_name)
-        if path:
-            path = '/' + path[0] # '/' + '/allen...' = '//allen...'
-            nwb2_filepath = find_nwb_v2(path)
-            # Terminal print statements
-            #print(f"Cell name: {cell_name}")
-            #print(f"File path: {nwb2_filepath}")
-            if nwb2_filepath:
-                dataset = make_dataset(cell_name, nwb2_filepath)
-
-        df = dataset.sweep_table
-        df["cell_name"] = cell_name
-        df = df[cols]
-
-        new_data_df = pd.DataFrame(columns=cols)
-        new_data_df = new_data_df.append(df, ignore_index=True)
-        new_data_df.to_csv("experiment-details.csv", mode="a", index=False, header=False)
-        print()
-
-        num += 1
-
-if cell_name in list(exp_details_df["cell_name"]):
-    print("The program did not run because there is already a cell name in the csv.")
-else:
-    print(f"The loop ran {num} experiments.")
+job = "experiment_details"
+
+
+def main(start_date=date_prev_day, end_date=date_prev_day, year=2022, cells=None, rigs=None, workers=workers,
+         out_dir=exp_data_dir, index_path=nwb_index_dir, ledger_path=failure_ledger_dir, plan=False):
+    """
+    Writes the sweep table of each cell patched in a date range (yesterday by
+    default) that isn't in the dataset yet.
+
+    Parameters:
+        start_date (date): the first patch date (default: yesterday, None for no limit).
+        end_date (date): the last patch date (default: yesterday, None for no limit).
+        year (int): keep this patch year only (None for every year).
+        cells (list): process these cells only (optional).
+        rigs (list): process the cells of these rigs only (jem-id_rig_number, optional).
+        workers (int): the number of worker processes.
+        out_dir (string): a string specifying the parquet dataset directory.
+        index_path (string): a string specifying the NWB index.
+        ledger_path (string): a string specifying the failure ledger.
+        plan (bool): only report what would be done (no NWB file is opened).
+    """
+
+    # Read the filtered data source (from a local snapshot, refreshed only when the csv changes)
+    jem_df = load_jem_metadata(json_data_dir, year=year, start_date=start_date, end_date=end_date, fields=jem_fields, cells=cells, rigs=rigs)
+
+    # Gather list of experiments based on the filtered pandas dataframe
+    cell_list = jem_df["jem-id_cell_specimen"].tolist()
+    patch_days = dict(zip(cell_list, jem_df["date_patch"].dt.strftime("%Y-%m-%d").fillna("unknown")))
+
+    # Cells already in the dataset are skipped (a set, so each check is O(1))
+    done_cells = stored_experiment_cells(out_dir)
+    # Cells that failed before wait out their backoff
+    ledger_conn = open_failure_ledger(ledger_path)
+    if plan:
+        print_plan(plan_cells(cell_list, done_cells, index_path, failed_cells=failed_cell_names(ledger_conn, job),
+                              skipped_cells=set(skipped_cells(ledger_conn, job))), job)
+        return
+
+    # Log stage timings, counters and failure reasons for this run
+    start_run_log(run_log_dir, job)
+    new_cells = due_cells(ledger_conn, job, [cell_name for cell_name in cell_list if cell_name not in done_cells])
+    # Resolve every storage directory up front in a few bulk LIMS queries
+    cell_paths = generate_cell_paths(new_cells)
+    tasks = [(cell_name, cell_paths.get(cell_name), index_path) for cell_name in new_cells]
+    print(f"{len(done_cells.intersection(cell_list))} cells are already in the dataset.")
+    if tasks:
+        # The sweep tables come from ipfx datasets; stop before any cell is counted as failed if it is missing
+        require_ipfx()
+
+    sweep_dfs = []
+    written = set()
+    num_cells = 0
+    num_sweeps = 0
+    start = time.time()
+
+    def write_batch():
+        # One concat per batch instead of one append per cell
+        batch_df = pd.concat(sweep_dfs, ignore_index=True)
+        write_experiment_partitions(batch_df, batch_df["cell_name"].map(patch_days), out_dir)
+        sweep_dfs.clear()
+        return len(batch_df)
+
+    for (cell_name, path, _), sweep_df in run_cells(extract_sweep_details, tasks, workers=workers, timeout=cell_timeout):
+        if sweep_df is None or not len(sweep_df):
+            print(f"{cell_name}: no sweep table")
+            continue
+        sweep_dfs.append(sweep_df)
+        written.add(cell_name)
+        num_cells += 1
+        if len(sweep_dfs) >= batch_cells:
+            num_sweeps += write_batch()
+    if sweep_dfs:
+        num_sweeps += write_batch()
+    # Failed cells get a later retry date, written cells leave the ledger
+    record_run_failures(ledger_conn, job, new_cells, written)
+
+    print(f"{num_sweeps} sweeps of {num_cells} cells written to {out_dir}.")
     print("\nThe for loop was executed in", round(((time.time()-start)/60), 2), "minutes.")
+    print_run_summary()
+
+
+if __name__ == "__main__":
+    main()
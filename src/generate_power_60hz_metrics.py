@@ -12,157 +12,149 @@ Description: Template for generating power_60hz_metrics_2023.csv
 
 #-----Imports-----#
 # General imports
-import h5py
-import numpy as np
 import os
-import pandas as pd
-import pg8000
-from datetime import datetime, date, timedelta
 # File imports
-from ipfx.dataset.create import create_ephys_data_set, get_nwb_version
+from functions.collector_functions import MetricsCollector
+from functions.jem_functions import load_jem_metadata
+from functions.ledger_functions import due_cells, failed_cell_names, open_failure_ledger, record_run_failures, skipped_cells
+from functions.lims_functions import generate_cell_paths
+from functions.parallel_functions import run_cells
+from functions.pipeline_functions import extract_cell_power_60hz
+from functions.plan_functions import plan_cells, print_plan
+from functions.runlog_functions import print_run_summary, start_run_log
+from functions.shard_functions import default_shard_dir, find_partials, finish_shard, merge_partials, select_shard_cells, shard_partial_path, start_shard
+from functions.store_functions import export_metrics_csv, open_metrics_store, stored_cell_names
 # Test imports
 import time # To measure program execution time
 
 
-# Functions
-def generate_cell_path(cellname):
+# Directories
+json_data_dir  = "//allen/programs/celltypes/workgroups/279/Patch-Seq/ivscc-data-warehouse/data-sources/jem_lims_metadata.csv"
+power_60hz_data_dir = "//allen/programs/celltypes/workgroups/279/Patch-Seq/ivscc-data-warehouse/data-sources/power_60hz_metrics_2023.csv"
+nwb_index_dir = os.path.join(os.path.expanduser("~"), ".ephys-noise-analysis", "nwb_index.sqlite") # Local, so it is fast to check
+store_dir = os.path.join(os.path.expanduser("~"), ".ephys-noise-analysis", "metrics_store.sqlite") # Keyed on cell_name, exported to power_60hz_data_dir
+run_log_dir = os.path.join(os.path.expanduser("~"), ".ephys-noise-analysis", "run_logs") # One JSON-lines file of stage timings per run
+failure_ledger_dir = os.path.join(os.path.expanduser("~"), ".ephys-noise-analysis", "failure_ledger.sqlite") # Failed cells and when to retry them
+
+# Settings
+workers = 4 # Number of worker processes (1 runs the cells one at a time in this process)
+cell_timeout = 600 # Seconds a cell may take before it is skipped
+batch_size = 50 # Rows written to the store per transaction (at most this many are lost on a crash)
+
+# Lists
+jem_fields = ["jem-date_patch", "jem-date_patch_y", "jem-date_patch_m", "jem-date_patch_d", "jem-id_cell_specimen", "jem-id_patched_cell_container", "jem-status_success_failure", "jem-id_rig_number"]
+power_cols = ["jem-date_patch", "cell_name", "average_power_60hz"]
+power_table = "power_60hz_metrics"
+job = "power_60hz"
+
+
+def main(year=2023, start_date=None, end_date=None, cells=None, rigs=None, workers=workers,
+         store_path=store_dir, csv_path=power_60hz_data_dir, index_path=nwb_index_dir, ledger_path=failure_ledger_dir,
+         shard=None, shard_dir=default_shard_dir, shard_plan=None, plan=False):
     """
-    Generates a file path given a cell name (ex. "Vip-IRES-Cre;Ai14-366688.04.01.01").
-    
+    Stores the last power60HzRatio value of every cell patched in the given year
+    and date range that isn't in the store yet. With shard=(i, N), only the i-th
+    of N shards of the cells is processed, into a partial store (see merge_shards).
+
     Parameters:
-        cellname (string): a string specifying the cell name.
-    
+        year (int): keep this patch year only (None for every year).
+        start_date (date): the first patch date (optional).
+        end_date (date): the last patch date (optional).
+        cells (list): process these cells only (optional).
+        rigs (list): process the cells of these rigs only (jem-id_rig_number, optional).
+        workers (int): the number of worker processes.
+        store_path (string): a string specifying the metrics store.
+        csv_path (string): a string specifying the csv exported from the store.
+        index_path (string): a string specifying the NWB index.
+        ledger_path (string): a string specifying the failure ledger.
+        shard (tuple): (i, N) to process the i-th of N shards of the cells (optional).
+        shard_dir (string): a string specifying the directory of the partial stores.
+        shard_plan (string): a string specifying the plan csv shared by the shards (optional, see select_shard_cells).
+        plan (bool): only report what would be done (no NWB file is opened).
+    """
+
+    # Read the filtered data source (from a local snapshot, refreshed only when the csv changes)
+    jem_df = load_jem_metadata(json_data_dir, year=year, start_date=start_date, end_date=end_date, fields=jem_fields, cells=cells, rigs=rigs)
+
+    # Gather list of experiments based on the filtered pandas dataframe
+    cell_list = jem_df["jem-id_cell_specimen"].tolist()
+    if shard:
+        # This shard's cells, balanced by past timings and NWB file sizes
+        cell_list, shard_costs, shard_plan_id = select_shard_cells(cell_list, *shard, index_path=index_path, log_dir=run_log_dir, job=job, plan_path=shard_plan)
+
+    # Store keyed on cell_name (seeded from the csv the first time)
+    store_conn = open_metrics_store(store_path, power_table, power_cols, seed_csv=csv_path)
+    power_cell_names = stored_cell_names(store_conn, power_table)
+    out_conn = store_conn
+    if shard:
+        # A shard writes to its own partial store, which also counts as done when the shard is run again
+        partial_path = shard_partial_path(shard_dir, job, *shard)
+        if not plan or os.path.exists(partial_path):
+            out_conn = open_metrics_store(partial_path, power_table, power_cols)
+            power_cell_names |= stored_cell_names(out_conn, power_table)
+    # Cells that failed before wait out their backoff
+    ledger_conn = open_failure_ledger(ledger_path)
+    if plan:
+        print_plan(plan_cells(cell_list, power_cell_names, index_path, failed_cells=failed_cell_names(ledger_conn, power_table),
+                              skipped_cells=set(skipped_cells(ledger_conn, power_table))), job)
+        return
+
+    # Log stage timings, counters and failure reasons for this run
+    start_run_log(run_log_dir, job)
+    if shard:
+        start_shard(out_conn, job, *shard, shard_plan_id, [power_table], shard_costs)
+    new_cells = due_cells(ledger_conn, power_table, [cell_name for cell_name in cell_list if cell_name not in power_cell_names])
+    # Resolve every storage directory up front in a few bulk LIMS queries
+    cell_paths = generate_cell_paths(new_cells)
+    tasks = [(cell_name, cell_paths.get(cell_name), index_path) for cell_name in new_cells]
+    print(f"{len(power_cell_names.intersection(cell_list))} cells are already in the store.")
+
+    num = 1
+    written = set()
+    start = time.time()
+    with MetricsCollector(out_conn, power_table, ["cell_name", "average_power_60hz"], power_cols, jem_df, batch_size=batch_size, aggregate_cols=["average_power_60hz"]) as collector:
+        for (cell_name, path, _), row in run_cells(extract_cell_power_60hz, tasks, workers=workers, timeout=cell_timeout):
+            print(f"***Loop ({num})***")
+            # Cells without a power60HzRatio result are stored empty so they aren't reopened
+            if row:
+                collector.add(row)
+                written.add(cell_name)
+            num += 1
+
+    print("\nThe for loop was executed in", round(((time.time()-start)/60), 2), "minutes.")
+
+    # Failed cells get a later retry date, written cells leave the ledger
+    record_run_failures(ledger_conn, power_table, new_cells, written)
+    if shard:
+        # The csv is rewritten when the partials are merged
+        finish_shard(out_conn)
+        print(f"{len(written)} cells written to {partial_path}.")
+    else:
+        # Rewrite the csv from the store for downstream consumers
+        export_metrics_csv(store_conn, power_table, power_cols, csv_path, dropna=["average_power_60hz"])
+    print_run_summary()
+
+
+def merge_shards(shard_dir=default_shard_dir, store_path=store_dir, csv_path=power_60hz_data_dir):
+    """
+    Merges the partial stores of the shards in shard_dir into the store (a cell in
+    several partials keeps its newest row) and rewrites the csv from the store.
+
     Returns:
-        result (list): a list with a single string specifying the file path.
+        counts (dict): table -> rows merged.
     """
-    
-    conn = pg8000.connect(user="limsreader", host="limsdb2", database="lims2", password="limsro", port=5432)
-    cur = conn.cursor()
-    cur.execute(
-    """SELECT err.storage_directory AS path 
-    FROM specimens cell 
-    JOIN ephys_roi_results err ON err.id = cell.ephys_roi_result_id 
-    WHERE cell.name LIKE '{}'
-    """.format(cellname))
-
-    result = cur.fetchone()
-    cur.close()
-    conn.close()
-    
-    if result != None:
-        return result
-
-
-def find_nwb_v2(path):
-    nwb2_file = None
-    for root, dirs, files in os.walk(path):
-        for fil in files:
-            if fil.endswith(".nwb"):
-                test_nwb_name = os.path.join(path, fil)
-                try:
-                    test_nwb_version = get_nwb_version(test_nwb_name)
-                    nwb_version = test_nwb_version['major']
-                    if nwb_version == 2:
-                        nwb2_file = path + fil
-                except OSError as e:
-                    pass
-        return nwb2_file
-
-# Dates
-dt_today = datetime.today() # datetime.datetime(2022, 10, 21, 8, 22, 9, 517314)
-date_today = dt_today.date() # datetime.date(2022, 10, 21)
-date_prev_day = date_today - timedelta(days=1) # datetime.date(2022, 10, 20)
 
-# Directories
-json_data_dir  = "//allen/programs/celltypes/workgroups/279/Patch-Seq/ivscc-data-warehouse/data-sources/jem_lims_metadata.csv"
-power_60hz_data_dir = "//allen/programs/celltypes/workgroups/279/Patch-Seq/ivscc-data-warehouse/data-sources/power_60hz_metrics_2023.csv"
+    partials = find_partials(shard_dir, job)
+    if not partials:
+        print(f"No {job} partials in {shard_dir}.")
+        return {}
+    counts = merge_partials(store_path, partials, seed_csvs={power_table: csv_path})
+    store_conn = open_metrics_store(store_path, power_table, power_cols, seed_csv=csv_path)
+    export_metrics_csv(store_conn, power_table, power_cols, csv_path, dropna=["average_power_60hz"])
+    store_conn.close()
+    print(f"{len(partials)} partials of plan {partials[0]['plan_id']} merged: " + ", ".join(f"{num} {table} rows" for table, num in counts.items()))
+    return counts
 
-# Lists
-jem_fields = ["jem-date_patch", "jem-date_patch_y", "jem-date_patch_m", "jem-date_patch_d", "jem-id_cell_specimen", "jem-id_patched_cell_container", "jem-status_success_failure"]
-sweep_cols= ["cell_name", "inbath_long_rms", "inbath_short_rms", "cellatt_long_rms", "cellatt_short_rms", "breakin_long_rms", "breakin_short_rms"]
-noise_cols= ["jem-date_patch", "cell_name", "inbath_long_rms", "inbath_short_rms", "cellatt_long_rms", "cellatt_short_rms", "breakin_long_rms", "breakin_short_rms"]
-
-# Read data source as a pandas dataframe
-jem_df = pd.read_csv(json_data_dir, usecols=jem_fields, low_memory=False)
-# Filters
-jem_df = jem_df.loc[jem_df["jem-status_success_failure"] == "SUCCESS"]
-#jem_df = jem_df.loc[jem_df["jem-status_patch_tube"] == "Patch Tube"]
-jem_df = jem_df.loc[jem_df["jem-date_patch_y"] == 2023]
-# Clean column of duplicates and NAs
-jem_df.drop_duplicates(subset=["jem-id_cell_specimen"], inplace=True)
-jem_df.dropna(subset=["jem-id_cell_specimen"], inplace=True)
-# Sort values by date
-jem_df.sort_values(by=["jem-date_patch"], ascending=True, inplace=True)
-
-# Filters dataframe to user specified date
-#jem_df = jem_df[jem_df["jem-date_patch"].str.contains(date_prev_day.strftime("%m/%d/%Y"))]
-
-# Gather list of experiments based on the filtered pandas dataframe
-cell_list = jem_df["jem-id_cell_specimen"].tolist()
-len(cell_list)
-
-power_60hz_dict = {}
-last_nb_layer = 8
-
-num = 1
-start = time.time()
-for cell_name in cell_list:
-    cell_values_list = []
-    
-    print(f"***Loop ({num})***")
-    path = generate_cell_path(cell_name)
-    if path:
-        # ['/allen'] to '/allen' by using path[0]
-        path = '/' + path[0] # '/' + '/allen...' = '//allen...'
-        nwb2_filepath = find_nwb_v2(path)
-        # Terminal print statements
-        print(f"Cell name: {cell_name}")
-        print(f"File path: {nwb2_filepath}")
-        
-        try:
-            # Use nwb2_filepath to find hdf5 file
-            h5f5_file = h5py.File(nwb2_filepath, "r")
-        
-            # Use hdf5_file to find the TextualResultsKeys
-            textual_results_keys = h5f5_file["general/results/textualResultsKeys"]
-        
-            keys_list = []
-            search_str = "Sweep Formula store [power60HzRatio]"
-            for k in textual_results_keys[0]:
-                keys_list.append(k)
-        
-            if search_str in keys_list:
-                power60idx = keys_list.index(search_str)
-        
-                # Use hdf5_file to find the TextualResultsValues
-                textual_results_values = h5f5_file["general/results/textualResultsValues"]
-
-                for k in range(len(textual_results_values)):
-                    # k = ?
-                    if len(textual_results_values[k][power60idx][last_nb_layer]) > 0:
-                        cell_values_list.append(textual_results_values[k][power60idx][last_nb_layer])
-
-                # Remove ";" from each string in the cell_values_list
-                cell_values_list = [sub[: -1] for sub in cell_values_list]
-                # Convert all items in list from string to float
-                cell_values_list = [float(x) for x in cell_values_list]
-
-                # Create a dictionary (power_60hz_dict) with the last value from cell_values_list
-                power_60hz_dict[cell_name] = cell_values_list[-1]
-            else:
-                pass
-        except KeyError as e:
-            pass
-        num += 1
-
-print("\nThe for loop was executed in", round(((time.time()-start)/60), 2), "minutes.")
-
-# Change dictionary to a pandas dataframe
-df = pd.DataFrame(power_60hz_dict.items(), columns=["cell_name", "average_power_60hz"])
-# Merge dataframes to get the date column
-merged_cols = ["jem-date_patch", "cell_name", "average_power_60hz"]
-merged_df = pd.merge(left=df, right=jem_df, how="left", left_on="cell_name", right_on="jem-id_cell_specimen")
-merged_df = merged_df[merged_cols]
-
-# Convert dataframe to csv
-merged_df.to_csv(path_or_buf=power_60hz_data_dir, index=False)
+
+if __name__ == "__main__":
+    main()
@@ -16,116 +16,20 @@ import csv
 import numpy as np
 import os
 import pandas as pd
-import pg8000
 from datetime import datetime, date, timedelta
 # File imports
-from ipfx.dataset.create import create_ephys_data_set, get_nwb_version
+from functions.collector_functions import MetricsCollector
+from functions.general_functions import noise_from_nwb, require_ipfx
+from functions.jem_functions import load_jem_metadata
+from functions.ledger_functions import due_cells, failed_cell_names, open_failure_ledger, record_run_failures, skipped_cells
+from functions.plan_functions import plan_cells, print_plan
+from functions.prefetch_functions import run_prefetch_pipeline
+from functions.rms_functions import noise_from_nwb_h5
+from functions.runlog_functions import print_run_summary, start_run_log
+from functions.store_functions import export_metrics_csv, open_metrics_store, stored_cell_names
 # Test imports
 import time # To measure program execution time
 
-# Functions
-def generate_cell_path(cellname):
-    """
-    Generates a file path given a cell name (ex. "Vip-IRES-Cre;Ai14-366688.04.01.01").
-    
-    Parameters:
-        cellname (string): a string specifying the cell name.
-    
-    Returns:
-        result (list): a list with a single string specifying the file path.
-    """
-    
-    conn = pg8000.connect(user="limsreader", host="limsdb2", database="lims2", password="limsro", port=5432)
-    cur = conn.cursor()
-    cur.execute(
-    """SELECT err.storage_directory AS path 
-    FROM specimens cell 
-    JOIN ephys_roi_results err ON err.id = cell.ephys_roi_result_id 
-    WHERE cell.name LIKE '{}'
-    """.format(cellname))
-
-    result = cur.fetchone()
-    cur.close()
-    conn.close()
-    
-    if result != None:
-        return result
-
-
-def find_nwb_v2(path):
-    nwb2_file = None
-    for root, dirs, files in os.walk(path):
-        for fil in files:
-            if fil.endswith(".nwb"):
-                test_nwb_name = os.path.join(path, fil)
-                try:
-                    test_nwb_version = get_nwb_version(test_nwb_name)
-                    nwb_version = test_nwb_version['major']
-                    if nwb_version == 2:
-                        nwb2_file = path + fil
-                except OSError as e:
-                    pass
-        return nwb2_file
-
-
-def make_dataset(cellname, nwb_path):
-    try:
-        dataset = create_ephys_data_set(nwb_file=nwb_path)
-    except (ValueError, OSError, TypeError):
-        print("can't make dataset for ", cellname)
-        dataset = None
-
-    return dataset
-
-def calculate_std_vs(vs_swp_num_lst):
-    """
-    vs_swp_num_lst (list): a list of sweep numbers
-    """
-    
-    try:
-        # -1 calls the last sweep in the list
-        sweepnum = vs_swp_num_lst[-1]
-        # Create a sweep table dataframe
-        swp_df = dataset.sweep_table 
-        # Select row with the specified sweepnum
-        swp_row_df = swp_df.loc[swp_df["sweep_number"] == sweepnum]
-        # Runs only if the sweep is in voltage clamp
-        if "VoltageClamp" in list(swp_row_df['clamp_mode']):
-            sweep = dataset.sweep(sweepnum)
-            epochs = sweep.epochs
-            samp_rate = sweep.sampling_rate
-
-            test_epoch = epochs["test"]
-            recording_epoch = epochs["recording"]
-            stim_epoch = epochs["stim"]
-            experiment_epoch = epochs["experiment"]
-
-            #bl_long_duration = 0.500 # 500 ms baseline duration
-            bl_short_duration = 0.0015 # 1.5 ms short baseline duration
-            bl_end = int(sweep.epochs['stim'][0]) # same baseline end can be used for both long and short baselines
-            #bl_long_start = int(((bl_end / sweep.sampling_rate) - bl_long_duration) * sweep.sampling_rate)
-            bl_short_start = int(((bl_end / samp_rate) - bl_short_duration) * samp_rate)
-            
-            # New method which doesn't work for older stim sets
-            #bl_long = sweep.i[bl_long_start : bl_end]
-            #long_rms = np.std(bl_long).round(3)
-            
-            # Old method works for older stim sets
-            buffer2 = samp_rate * 0.015
-            bl_long = sweep.i[(int(test_epoch[1]+buffer2)):stim_epoch[0]]
-            long_rms = np.std(bl_long).round(3)
-            
-            # New method that works for old and new stim sets
-            bl_short = sweep.i[bl_short_start : bl_end]
-            short_rms = np.std(bl_short).round(3)
-            
-            #print(bl_long_start, bl_end)
-            return long_rms, short_rms
-
-    except (NameError, TypeError, AttributeError) as e:
-        print("NameError")
-        return None    
-
 
 # Dates
 dt_today = datetime.today() # datetime.datetime(2022, 10, 21, 8, 22, 9, 517314)
@@ -135,90 +39,101 @@ date_prev_day = date_today - timedelta(days=1) # datetime.date(2022, 10, 20)
 # Directories
 json_data_dir  = "//allen/programs/celltypes/workgroups/279/Patch-Seq/ivscc-data-warehouse/data-sources/jem_lims_metadata.csv"
 noise_data_dir = "//allen/programs/celltypes/workgroups/279/Patch-Seq/ivscc-data-warehouse/data-sources/noise_metrics_2023.csv"
+nwb_index_dir = os.path.join(os.path.expanduser("~"), ".ephys-noise-analysis", "nwb_index.sqlite") # Local, so it is fast to check
+noise_store_dir = os.path.join(os.path.expanduser("~"), ".ephys-noise-analysis", "metrics_store.sqlite") # Keyed on cell_name, exported to noise_data_dir
+scratch_dir = os.path.join(os.path.expanduser("~"), ".ephys-noise-analysis", "scratch") # Local copies of the NWB files being processed
+run_log_dir = os.path.join(os.path.expanduser("~"), ".ephys-noise-analysis", "run_logs") # One JSON-lines file of stage timings per run
+failure_ledger_dir = os.path.join(os.path.expanduser("~"), ".ephys-noise-analysis", "failure_ledger.sqlite") # Failed cells and when to retry them
+
+# Settings
+prefetch_limit = 4 # NWB files copied from the share at the same time
+compute_workers = 1 # Worker processes computing the copies
+queue_size = 8 # Cells waiting between stages (bounds the local copies in scratch_dir)
+rms_kernel = "ipfx" # "ipfx" (dataset.sweep) or "h5py" (reads only the baseline windows)
 
 # Lists
-jem_fields = ["jem-date_patch", "jem-date_patch_y", "jem-date_patch_m", "jem-date_patch_d", "jem-id_cell_specimen", "jem-id_patched_cell_container", "jem-status_success_failure"]
+jem_fields = ["jem-date_patch", "jem-date_patch_y", "jem-date_patch_m", "jem-date_patch_d", "jem-id_cell_specimen", "jem-id_patched_cell_container", "jem-status_success_failure", "jem-id_rig_number"]
 sweep_cols= ["cell_name", "inbath_long_rms", "inbath_short_rms", "cellatt_long_rms", "cellatt_short_rms", "breakin_long_rms", "breakin_short_rms"]
 noise_cols= ["jem-date_patch", "cell_name", "inbath_long_rms", "inbath_short_rms", "cellatt_long_rms", "cellatt_short_rms", "breakin_long_rms", "breakin_short_rms"]
+noise_table = "noise_metrics"
+batch_size = 50 # Rows written to the store per transaction (at most this many are lost on a crash)
+job = "rig_noise"
 
-# Read data source as a pandas dataframe
-jem_df = pd.read_csv(json_data_dir, usecols=jem_fields, low_memory=False)
-# Filters
-jem_df = jem_df.loc[jem_df["jem-status_success_failure"] == "SUCCESS"]
-jem_df = jem_df.loc[jem_df["jem-date_patch_y"] == 2023]
-# Clean column of duplicates and NAs
-jem_df.drop_duplicates(subset=["jem-id_cell_specimen"], inplace=True)
-jem_df.dropna(subset=["jem-id_cell_specimen"], inplace=True)
-
-# Filters dataframe to user specified date
-jem_df = jem_df[jem_df["jem-date_patch"].str.contains(date_prev_day.strftime("%m/%d/%Y"))]
-# Sort values by date
-jem_df.sort_values(by=["jem-date_patch"], ascending=True, inplace=True)
-
-# Gather list of experiments based on the filtered pandas dataframe
-cell_list = jem_df["jem-id_cell_specimen"].tolist()
-
-if os.path.exists(noise_data_dir):
-    noise_df = pd.read_csv(noise_data_dir)
-    # Sort values by date
-    noise_df.sort_values(by=["jem-date_patch"], ascending=False, inplace=True)
-
-else:
-    noise_df = pd.DataFrame(columns=noise_cols)
-    noise_df.to_csv(noise_data_dir, mode="a", index=False, header=noise_cols)
-
-# Use the 3 voltage sweep names and use startswith (column=stimulus_code)
-vs_inbath_stim_names = ["EXTPINBATH141203", "EXTPINBATH180424"]
-vs_cellatt_stim_names = ["EXTPCllATT141203", "EXTPCllATT180424"]
-vs_breakin_stim_names = ["EXTPBREAKN141203", "EXTPBREAKN180424"]
-
-num = 1
-start = time.time()
-for cell_name in cell_list:
-    if cell_name not in list(noise_df["cell_name"]):
-        print(f"***Loop ({num})***")
-        path = generate_cell_path(cell_name)
-        if path:
-            # ['/allen'] to '/allen' by using path[0]
-            path = '/' + path[0] # '/' + '/allen...' = '//allen...'
-            nwb2_filepath = find_nwb_v2(path)
-            # Terminal print statements
-            print(f"Cell name: {cell_name}")
-            print(f"File path: {nwb2_filepath}")
-            if nwb2_filepath:
-                dataset = make_dataset(cell_name, nwb2_filepath)
-
-        # Returns the sweep number (column=sweep_number)
-        try:
-            vs_inbath_sweep_nums = dataset.get_sweep_numbers(stimuli=vs_inbath_stim_names)
-            vs_cellatt_sweep_nums = dataset.get_sweep_numbers(stimuli=vs_cellatt_stim_names)
-            vs_breakin_sweep_nums = dataset.get_sweep_numbers(stimuli=vs_breakin_stim_names)
-        except (IndexError) as e:
-            print(f"{cell_name} does not contain a voltage sweep.")
-
-        try: 
-            (inbath_long_rms, inbath_short_rms) = calculate_std_vs(vs_inbath_sweep_nums)
-            (cellatt_long_rms, cellatt_short_rms) = calculate_std_vs(vs_cellatt_sweep_nums)
-            (breakin_long_rms, breakin_short_rms) = calculate_std_vs(vs_breakin_sweep_nums)
-        
-            sweep_df = pd.DataFrame(columns=sweep_cols)
-            row_list = [cell_name, inbath_long_rms, inbath_short_rms, cellatt_long_rms, cellatt_short_rms, breakin_long_rms, breakin_short_rms]
-            row = pd.Series(row_list, index=sweep_df.columns)
-            sweep_df = sweep_df.append(row, ignore_index=True)
-            
-            df = pd.merge(left=sweep_df, right=jem_df, how="left", left_on="cell_name", right_on="jem-id_cell_specimen")
-            df = df[noise_cols]
-            
-            new_data_df = pd.DataFrame(columns=noise_cols)
-            new_data_df = new_data_df.append(df, ignore_index=True)
-            new_data_df.to_csv(noise_data_dir, mode="a", index=False, header=False)
-            print()
-        
-        except (NameError, TypeError) as e:
-            print("Missing Voltage Sweep")
+
+def main(start_date=date_prev_day, end_date=date_prev_day, year=2023, cells=None, rigs=None, prefetch=prefetch_limit,
+         workers=compute_workers, kernel=rms_kernel, store_path=noise_store_dir, csv_path=noise_data_dir, index_path=nwb_index_dir,
+         ledger_path=failure_ledger_dir, plan=False):
+    """
+    Appends the noise metrics of the cells patched in a date range (yesterday by
+    default) that aren't in the store yet, streaming the NWB files through local copies.
+
+    Parameters:
+        start_date (date): the first patch date (default: yesterday, None for no limit).
+        end_date (date): the last patch date (default: yesterday, None for no limit).
+        year (int): keep this patch year only (None for every year).
+        cells (list): process these cells only (optional).
+        rigs (list): process the cells of these rigs only (jem-id_rig_number, optional).
+        prefetch (int): the number of NWB files copied from the share at the same time.
+        workers (int): the number of worker processes computing the copies.
+        kernel (string): "ipfx" or "h5py".
+        store_path (string): a string specifying the metrics store.
+        csv_path (string): a string specifying the csv exported from the store.
+        index_path (string): a string specifying the NWB index.
+        ledger_path (string): a string specifying the failure ledger.
+        plan (bool): only report what would be done (no NWB file is opened).
+    """
+
+    # Read the filtered data source (from a local snapshot, refreshed only when the csv changes)
+    jem_df = load_jem_metadata(json_data_dir, year=year, start_date=start_date, end_date=end_date, fields=jem_fields, cells=cells, rigs=rigs)
+
+    # Gather list of experiments based on the filtered pandas dataframe
+    cell_list = jem_df["jem-id_cell_specimen"].tolist()
+
+    # Store keyed on cell_name (seeded from the csv the first time)
+    store_conn = open_metrics_store(store_path, noise_table, noise_cols, seed_csv=csv_path)
+    noise_cell_names = stored_cell_names(store_conn, noise_table)
+    # Cells that failed before wait out their backoff
+    ledger_conn = open_failure_ledger(ledger_path)
+    if plan:
+        print_plan(plan_cells(cell_list, noise_cell_names, index_path, failed_cells=failed_cell_names(ledger_conn, noise_table),
+                              skipped_cells=set(skipped_cells(ledger_conn, noise_table))), job)
+        return
+
+    # Log stage timings, counters and failure reasons for this run
+    start_run_log(run_log_dir, job)
+    new_cells = due_cells(ledger_conn, noise_table, [cell_name for cell_name in cell_list if cell_name not in noise_cell_names])
+    print(f"{len(noise_cell_names.intersection(cell_list))} cells are already in the csv.")
+
+    num = 1
+    written = set()
+    start = time.time()
+    # Leaving the block flushes the buffered rows and aggregates, also if the pipeline raises
+    with MetricsCollector(store_conn, noise_table, sweep_cols, noise_cols, jem_df, batch_size=batch_size, aggregate_cols=sweep_cols[1:]) as collector:
+        def write_row(cell_name, row_list):
+            nonlocal num
+            print(f"***Loop ({num})***")
+            if row_list:
+                collector.add(row_list)
+                written.add(cell_name)
+            else:
+                print(f"{cell_name}: Missing Voltage Sweep")
             print()
-        num += 1
-    else:
-    	print("The for loop did not run because there is already a cell name in the csv.")
+            num += 1
+
+        # LIMS lookups, NWB copies from the share and the rms calculations overlap
+        compute = noise_from_nwb_h5 if kernel == "h5py" else noise_from_nwb
+        if compute is noise_from_nwb and new_cells:
+            require_ipfx()
+        run_prefetch_pipeline(new_cells, compute, write_row, scratch_dir, index_path, prefetch_limit=prefetch, compute_limit=workers,
+                              queue_size=queue_size)
+
+    # Failed cells get a later retry date, written cells leave the ledger
+    record_run_failures(ledger_conn, noise_table, new_cells, written)
+    # Rewrite the csv from the store for downstream consumers
+    export_metrics_csv(store_conn, noise_table, noise_cols, csv_path)
+    print("\nThe for loop was executed in", round(((time.time()-start)/60), 2), "minutes.")
+    print_run_summary()
+
 
-print("\nThe for loop was executed in", round(((time.time()-start)/60), 2), "minutes.")
+if __name__ == "__main__":
+    main()
@@ -12,120 +12,24 @@ Description: Template for generating noise_metrics_2022.csv
 
 #-----Imports-----#
 # General imports
-import csv
-import numpy as np
 import os
 import pandas as pd
-import pg8000
-from datetime import datetime, date, timedelta
+from datetime import datetime, timedelta
 # File imports
-from ipfx.dataset.create import create_ephys_data_set, get_nwb_version
+from functions.collector_functions import MetricsCollector
+from functions.general_functions import extract_cell_noise, require_ipfx
+from functions.jem_functions import load_jem_metadata
+from functions.ledger_functions import due_cells, failed_cell_names, open_failure_ledger, record_run_failures, skipped_cells
+from functions.lims_functions import generate_cell_paths
+from functions.parallel_functions import run_cells
+from functions.plan_functions import plan_cells, print_plan
+from functions.rms_functions import extract_cell_noise_h5, extract_cell_sweep_noise_h5, rep_stats, sweep_types
+from functions.runlog_functions import print_run_summary, start_run_log
+from functions.shard_functions import default_shard_dir, find_partials, finish_shard, merge_partials, select_shard_cells, shard_partial_path, start_shard
+from functions.store_functions import export_metrics_csv, open_metrics_store, stored_cell_names
 # Test imports
 import time # To measure program execution time
 
-# Functions
-def generate_cell_path(cellname):
-    """
-    Generates a file path given a cell name (ex. "Vip-IRES-Cre;Ai14-366688.04.01.01").
-    
-    Parameters:
-        cellname (string): a string specifying the cell name.
-    
-    Returns:
-        result (list): a list with a single string specifying the file path.
-    """
-    
-    conn = pg8000.connect(user="limsreader", host="limsdb2", database="lims2", password="limsro", port=5432)
-    cur = conn.cursor()
-    cur.execute(
-    """SELECT err.storage_directory AS path 
-    FROM specimens cell 
-    JOIN ephys_roi_results err ON err.id = cell.ephys_roi_result_id 
-    WHERE cell.name LIKE '{}'
-    """.format(cellname))
-
-    result = cur.fetchone()
-    cur.close()
-    conn.close()
-    
-    if result != None:
-        return result
-
-
-def find_nwb_v2(path):
-    nwb2_file = None
-    for root, dirs, files in os.walk(path):
-        for fil in files:
-            if fil.endswith(".nwb"):
-                test_nwb_name = os.path.join(path, fil)
-                try:
-                    test_nwb_version = get_nwb_version(test_nwb_name)
-                    nwb_version = test_nwb_version['major']
-                    if nwb_version == 2:
-                        nwb2_file = path + fil
-                except OSError as e:
-                    pass
-        return nwb2_file
-
-
-def make_dataset(cellname, nwb_path):
-    try:
-        dataset = create_ephys_data_set(nwb_file=nwb_path)
-    except (ValueError, OSError, TypeError):
-        print("can't make dataset for ", cellname)
-        dataset = None
-
-    return dataset
-
-def calculate_std_vs(vs_swp_num_lst):
-    """
-    vs_swp_num_lst (list): a list of sweep numbers
-    """
-    
-    try:
-        # -1 calls the last sweep in the list
-        sweepnum = vs_swp_num_lst[-1]
-        # Create a sweep table dataframe
-        swp_df = dataset.sweep_table 
-        # Select row with the specified sweepnum
-        swp_row_df = swp_df.loc[swp_df["sweep_number"] == sweepnum]
-        # Runs only if the sweep is in voltage clamp
-        if "VoltageClamp" in list(swp_row_df['clamp_mode']):
-            sweep = dataset.sweep(sweepnum)
-            epochs = sweep.epochs
-            samp_rate = sweep.sampling_rate
-
-            test_epoch = epochs["test"]
-            recording_epoch = epochs["recording"]
-            stim_epoch = epochs["stim"]
-            experiment_epoch = epochs["experiment"]
-
-            #bl_long_duration = 0.500 # 500 ms baseline duration
-            bl_short_duration = 0.0015 # 1.5 ms short baseline duration
-            bl_end = int(sweep.epochs['stim'][0]) # same baseline end can be used for both long and short baselines
-            #bl_long_start = int(((bl_end / sweep.sampling_rate) - bl_long_duration) * sweep.sampling_rate)
-            bl_short_start = int(((bl_end / samp_rate) - bl_short_duration) * samp_rate)
-            
-            # New method which doesn't work for older stim sets
-            #bl_long = sweep.i[bl_long_start : bl_end]
-            #long_rms = np.std(bl_long).round(3)
-            
-            # Old method works for older stim sets
-            buffer2 = samp_rate * 0.015
-            bl_long = sweep.i[(int(test_epoch[1]+buffer2)):stim_epoch[0]]
-            long_rms = np.std(bl_long).round(3)
-            
-            # New method that works for old and new stim sets
-            bl_short = sweep.i[bl_short_start : bl_end]
-            short_rms = np.std(bl_short).round(3)
-            
-            #print(bl_long_start, bl_end)
-            return long_rms, short_rms
-
-    except (NameError, TypeError, AttributeError) as e:
-        print("NameError")
-        return None    
-
 
 # Dates
 dt_today = datetime.today() # datetime.datetime(2022, 10, 21, 8, 22, 9, 517314)
@@ -135,85 +39,213 @@ date_prev_day = date_today - timedelta(days=1) # datetime.date(2022, 10, 20)
 # Directories
 json_data_dir  = "//allen/programs/celltypes/workgroups/279/Patch-Seq/ivscc-data-warehouse/data-sources/jem_lims_metadata.csv"
 noise_data_dir = "//allen/programs/celltypes/workgroups/279/Patch-Seq/ivscc-data-warehouse/data-sources/noise_metrics_2023.csv"
+noise_rep_data_dir = "//allen/programs/celltypes/workgroups/279/Patch-Seq/ivscc-data-warehouse/data-sources/noise_rep_metrics_2023.csv" # Goes with noise_data_dir
+noise_sweep_data_dir = "//allen/programs/celltypes/workgroups/279/Patch-Seq/ivscc-data-warehouse/data-sources/noise_sweep_metrics_2023.csv" # Goes with noise_data_dir
+nwb_index_dir = os.path.join(os.path.expanduser("~"), ".ephys-noise-analysis", "nwb_index.sqlite") # Local, so it is fast to check
+noise_store_dir = os.path.join(os.path.expanduser("~"), ".ephys-noise-analysis", "metrics_store.sqlite") # Keyed on cell_name, exported to noise_data_dir
+run_log_dir = os.path.join(os.path.expanduser("~"), ".ephys-noise-analysis", "run_logs") # One JSON-lines file of stage timings per run
+failure_ledger_dir = os.path.join(os.path.expanduser("~"), ".ephys-noise-analysis", "failure_ledger.sqlite") # Failed cells and when to retry them
+
+# Settings
+workers = 4 # Number of worker processes (1 runs the cells one at a time in this process)
+cell_timeout = 600 # Seconds a cell may take before it is skipped
+rms_kernel = "ipfx" # "ipfx" (dataset.sweep) or "h5py" (reads only the baseline windows)
+all_sweeps = False # Also store the rms of every repetition of each stimulus (always read with h5py)
 
 # Lists
-jem_fields = ["jem-date_patch", "jem-date_patch_y", "jem-date_patch_m", "jem-date_patch_d", "jem-id_cell_specimen", "jem-id_patched_cell_container", "jem-status_success_failure"]
+jem_fields = ["jem-date_patch", "jem-date_patch_y", "jem-date_patch_m", "jem-date_patch_d", "jem-id_cell_specimen", "jem-id_patched_cell_container", "jem-status_success_failure", "jem-id_rig_number"]
 sweep_cols= ["cell_name", "inbath_long_rms", "inbath_short_rms", "cellatt_long_rms", "cellatt_short_rms", "breakin_long_rms", "breakin_short_rms"]
 noise_cols= ["jem-date_patch", "cell_name", "inbath_long_rms", "inbath_short_rms", "cellatt_long_rms", "cellatt_short_rms", "breakin_long_rms", "breakin_short_rms"]
+noise_rep_cols = ["jem-date_patch", "cell_name"] + [f"{sweep_type}_{col}" for sweep_type in sweep_types for col in
+                   ["sweeps"] + [f"{window}_rms_{stat}" for window in ("long", "short") for stat in rep_stats]]
+noise_sweep_cols = ["cell_name", "sweep_type", "sweep_number", "long_rms", "short_rms"]
+noise_table = "noise_metrics"
+noise_rep_table = "noise_rep_metrics" # Median/min/max across the repetitions, one row per cell
+noise_sweep_table = "noise_sweep_metrics" # One row per sweep
+batch_size = 50 # Rows written to the store per transaction (at most this many are lost on a crash)
+job = "rig_noise_2023"
 
-# Read data source as a pandas dataframe
-jem_df = pd.read_csv(json_data_dir, usecols=jem_fields, low_memory=False)
-# Filters
-jem_df = jem_df.loc[jem_df["jem-status_success_failure"] == "SUCCESS"]
-jem_df = jem_df.loc[jem_df["jem-date_patch_y"] == 2023]
-# Clean column of duplicates and NAs
-jem_df.drop_duplicates(subset=["jem-id_cell_specimen"], inplace=True)
-jem_df.dropna(subset=["jem-id_cell_specimen"], inplace=True)
-
-# Sort values by date
-jem_df.sort_values(by=["jem-date_patch"], ascending=True, inplace=True)
-
-# Gather list of experiments based on the filtered pandas dataframe
-cell_list = jem_df["jem-id_cell_specimen"].tolist()
-
-if os.path.exists(noise_data_dir):
-    noise_df = pd.read_csv(noise_data_dir)
-else:
-    noise_df = pd.DataFrame(columns=noise_cols)
-    noise_df.to_csv(noise_data_dir, mode="a", index=False, header=noise_cols)
-
-# Use the 3 voltage sweep names and use startswith (column=stimulus_code)
-vs_inbath_stim_names = ["EXTPINBATH141203", "EXTPINBATH180424"]
-vs_cellatt_stim_names = ["EXTPCllATT141203", "EXTPCllATT180424"]
-vs_breakin_stim_names = ["EXTPBREAKN141203", "EXTPBREAKN180424"]
-
-num = 1
-start = time.time()
-for cell_name in cell_list:
-    if cell_name not in list(noise_df["cell_name"]):
-        print(f"***Loop ({num})***")
-        path = generate_cell_path(cell_name)
-        if path:
-            # ['/allen'] to '/allen' by using path[0]
-            path = '/' + path[0] # '/' + '/allen...' = '//allen...'
-            nwb2_filepath = find_nwb_v2(path)
-            # Terminal print statements
-            print(f"Cell name: {cell_name}")
-            print(f"File path: {nwb2_filepath}")
-            if nwb2_filepath:
-                dataset = make_dataset(cell_name, nwb2_filepath)
-
-        # Returns the sweep number (column=sweep_number)
-        try:
-            vs_inbath_sweep_nums = dataset.get_sweep_numbers(stimuli=vs_inbath_stim_names)
-            vs_cellatt_sweep_nums = dataset.get_sweep_numbers(stimuli=vs_cellatt_stim_names)
-            vs_breakin_sweep_nums = dataset.get_sweep_numbers(stimuli=vs_breakin_stim_names)
-        except (IndexError) as e:
-            print(f"{cell_name} does not contain a voltage sweep.")
-
-        try: 
-            (inbath_long_rms, inbath_short_rms) = calculate_std_vs(vs_inbath_sweep_nums)
-            (cellatt_long_rms, cellatt_short_rms) = calculate_std_vs(vs_cellatt_sweep_nums)
-            (breakin_long_rms, breakin_short_rms) = calculate_std_vs(vs_breakin_sweep_nums)
-        
-            sweep_df = pd.DataFrame(columns=sweep_cols)
-            row_list = [cell_name, inbath_long_rms, inbath_short_rms, cellatt_long_rms, cellatt_short_rms, breakin_long_rms, breakin_short_rms]
-            row = pd.Series(row_list, index=sweep_df.columns)
-            sweep_df = sweep_df.append(row, ignore_index=True)
-            
-            df = pd.merge(left=sweep_df, right=jem_df, how="left", left_on="cell_name", right_on="jem-id_cell_specimen")
-            df = df[noise_cols]
-            
-            new_data_df = pd.DataFrame(columns=noise_cols)
-            new_data_df = new_data_df.append(df, ignore_index=True)
-            new_data_df.to_csv(noise_data_dir, mode="a", index=False, header=False)
-            print()
-        
-        except (NameError, TypeError) as e:
-            print("Missing Voltage Sweep")
+
+def repetition_csv_paths(csv_path):
+    """
+    Returns the repetition and per sweep csvs that go with a noise csv: the share's
+    csvs for noise_data_dir, else <stem>_rep.csv and <stem>_sweep.csv beside csv_path
+    (so --csv redirects all three).
+
+    Returns:
+        rep_csv_path, sweep_csv_path (string): None if csv_path is None.
+    """
+
+    if csv_path is None:
+        return None, None
+    if csv_path == noise_data_dir:
+        return noise_rep_data_dir, noise_sweep_data_dir
+    stem = os.path.splitext(csv_path)[0]
+    return stem + "_rep.csv", stem + "_sweep.csv"
+
+
+def open_noise_tables(store_path, all_sweeps, csv_path=None):
+    """
+    Opens the noise tables of a store (the repetition tables too with all_sweeps).
+    New tables are seeded from csv_path (and its repetition csvs, see
+    repetition_csv_paths) if it is given.
+
+    Returns:
+        conn (sqlite3.Connection): an open connection to the store.
+        done_cells (set): the cells stored (with their repetitions, with all_sweeps).
+    """
+
+    conn = open_metrics_store(store_path, noise_table, noise_cols, seed_csv=csv_path)
+    done_cells = stored_cell_names(conn, noise_table)
+    if all_sweeps:
+        rep_csv_path, sweep_csv_path = repetition_csv_paths(csv_path)
+        open_metrics_store(store_path, noise_rep_table, noise_rep_cols, seed_csv=rep_csv_path).close()
+        open_metrics_store(store_path, noise_sweep_table, noise_sweep_cols, key=["cell_name", "sweep_number"], seed_csv=sweep_csv_path).close()
+        # Cells stored without their repetitions are done again
+        done_cells &= stored_cell_names(conn, noise_rep_table)
+    return conn, done_cells
+
+
+def main(year=2023, start_date=None, end_date=None, cells=None, rigs=None, workers=workers, kernel=rms_kernel,
+         store_path=noise_store_dir, csv_path=noise_data_dir, index_path=nwb_index_dir, ledger_path=failure_ledger_dir, all_sweeps=all_sweeps,
+         shard=None, shard_dir=default_shard_dir, shard_plan=None, plan=False):
+    """
+    Appends the noise metrics of every cell patched in the given year and date
+    range that isn't in the store yet. With shard=(i, N), only the i-th of N
+    cost-balanced shards of the cells is processed, into a partial store in
+    shard_dir (see merge_shards).
+
+    Parameters:
+        year (int): keep this patch year only (None for every year).
+        start_date (date): the first patch date (optional).
+        end_date (date): the last patch date (optional).
+        cells (list): process these cells only (optional).
+        rigs (list): process the cells of these rigs only (jem-id_rig_number, optional).
+        workers (int): the number of worker processes.
+        kernel (string): "ipfx" or "h5py".
+        store_path (string): a string specifying the metrics store.
+        csv_path (string): a string specifying the csv exported from the store (the repetition
+            csvs are written beside it, see repetition_csv_paths).
+        index_path (string): a string specifying the NWB index.
+        ledger_path (string): a string specifying the failure ledger.
+        all_sweeps (bool): also store the rms of every repetition (noise_rep_table and noise_sweep_table).
+        shard (tuple): (i, N) to process the i-th of N shards of the cells (optional).
+        shard_dir (string): a string specifying the directory of the partial stores.
+        shard_plan (string): a string specifying the plan csv shared by the shards (optional, see select_shard_cells).
+        plan (bool): only report what would be done (no NWB file is opened).
+    """
+
+    # Read the filtered data source (from a local snapshot, refreshed only when the csv changes)
+    jem_df = load_jem_metadata(json_data_dir, year=year, start_date=start_date, end_date=end_date, fields=jem_fields, cells=cells, rigs=rigs)
+
+    # Gather list of experiments based on the filtered pandas dataframe
+    cell_list = jem_df["jem-id_cell_specimen"].tolist()
+    if shard:
+        # This shard's cells, balanced by past timings and NWB file sizes
+        cell_list, shard_costs, shard_plan_id = select_shard_cells(cell_list, *shard, index_path=index_path, log_dir=run_log_dir, job=job, plan_path=shard_plan)
+
+    # Store keyed on cell_name (seeded from the csv the first time); cells already in it are skipped
+    store_conn, noise_cell_names = open_noise_tables(store_path, all_sweeps, csv_path)
+    out_conn = store_conn
+    if shard:
+        # A shard writes to its own partial store, which also counts as done when the shard is run again
+        partial_path = shard_partial_path(shard_dir, job, *shard)
+        if not plan or os.path.exists(partial_path):
+            out_conn, partial_cell_names = open_noise_tables(partial_path, all_sweeps)
+            noise_cell_names |= partial_cell_names
+    # Cells that failed before wait out their backoff
+    ledger_conn = open_failure_ledger(ledger_path)
+    if plan:
+        print_plan(plan_cells(cell_list, noise_cell_names, index_path, failed_cells=failed_cell_names(ledger_conn, noise_table),
+                              skipped_cells=set(skipped_cells(ledger_conn, noise_table))), job)
+        return
+
+    # Log stage timings, counters and failure reasons for this run
+    start_run_log(run_log_dir, job)
+    if shard:
+        start_shard(out_conn, job, *shard, shard_plan_id, [noise_table] + ([noise_rep_table, noise_sweep_table] if all_sweeps else []), shard_costs)
+    new_cells = due_cells(ledger_conn, noise_table, [cell_name for cell_name in cell_list if cell_name not in noise_cell_names])
+    # Resolve every storage directory up front in a few bulk LIMS queries
+    cell_paths = generate_cell_paths(new_cells)
+    tasks = [(cell_name, cell_paths.get(cell_name), index_path) for cell_name in new_cells]
+    print(f"{len(noise_cell_names.intersection(cell_list))} cells are already in the store.")
+
+    num = 1
+    written = set()
+    start = time.time()
+    # Workers return plain metric rows, which are written here in cell_list order
+    if all_sweeps:
+        worker = extract_cell_sweep_noise_h5
+    else:
+        worker = extract_cell_noise_h5 if kernel == "h5py" else extract_cell_noise
+    if worker is extract_cell_noise and tasks:
+        # Stop before any cell is counted as failed if ipfx is missing
+        require_ipfx()
+    with MetricsCollector(out_conn, noise_table, sweep_cols, noise_cols, jem_df, batch_size=batch_size, aggregate_cols=sweep_cols[1:]) as collector, \
+         MetricsCollector(out_conn, noise_rep_table, noise_rep_cols[1:], noise_rep_cols, jem_df, batch_size=batch_size) as rep_collector, \
+         MetricsCollector(out_conn, noise_sweep_table, noise_sweep_cols, noise_sweep_cols, jem_df, batch_size=batch_size, key=["cell_name", "sweep_number"]) as sweep_collector:
+        for (cell_name, path, _), result in run_cells(worker, tasks, workers=workers, timeout=cell_timeout):
+            print(f"***Loop ({num})***")
+            if all_sweeps:
+                # The last sweep's row, the repetition summary and one row per sweep
+                row_list, rep_row, sweep_rows = result or (None, None, [])
+                if rep_row:
+                    rep_collector.add(rep_row)
+                for sweep_row in sweep_rows:
+                    sweep_collector.add(sweep_row)
+            else:
+                row_list = result
+            if row_list:
+                collector.add(row_list)
+                written.add(cell_name)
+            else:
+                print(f"{cell_name}: Missing Voltage Sweep")
             print()
-        num += 1
+            num += 1
+
+    # Failed cells get a later retry date, written cells leave the ledger
+    record_run_failures(ledger_conn, noise_table, new_cells, written)
+    if shard:
+        # The csv is rewritten when the partials are merged
+        finish_shard(out_conn)
+        print(f"{len(written)} cells written to {partial_path}.")
     else:
-    	print("The for loop did not run because there is already a cell name in the csv.")
+        # Rewrite the csv from the store for downstream consumers
+        export_metrics_csv(store_conn, noise_table, noise_cols, csv_path)
+        if all_sweeps:
+            rep_csv_path, sweep_csv_path = repetition_csv_paths(csv_path)
+            export_metrics_csv(store_conn, noise_rep_table, noise_rep_cols, rep_csv_path)
+            export_metrics_csv(store_conn, noise_sweep_table, noise_sweep_cols, sweep_csv_path)
+
+    print("\nThe for loop was executed in", round(((time.time()-start)/60), 2), "minutes.")
+    print_run_summary()
+
+
+def merge_shards(shard_dir=default_shard_dir, store_path=noise_store_dir, csv_path=noise_data_dir):
+    """
+    Merges the partial stores of the shards in shard_dir into the store (a cell in
+    several partials keeps its newest row) and rewrites the csv(s) from the store
+    (the repetition csvs beside csv_path, see repetition_csv_paths).
+
+    Returns:
+        counts (dict): table -> rows merged.
+    """
 
-print("\nThe for loop was executed in", round(((time.time()-start)/60), 2), "minutes.")
+    partials = find_partials(shard_dir, job)
+    if not partials:
+        print(f"No {job} partials in {shard_dir}.")
+        return {}
+    rep_csv_path, sweep_csv_path = repetition_csv_paths(csv_path)
+    counts = merge_partials(store_path, partials, seed_csvs={noise_table: csv_path, noise_rep_table: rep_csv_path, noise_sweep_table: sweep_csv_path})
+    store_conn, _ = open_noise_tables(store_path, noise_rep_table in counts, csv_path)
+    export_metrics_csv(store_conn, noise_table, noise_cols, csv_path)
+    if noise_rep_table in counts:
+        export_metrics_csv(store_conn, noise_rep_table, noise_rep_cols, rep_csv_path)
+        export_metrics_csv(store_conn, noise_sweep_table, noise_sweep_cols, sweep_csv_path)
+    store_conn.close()
+    print(f"{len(partials)} partials of plan {partials[0]['plan_id']} merged: " + ", ".join(f"{num} {table} rows" for table, num in counts.items()))
+    return counts
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
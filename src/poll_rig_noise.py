@@ -0,0 +1,150 @@
+"""
+-----------------------------------------------------------------------
+File name: poll_rig_noise.py
+Maintainer: Ramkumar Rajanbabu
+-----------------------------------------------------------------------
+Developer: Ramkumar Rajanbabu
+Date/time created: 10/17/2026
+Description: Change-driven rig noise: each poll processes only the cells
+that are new in the JEM metadata or got a new or changed NWB file, so late
+uploads are caught without a full-year rescan
+-----------------------------------------------------------------------
+"""
+
+
+#-----Imports-----#
+# General imports
+import os
+import time
+from collections import Counter
+# File imports
+from functions.collector_functions import MetricsCollector
+from functions.general_functions import extract_cell_noise, require_ipfx
+from functions.jem_functions import load_jem_metadata
+from functions.ledger_functions import due_cells, open_failure_ledger, record_run_failures, reset_failures
+from functions.parallel_functions import run_cells
+from functions.poll_functions import default_poll_state_dir, find_changed_cells, lookback_days, open_poll_state, read_poll_mark, record_polled_cells
+from functions.rms_functions import extract_cell_noise_h5
+from functions.runlog_functions import print_run_summary, start_run_log, stop_run_log
+from functions.store_functions import export_metrics_csv, open_metrics_store, stored_cell_names
+
+
+# Directories
+json_data_dir  = "//allen/programs/celltypes/workgroups/279/Patch-Seq/ivscc-data-warehouse/data-sources/jem_lims_metadata.csv"
+noise_data_dir = "//allen/programs/celltypes/workgroups/279/Patch-Seq/ivscc-data-warehouse/data-sources/noise_metrics_2023.csv"
+nwb_index_dir = os.path.join(os.path.expanduser("~"), ".ephys-noise-analysis", "nwb_index.sqlite") # Local, so it is fast to check
+noise_store_dir = os.path.join(os.path.expanduser("~"), ".ephys-noise-analysis", "metrics_store.sqlite") # Keyed on cell_name, exported to noise_data_dir
+run_log_dir = os.path.join(os.path.expanduser("~"), ".ephys-noise-analysis", "run_logs") # One JSON-lines file of stage timings per run
+failure_ledger_dir = os.path.join(os.path.expanduser("~"), ".ephys-noise-analysis", "failure_ledger.sqlite") # Failed cells and when to retry them
+
+# Settings
+workers = 2 # Number of worker processes (a poll usually has a handful of cells)
+cell_timeout = 600 # Seconds a cell may take before it is skipped
+rms_kernel = "h5py" # "ipfx" (dataset.sweep) or "h5py" (reads only the baseline windows)
+poll_minutes = 10 # Minutes between polls with --every
+
+# Lists
+jem_fields = ["jem-date_patch", "jem-date_patch_y", "jem-date_patch_m", "jem-date_patch_d", "jem-id_cell_specimen", "jem-id_patched_cell_container", "jem-status_success_failure", "jem-id_rig_number"]
+sweep_cols= ["cell_name", "inbath_long_rms", "inbath_short_rms", "cellatt_long_rms", "cellatt_short_rms", "breakin_long_rms", "breakin_short_rms"]
+noise_cols= ["jem-date_patch", "cell_name", "inbath_long_rms", "inbath_short_rms", "cellatt_long_rms", "cellatt_short_rms", "breakin_long_rms", "breakin_short_rms"]
+noise_table = "noise_metrics"
+batch_size = 50 # Rows written to the store per transaction (at most this many are lost on a crash)
+job = "rig_noise_poll"
+
+
+def poll_once(jem_path=json_data_dir, rigs=None, lookback=lookback_days, workers=workers, kernel=rms_kernel, store_path=noise_store_dir,
+              csv_path=noise_data_dir, index_path=nwb_index_dir, ledger_path=failure_ledger_dir, state_path=default_poll_state_dir,
+              plan=False, today=None):
+    """
+    Runs one poll: finds the new and changed cells (see find_changed_cells), computes
+    their noise metrics and moves the high-water mark. A poll with nothing to do only
+    reads the JEM snapshot and stats the recent storage directories.
+
+    Parameters:
+        jem_path (string): a string specifying the JEM metadata csv.
+        rigs (list): poll the cells of these rigs only (jem-id_rig_number, optional).
+        lookback (int): the days of known cells whose directories are checked again.
+        workers (int): the number of worker processes.
+        kernel (string): "ipfx" or "h5py".
+        store_path (string): a string specifying the metrics store.
+        csv_path (string): a string specifying the csv exported from the store.
+        index_path (string): a string specifying the NWB index.
+        ledger_path (string): a string specifying the failure ledger.
+        state_path (string): a string specifying the poll state.
+        plan (bool): only report what would be queued (nothing is processed or recorded).
+        today (date): the day of the poll (default: today).
+
+    Returns:
+        written (set): the cells written to the store.
+    """
+
+    # Every SUCCESS cell (the snapshot is only rebuilt when the csv changed)
+    jem_df = load_jem_metadata(jem_path, fields=jem_fields, rigs=rigs)
+    store_conn = open_metrics_store(store_path, noise_table, noise_cols, seed_csv=csv_path)
+    noise_cell_names = stored_cell_names(store_conn, noise_table)
+    state_conn = open_poll_state(state_path)
+    mark = read_poll_mark(state_conn, job)
+
+    queue, polled = find_changed_cells(state_conn, job, jem_df, noise_cell_names, lookback=lookback, today=today)
+    reasons = Counter(reason for _, _, reason in queue)
+    print(time.strftime("%Y-%m-%d %H:%M:%S"), f"{len(polled)} cells checked, {len(queue)} queued"
+          + "".join(f", {num} {reason}" for reason, num in sorted(reasons.items()))
+          + (f" (last patch date {mark['last_date_patch']})" if mark else " (first poll)"))
+    if plan:
+        for cell_name, path, reason in queue:
+            print(f"  {reason:<9}{cell_name}")
+        store_conn.close()
+        state_conn.close()
+        return set()
+
+    ledger_conn = open_failure_ledger(ledger_path)
+    # A new or changed upload is worth trying straight away, whatever the backoff
+    reset_failures(ledger_conn, noise_table, [cell_name for cell_name, _, reason in queue if reason != "new"])
+    cell_paths = {cell_name: path for cell_name, path, _ in queue}
+    new_cells = due_cells(ledger_conn, noise_table, list(cell_paths))
+
+    written = set()
+    if new_cells:
+        # Log stage timings, counters and failure reasons for polls that process cells
+        start_run_log(run_log_dir, job)
+        tasks = [(cell_name, cell_paths[cell_name], index_path) for cell_name in new_cells]
+        worker = extract_cell_noise_h5 if kernel == "h5py" else extract_cell_noise
+        if worker is extract_cell_noise:
+            require_ipfx()
+        with MetricsCollector(store_conn, noise_table, sweep_cols, noise_cols, jem_df, batch_size=batch_size, aggregate_cols=sweep_cols[1:]) as collector:
+            for (cell_name, path, _), row_list in run_cells(worker, tasks, workers=workers, timeout=cell_timeout):
+                if row_list:
+                    collector.add(row_list)
+                    written.add(cell_name)
+        record_run_failures(ledger_conn, noise_table, new_cells, written)
+        if written:
+            export_metrics_csv(store_conn, noise_table, noise_cols, csv_path)
+        print(f"{len(written)} of {len(new_cells)} cells written.")
+        print_run_summary()
+        stop_run_log()
+
+    # The directories as they were before processing, so an upload during the run is caught next time
+    record_polled_cells(state_conn, job, jem_path, jem_df, polled, noise_cell_names | written, index_path)
+    for conn in (store_conn, state_conn, ledger_conn):
+        conn.close()
+    return written
+
+
+def main(every=None, **params):
+    """
+    Polls once, or every `every` minutes until interrupted (Ctrl+C). Parameters are
+    passed to poll_once.
+    """
+
+    while True:
+        poll_once(**params)
+        if not every or params.get("plan"):
+            return
+        try:
+            time.sleep(every * 60)
+        except KeyboardInterrupt:
+            return
+
+
+if __name__ == "__main__":
+    main(every=poll_minutes)
@@ -0,0 +1,20 @@
+"""
+-----------------------------------------------------------------------
+File name: conftest.py
+Maintainer: Ramkumar Rajanbabu
+-----------------------------------------------------------------------
+Developer: Ramkumar Rajanbabu
+Date/time created: 10/17/2026
+Description: Puts src on the path, so the tests import the modules the
+way the scripts do (ex. from functions.lims_functions import ...)
+-----------------------------------------------------------------------
+"""
+
+
+#-----Imports-----#
+# General imports
+import os
+import sys
+
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src"))
@@ -0,0 +1,50 @@
+"""
+-----------------------------------------------------------------------
+File name: test_backfill_functions.py
+Maintainer: Ramkumar Rajanbabu
+-----------------------------------------------------------------------
+Developer: Ramkumar Rajanbabu
+Date/time created: 10/17/2026
+Description: Worker memory reported through run_cells
+-----------------------------------------------------------------------
+"""
+
+
+#-----Imports-----#
+# General imports
+import functools
+import os
+import numpy as np
+import pytest
+# File imports
+from functions.backfill_functions import current_rss_mb, with_rss
+from functions.parallel_functions import run_cells
+
+
+# Lists
+_held = [] # What the worker keeps between cells (like ipfx's leftovers)
+
+
+def leaky_worker(cell_name, num_mb):
+    _held.append(np.ones(int(num_mb * 1024**2 // 8)))
+    return cell_name, os.getpid()
+
+
+@pytest.mark.skipif(current_rss_mb() is None, reason="resident memory can't be read here")
+def test_workers_report_their_memory():
+    parent_rss_mb = current_rss_mb()
+    tasks = [(f"cell_{i}", 100) for i in range(4)]
+    results = [result for task, result in run_cells(functools.partial(with_rss, leaky_worker), tasks, workers=2, isolate=True)]
+
+    assert [row[0] for row, rss_mb in results] == [cell_name for cell_name, num_mb in tasks]
+    assert all(row[1] != os.getpid() for row, rss_mb in results)
+    # Each worker holds the arrays of the cells it ran
+    assert min(rss_mb for row, rss_mb in results) > 100
+    # The parent never held the arrays
+    assert current_rss_mb() - parent_rss_mb < 100
+
+
+def test_with_rss_in_process():
+    (row, rss_mb), = [result for task, result in run_cells(functools.partial(with_rss, leaky_worker), [("cell_0", 1)])]
+    assert row == ("cell_0", os.getpid())
+    assert rss_mb is None or rss_mb > 0
@@ -0,0 +1,83 @@
+"""
+-----------------------------------------------------------------------
+File name: test_backfill_rig_noise.py
+Maintainer: Ramkumar Rajanbabu
+-----------------------------------------------------------------------
+Developer: Ramkumar Rajanbabu
+Date/time created: 10/17/2026
+Description: A chunk with cells waiting for a retry isn't checkpointed,
+so a later run retries them
+-----------------------------------------------------------------------
+"""
+
+
+#-----Imports-----#
+# General imports
+import sqlite3
+import pandas as pd
+# File imports
+import backfill_rig_noise
+from functions import jem_functions, lims_functions
+from functions.backfill_functions import finished_chunks, open_checkpoints
+from functions.fixture_functions import build_fixture_tree, make_lims_stand_in
+from functions.ledger_functions import open_failure_ledger, pending_cells
+from functions.runlog_functions import stop_run_log
+from functions.store_functions import open_metrics_store, stored_cell_names
+
+
+def _run(tmp_path, argv):
+    try:
+        backfill_rig_noise.main(["--from", "2023-03-01", "--to", "2023-03-10", "--chunk-days", "30", "--kernel", "h5py",
+                                 "--workers", "1", "--csv", str(tmp_path / "noise.csv")] + argv)
+    finally:
+        stop_run_log()
+    store_conn = open_metrics_store(backfill_rig_noise.noise_store_dir, backfill_rig_noise.noise_table, backfill_rig_noise.noise_cols)
+    try:
+        open_checkpoints(store_conn)
+        return stored_cell_names(store_conn, backfill_rig_noise.noise_table), finished_chunks(store_conn, backfill_rig_noise.job)
+    finally:
+        store_conn.close()
+
+
+def test_chunk_with_pending_cells_is_run_again(tmp_path, monkeypatch):
+    cell_dirs = build_fixture_tree(str(tmp_path / "tree"), 2, unique_files=2)
+    first_cell, second_cell = cell_dirs
+    jem_path = str(tmp_path / "jem.csv")
+    pd.DataFrame({
+        "jem-date_patch": ["03/01/2023 10:00:00 -0800", "03/02/2023 10:00:00 -0800"],
+        "jem-date_patch_y": 2023,
+        "jem-date_patch_m": 3,
+        "jem-date_patch_d": [1, 2],
+        "jem-id_cell_specimen": list(cell_dirs),
+        "jem-id_patched_cell_container": ["PAS1", "PAS2"],
+        "jem-status_success_failure": "SUCCESS",
+        "jem-id_rig_number": [1, 2],
+    }).to_csv(jem_path, index=False)
+    # The second cell isn't in LIMS yet
+    db_path = str(tmp_path / "lims_stand_in.sqlite")
+    make_lims_stand_in(db_path, {first_cell: cell_dirs[first_cell]})
+    monkeypatch.setattr(lims_functions, "_lims_conn", sqlite3.connect(db_path))
+    monkeypatch.setattr(jem_functions, "snapshot_root", str(tmp_path / "local"))
+    monkeypatch.setattr(backfill_rig_noise, "json_data_dir", jem_path)
+    monkeypatch.setattr(backfill_rig_noise, "run_log_dir", str(tmp_path / "run_logs"))
+    monkeypatch.setattr(backfill_rig_noise, "nwb_index_dir", str(tmp_path / "local" / "nwb_index.sqlite"))
+    monkeypatch.setattr(backfill_rig_noise, "noise_store_dir", str(tmp_path / "local" / "metrics_store.sqlite"))
+    ledger_path = str(tmp_path / "local" / "failure_ledger.sqlite")
+    monkeypatch.setattr(backfill_rig_noise, "failure_ledger_dir", ledger_path)
+
+    stored, done = _run(tmp_path, [])
+    assert stored == {first_cell}
+    assert done == set()
+    ledger_conn = open_failure_ledger(ledger_path)
+    assert pending_cells(ledger_conn, backfill_rig_noise.noise_table, list(cell_dirs)) == [second_cell]
+
+    # The cell shows up in LIMS and its retry is due
+    make_lims_stand_in(db_path, cell_dirs)
+    monkeypatch.setattr(lims_functions, "_lims_conn", sqlite3.connect(db_path))
+    with ledger_conn:
+        ledger_conn.execute("UPDATE failure_ledger SET retry_after = 0")
+    stored, done = _run(tmp_path, [])
+    assert stored == set(cell_dirs)
+    assert len(done) == 1
+    assert pending_cells(ledger_conn, backfill_rig_noise.noise_table, list(cell_dirs)) == []
+    ledger_conn.close()
@@ -0,0 +1,90 @@
+"""
+-----------------------------------------------------------------------
+File name: test_cache_functions.py
+Maintainer: Ramkumar Rajanbabu
+-----------------------------------------------------------------------
+Developer: Ramkumar Rajanbabu
+Date/time created: 10/17/2026
+Description: Metric cache totals, least recently used eviction and the
+deferred last_used marks
+-----------------------------------------------------------------------
+"""
+
+
+#-----Imports-----#
+# General imports
+import sqlite3
+# File imports
+from functions import cache_functions
+from functions.cache_functions import (cache_schema, evict_metric_cache, get_cached_metrics, metric_cache_key, open_metric_cache,
+                                       put_cached_metrics)
+
+
+def _key(tmp_path, i, metrics_version="1"):
+    nwb_path = tmp_path / f"cell_{i}.nwb"
+    if not nwb_path.exists():
+        nwb_path.write_bytes(b"x" * (i + 1))
+    return metric_cache_key(str(nwb_path), metrics_version)
+
+
+def _totals(conn):
+    return conn.execute("SELECT entries, nbytes FROM metric_cache_totals").fetchone()
+
+
+def _counted(conn):
+    return conn.execute("SELECT COUNT(*), COALESCE(SUM(nbytes), 0) FROM metric_cache").fetchone()
+
+
+def test_totals_follow_puts(tmp_path):
+    conn = open_metric_cache(str(tmp_path / "cache.sqlite"))
+    for i in range(5):
+        put_cached_metrics(conn, _key(tmp_path, i), [i, "row"])
+    # Same key again, then a new metric version that replaces the old entry of the path
+    put_cached_metrics(conn, _key(tmp_path, 0), [0, "a longer row"])
+    put_cached_metrics(conn, _key(tmp_path, 1, metrics_version="2"), [1])
+    assert _totals(conn) == _counted(conn)
+    assert _totals(conn)[0] == 5
+    assert get_cached_metrics(conn, _key(tmp_path, 1)) is None
+    assert get_cached_metrics(conn, _key(tmp_path, 1, metrics_version="2")) == [1]
+
+
+def test_least_recently_used_go_first(tmp_path):
+    conn = open_metric_cache(str(tmp_path / "cache.sqlite"))
+    for i in range(10):
+        put_cached_metrics(conn, _key(tmp_path, i), [i], max_entries=10)
+    get_cached_metrics(conn, _key(tmp_path, 0))
+    put_cached_metrics(conn, _key(tmp_path, 10), [10], max_entries=10)
+
+    # Down to 90% of the limit: cells 1 and 2 were used least recently
+    assert _totals(conn) == _counted(conn)
+    assert _totals(conn)[0] == 9
+    assert get_cached_metrics(conn, _key(tmp_path, 0)) == [0]
+    assert get_cached_metrics(conn, _key(tmp_path, 1)) is None
+    assert get_cached_metrics(conn, _key(tmp_path, 2)) is None
+    assert evict_metric_cache(conn, max_entries=10) == 0
+
+
+def test_hits_are_marked_in_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache_functions, "last_used_batch", 3)
+    conn = open_metric_cache(str(tmp_path / "cache.sqlite"))
+    keys = [_key(tmp_path, i) for i in range(3)]
+    for i, key in enumerate(keys):
+        put_cached_metrics(conn, key, [i])
+    marks = dict(conn.execute("SELECT cache_key, last_used FROM metric_cache"))
+
+    get_cached_metrics(conn, keys[0])
+    get_cached_metrics(conn, keys[1])
+    assert dict(conn.execute("SELECT cache_key, last_used FROM metric_cache")) == marks
+    get_cached_metrics(conn, keys[2])
+    assert all(last_used > marks[cache_key] for cache_key, last_used in conn.execute("SELECT cache_key, last_used FROM metric_cache"))
+
+
+def test_totals_of_an_older_cache(tmp_path):
+    cache_path = str(tmp_path / "cache.sqlite")
+    conn = sqlite3.connect(cache_path)
+    conn.execute(cache_schema)
+    conn.executemany("INSERT INTO metric_cache (cache_key, nwb_path, nbytes, last_used) VALUES (?, ?, ?, ?)",
+                     [(f"key_{i}", f"cell_{i}.nwb", 10 * i, i) for i in range(4)])
+    conn.commit()
+    conn.close()
+    assert _totals(open_metric_cache(cache_path)) == (4, 60)
@@ -0,0 +1,65 @@
+"""
+-----------------------------------------------------------------------
+File name: test_experiment_functions.py
+Maintainer: Ramkumar Rajanbabu
+-----------------------------------------------------------------------
+Developer: Ramkumar Rajanbabu
+Date/time created: 10/17/2026
+Description: Parquet partitions of the experiment details
+-----------------------------------------------------------------------
+"""
+
+
+#-----Imports-----#
+# General imports
+import glob
+import os
+import pandas as pd
+import pytest
+# File imports
+from functions.experiment_functions import partition_col, read_experiment_details, write_experiment_partitions
+
+
+def _details(cell_name, num_sweeps):
+    return pd.DataFrame({
+        "cell_name": cell_name,
+        "sweep_number": range(num_sweeps),
+        "stimulus_units": "Amps",
+        "bridge_balance_mohm": 10.0,
+        "leak_pa": 0.0,
+        "stimulus_scale_factor": 1.0,
+        "stimulus_code": "X1PS_SubThresh",
+        "stimulus_code_ext": "X1PS_SubThresh[0]",
+        "clamp_mode": "CurrentClamp",
+        "stimulus_name": "Long Square",
+    })
+
+
+def test_batches_in_the_same_second(tmp_path):
+    pytest.importorskip("pyarrow")
+    out_dir = str(tmp_path / "experiment_details")
+    paths = []
+    # Back to back, so the batches share the timestamp (and pid)
+    for cell_name in ("Cell-1", "Cell-2", "Cell-3"):
+        details_df = _details(cell_name, 4)
+        paths += write_experiment_partitions(details_df, pd.Series(["2023-01-02"] * len(details_df)), out_dir)
+
+    assert len(set(paths)) == 3
+    assert sorted(glob.glob(os.path.join(out_dir, f"{partition_col}=2023-01-02", "*"))) == sorted(paths)
+    details_df = read_experiment_details(out_dir)
+    assert sorted(details_df["cell_name"].astype(str).unique()) == ["Cell-1", "Cell-2", "Cell-3"]
+    assert len(details_df) == 12
+
+
+def test_no_partial_file_on_error(tmp_path, monkeypatch):
+    out_dir = str(tmp_path / "experiment_details")
+
+    def failing_write(self, path, **kwargs):
+        with open(path, "wb") as f:
+            f.write(b"PAR1")
+        raise OSError("No space left on device")
+    monkeypatch.setattr(pd.DataFrame, "to_parquet", failing_write)
+    details_df = _details("Cell-1", 2)
+    with pytest.raises(OSError):
+        write_experiment_partitions(details_df, pd.Series(["2023-01-02"] * len(details_df)), out_dir)
+    assert glob.glob(os.path.join(out_dir, "*", "*")) == []
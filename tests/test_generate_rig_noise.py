@@ -0,0 +1,67 @@
+"""
+-----------------------------------------------------------------------
+File name: test_generate_rig_noise.py
+Maintainer: Ramkumar Rajanbabu
+-----------------------------------------------------------------------
+Developer: Ramkumar Rajanbabu
+Date/time created: 10/17/2026
+Description: Rows computed before the pipeline fails are still stored
+-----------------------------------------------------------------------
+"""
+
+
+#-----Imports-----#
+# General imports
+import sqlite3
+import pandas as pd
+import pytest
+# File imports
+import generate_rig_noise
+from functions import jem_functions, lims_functions
+from functions.fixture_functions import build_fixture_tree, make_lims_stand_in
+from functions.runlog_functions import stop_run_log
+from functions.store_functions import open_metrics_store, read_metrics
+
+
+def test_rows_kept_when_the_pipeline_fails(tmp_path, monkeypatch):
+    cell_dirs = build_fixture_tree(str(tmp_path / "tree"), 2, unique_files=2)
+    db_path = str(tmp_path / "lims_stand_in.sqlite")
+    make_lims_stand_in(db_path, cell_dirs)
+    jem_path = str(tmp_path / "jem.csv")
+    pd.DataFrame({
+        "jem-date_patch": ["03/01/2023 10:00:00 -0800", "03/02/2023 10:00:00 -0800"],
+        "jem-date_patch_y": 2023,
+        "jem-date_patch_m": 3,
+        "jem-date_patch_d": [1, 2],
+        "jem-id_cell_specimen": list(cell_dirs),
+        "jem-id_patched_cell_container": ["PAS1", "PAS2"],
+        "jem-status_success_failure": "SUCCESS",
+        "jem-id_rig_number": [1, 2],
+    }).to_csv(jem_path, index=False)
+    monkeypatch.setattr(lims_functions, "_lims_conn", sqlite3.connect(db_path))
+    monkeypatch.setattr(jem_functions, "snapshot_root", str(tmp_path / "local"))
+    monkeypatch.setattr(generate_rig_noise, "json_data_dir", jem_path)
+    monkeypatch.setattr(generate_rig_noise, "run_log_dir", str(tmp_path / "run_logs"))
+    monkeypatch.setattr(generate_rig_noise, "scratch_dir", str(tmp_path / "scratch"))
+
+    first_cell = list(cell_dirs)[0]
+    def failing_pipeline(cell_list, compute, write_row, *args, **kwargs):
+        # One row is buffered (well under batch_size), then the pipeline fails
+        write_row(first_cell, (first_cell, 1.0, 2.0, 3.0, 4.0, 5.0, 6.0))
+        raise RuntimeError("share went away")
+    monkeypatch.setattr(generate_rig_noise, "run_prefetch_pipeline", failing_pipeline)
+
+    store_path = str(tmp_path / "local" / "metrics_store.sqlite")
+    try:
+        with pytest.raises(RuntimeError):
+            generate_rig_noise.main(year=2023, kernel="h5py", store_path=store_path, csv_path=str(tmp_path / "noise.csv"),
+                                    index_path=str(tmp_path / "local" / "nwb_index.sqlite"),
+                                    ledger_path=str(tmp_path / "local" / "failure_ledger.sqlite"))
+    finally:
+        stop_run_log()
+
+    conn = open_metrics_store(store_path, generate_rig_noise.noise_table, generate_rig_noise.noise_cols)
+    try:
+        assert read_metrics(conn, generate_rig_noise.noise_table, ["cell_name"])["cell_name"].tolist() == [first_cell]
+    finally:
+        conn.close()
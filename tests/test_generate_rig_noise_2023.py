@@ -0,0 +1,128 @@
+"""
+-----------------------------------------------------------------------
+File name: test_generate_rig_noise_2023.py
+Maintainer: Ramkumar Rajanbabu
+-----------------------------------------------------------------------
+Developer: Ramkumar Rajanbabu
+Date/time created: 10/17/2026
+Description: --all-sweeps runs and merges write every csv beside --csv
+-----------------------------------------------------------------------
+"""
+
+
+#-----Imports-----#
+# General imports
+import multiprocessing
+import os
+import sqlite3
+import pandas as pd
+import pytest
+# File imports
+import generate_rig_noise_2023
+from functions import jem_functions, lims_functions
+from functions.fixture_functions import build_fixture_tree, make_lims_stand_in
+from functions.runlog_functions import stop_run_log
+
+
+@pytest.fixture
+def local_run(tmp_path, monkeypatch):
+    """
+    Points the job at fixture cells, a LIMS stand-in and a JEM csv under tmp_path.
+    """
+
+    cell_dirs = build_fixture_tree(str(tmp_path / "tree"), 3, unique_files=3)
+    db_path = str(tmp_path / "lims_stand_in.sqlite")
+    make_lims_stand_in(db_path, cell_dirs)
+    jem_path = str(tmp_path / "jem.csv")
+    pd.DataFrame({
+        "jem-date_patch": [f"03/{day:02d}/2023 10:00:00 -0800" for day in range(1, 4)],
+        "jem-date_patch_y": 2023,
+        "jem-date_patch_m": 3,
+        "jem-date_patch_d": range(1, 4),
+        "jem-id_cell_specimen": list(cell_dirs),
+        "jem-id_patched_cell_container": ["PAS1", "PAS2", "PAS3"],
+        "jem-status_success_failure": "SUCCESS",
+        "jem-id_rig_number": [1, 2, 3],
+    }).to_csv(jem_path, index=False)
+
+    monkeypatch.setattr(lims_functions, "_lims_conn", sqlite3.connect(db_path))
+    monkeypatch.setattr(jem_functions, "snapshot_root", str(tmp_path / "local"))
+    monkeypatch.setattr(generate_rig_noise_2023, "json_data_dir", jem_path)
+    monkeypatch.setattr(generate_rig_noise_2023, "run_log_dir", str(tmp_path / "run_logs"))
+    yield {"store_path": str(tmp_path / "local" / "metrics_store.sqlite"), "index_path": str(tmp_path / "local" / "nwb_index.sqlite"),
+           "ledger_path": str(tmp_path / "local" / "failure_ledger.sqlite")}
+    stop_run_log()
+
+
+def test_repetition_csv_paths():
+    assert generate_rig_noise_2023.repetition_csv_paths(generate_rig_noise_2023.noise_data_dir) == \
+        (generate_rig_noise_2023.noise_rep_data_dir, generate_rig_noise_2023.noise_sweep_data_dir)
+    assert generate_rig_noise_2023.repetition_csv_paths(os.path.join("out", "noise.csv")) == \
+        (os.path.join("out", "noise_rep.csv"), os.path.join("out", "noise_sweep.csv"))
+    assert generate_rig_noise_2023.repetition_csv_paths(None) == (None, None)
+
+
+def test_all_sweeps_csvs_follow_csv_path(tmp_path, local_run):
+    csv_path = str(tmp_path / "out" / "noise.csv")
+    os.makedirs(os.path.dirname(csv_path))
+    generate_rig_noise_2023.main(year=2023, workers=1, all_sweeps=True, csv_path=csv_path, **local_run)
+
+    assert sorted(os.listdir(os.path.dirname(csv_path))) == ["noise.csv", "noise_rep.csv", "noise_sweep.csv"]
+    assert len(pd.read_csv(csv_path)) == 3
+    assert len(pd.read_csv(str(tmp_path / "out" / "noise_rep.csv"))) == 3
+    # One inbath, cellatt and breakin sweep per fixture cell
+    assert len(pd.read_csv(str(tmp_path / "out" / "noise_sweep.csv"))) == 9
+
+
+def test_merge_csvs_follow_csv_path(tmp_path, local_run):
+    shard_dir = str(tmp_path / "shards")
+    plan_path = str(tmp_path / "plan.csv")
+    for shard in (1, 2):
+        generate_rig_noise_2023.main(year=2023, workers=1, all_sweeps=True, shard=(shard, 2), shard_dir=shard_dir, shard_plan=plan_path,
+                                     csv_path=str(tmp_path / "unused.csv"), **local_run)
+        stop_run_log()
+
+    csv_path = str(tmp_path / "merged" / "noise.csv")
+    os.makedirs(os.path.dirname(csv_path))
+    generate_rig_noise_2023.merge_shards(shard_dir, local_run["store_path"], csv_path)
+    assert sorted(os.listdir(os.path.dirname(csv_path))) == ["noise.csv", "noise_rep.csv", "noise_sweep.csv"]
+    assert len(pd.read_csv(str(tmp_path / "merged" / "noise_sweep.csv"))) == 9
+
+
+def _run_shard(barrier, results, db_path, shard, num_shards, kwargs):
+    """
+    Runs one shard (in a forked process, so it keeps local_run's settings) once every
+    shard is ready.
+    """
+
+    # sqlite connections can't cross a fork
+    lims_functions._lims_conn = sqlite3.connect(db_path)
+    barrier.wait()
+    try:
+        generate_rig_noise_2023.main(year=2023, workers=1, all_sweeps=True, shard=(shard, num_shards), **kwargs)
+        results.put((shard, None))
+    except Exception as e:
+        results.put((shard, repr(e)))
+
+
+@pytest.mark.skipif("fork" not in multiprocessing.get_all_start_methods(), reason="needs fork")
+def test_shards_started_together(tmp_path, local_run):
+    num_shards = 3
+    shard_dir = str(tmp_path / "shards")
+    kwargs = dict(local_run, shard_dir=shard_dir, shard_plan=str(tmp_path / "plan.csv"), csv_path=str(tmp_path / "unused.csv"))
+    context = multiprocessing.get_context("fork")
+    barrier = context.Barrier(num_shards)
+    results = context.Queue()
+    processes = [context.Process(target=_run_shard, args=(barrier, results, str(tmp_path / "lims_stand_in.sqlite"), shard, num_shards, kwargs))
+                 for shard in range(1, num_shards + 1)]
+    for process in processes:
+        process.start()
+    errors = [error for _, error in (results.get(timeout=300) for _ in processes) if error]
+    for process in processes:
+        process.join(timeout=300)
+    assert errors == []
+
+    csv_path = str(tmp_path / "merged" / "noise.csv")
+    os.makedirs(os.path.dirname(csv_path))
+    generate_rig_noise_2023.merge_shards(shard_dir, local_run["store_path"], csv_path)
+    assert len(pd.read_csv(csv_path)) == 3
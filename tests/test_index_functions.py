@@ -0,0 +1,58 @@
+"""
+-----------------------------------------------------------------------
+File name: test_index_functions.py
+Maintainer: Ramkumar Rajanbabu
+-----------------------------------------------------------------------
+Developer: Ramkumar Rajanbabu
+Date/time created: 10/17/2026
+Description: The NWB index keeps found files and "no NWB v2" entries,
+but not a miss caused by a failed probe
+-----------------------------------------------------------------------
+"""
+
+
+#-----Imports-----#
+# General imports
+import os
+# File imports
+from functions import general_functions
+from functions.fixture_functions import build_fixture_tree
+from functions.index_functions import find_nwb_v2_indexed, peek_nwb_index
+
+
+def _share_hiccup(nwb_path, keep_open=False):
+    raise OSError("Unable to open file (file read failed)")
+
+
+def test_found_file_is_indexed(tmp_path):
+    cell_dirs = build_fixture_tree(str(tmp_path / "tree"), 1, unique_files=1)
+    (cell_name, cell_dir), = cell_dirs.items()
+    index_path = str(tmp_path / "nwb_index.sqlite")
+
+    assert peek_nwb_index(cell_name, cell_dir, index_path) == (False, None)
+    nwb_path = find_nwb_v2_indexed(cell_name, cell_dir, index_path)
+    assert nwb_path is not None
+    assert peek_nwb_index(cell_name, cell_dir, index_path) == (True, nwb_path)
+
+
+def test_empty_directory_is_indexed(tmp_path):
+    cell_dir = str(tmp_path / "empty") + os.sep
+    os.makedirs(cell_dir)
+    index_path = str(tmp_path / "nwb_index.sqlite")
+
+    assert find_nwb_v2_indexed("Empty-Cell", cell_dir, index_path) is None
+    assert peek_nwb_index("Empty-Cell", cell_dir, index_path) == (True, None)
+
+
+def test_failed_probe_is_not_indexed(tmp_path, monkeypatch):
+    cell_dirs = build_fixture_tree(str(tmp_path / "tree"), 1, unique_files=1)
+    (cell_name, cell_dir), = cell_dirs.items()
+    index_path = str(tmp_path / "nwb_index.sqlite")
+
+    monkeypatch.setattr(general_functions, "get_nwb_major_version", _share_hiccup)
+    assert find_nwb_v2_indexed(cell_name, cell_dir, index_path) is None
+    assert peek_nwb_index(cell_name, cell_dir, index_path) == (False, None)
+
+    # The next run probes again, with the directory unchanged
+    monkeypatch.undo()
+    assert find_nwb_v2_indexed(cell_name, cell_dir, index_path) is not None
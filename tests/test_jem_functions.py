@@ -0,0 +1,60 @@
+"""
+-----------------------------------------------------------------------
+File name: test_jem_functions.py
+Maintainer: Ramkumar Rajanbabu
+-----------------------------------------------------------------------
+Developer: Ramkumar Rajanbabu
+Date/time created: 10/17/2026
+Description: JEM snapshot filters (dates, cells, rigs)
+-----------------------------------------------------------------------
+"""
+
+
+#-----Imports-----#
+# General imports
+from datetime import date
+import pandas as pd
+import pytest
+# File imports
+from functions.jem_functions import jem_fields, load_jem_metadata, refresh_jem_snapshot
+
+
+def _write_jem_csv(path, rigs):
+    pd.DataFrame({
+        "jem-date_patch": [f"01/{day:02d}/2023 10:00:00 -0800" for day in range(1, len(rigs) + 1)],
+        "jem-date_patch_y": 2023,
+        "jem-date_patch_m": 1,
+        "jem-date_patch_d": range(1, len(rigs) + 1),
+        "jem-id_cell_specimen": [f"Cell-{i}" for i in range(len(rigs))],
+        "jem-id_patched_cell_container": [f"PAS{i}" for i in range(len(rigs))],
+        "jem-status_success_failure": "SUCCESS",
+        "jem-id_rig_number": rigs,
+    }).to_csv(path, index=False)
+
+
+@pytest.mark.parametrize("rigs", [[1.0, 2.0, 3.0, 2.0, None], ["1", "2", "3", "2", None]])
+def test_rig_filter(tmp_path, rigs):
+    csv_path = str(tmp_path / "jem.csv")
+    snapshot_path = str(tmp_path / "jem.sqlite")
+    _write_jem_csv(csv_path, rigs)
+
+    jem_df = load_jem_metadata(csv_path, snapshot_path, rigs=["2"])
+    assert jem_df["jem-id_cell_specimen"].tolist() == ["Cell-1", "Cell-3"]
+    # The rig column is only filtered on, the columns are still the requested fields
+    assert list(jem_df.columns) == jem_fields + ["date_patch"]
+
+    jem_df = load_jem_metadata(csv_path, snapshot_path, rigs=[1, "3"], start_date=date(2023, 1, 2))
+    assert jem_df["jem-id_cell_specimen"].tolist() == ["Cell-2"]
+    assert len(load_jem_metadata(csv_path, snapshot_path)) == len(rigs)
+
+
+def test_snapshot_kept_for_fewer_fields(tmp_path):
+    csv_path = str(tmp_path / "jem.csv")
+    snapshot_path = str(tmp_path / "jem.sqlite")
+    _write_jem_csv(csv_path, [1, 2])
+
+    assert refresh_jem_snapshot(csv_path, snapshot_path, jem_fields)
+    # A rig filter needs the rig column, which the snapshot doesn't have yet
+    assert refresh_jem_snapshot(csv_path, snapshot_path, jem_fields + ["jem-id_rig_number"])
+    assert not refresh_jem_snapshot(csv_path, snapshot_path, jem_fields + ["jem-id_rig_number"])
+    assert not refresh_jem_snapshot(csv_path, snapshot_path, jem_fields)
@@ -0,0 +1,49 @@
+"""
+-----------------------------------------------------------------------
+File name: test_ledger_functions.py
+Maintainer: Ramkumar Rajanbabu
+-----------------------------------------------------------------------
+Developer: Ramkumar Rajanbabu
+Date/time created: 10/17/2026
+Description: Failure reasons recorded from the run log, given explicitly,
+or without any run log
+-----------------------------------------------------------------------
+"""
+
+
+#-----Imports-----#
+# File imports
+from functions.ledger_functions import open_failure_ledger, pending_cells, record_run_failures
+from functions.runlog_functions import failure, start_run_log, stop_run_log
+
+
+# Settings
+job = "noise_metrics"
+
+
+def _reasons(conn):
+    return {cell_name: (reason, detail) for cell_name, reason, detail in conn.execute("SELECT cell_name, reason, detail FROM failure_ledger")}
+
+
+def test_reasons_from_the_run_log(tmp_path):
+    conn = open_failure_ledger(str(tmp_path / "failure_ledger.sqlite"))
+    start_run_log(str(tmp_path / "run_logs"), "test")
+    try:
+        failure("cell_a", "unreadable_nwb", "OSError('truncated file')")
+        assert record_run_failures(conn, job, ["cell_a", "cell_b", "cell_c"], {"cell_c"}) == 2
+    finally:
+        stop_run_log()
+    assert _reasons(conn) == {"cell_a": ("unreadable_nwb", "OSError('truncated file')"), "cell_b": ("no_result", None)}
+    assert pending_cells(conn, job, ["cell_c", "cell_b", "cell_a"]) == ["cell_b", "cell_a"]
+
+
+def test_without_a_run_log(tmp_path):
+    stop_run_log()
+    conn = open_failure_ledger(str(tmp_path / "failure_ledger.sqlite"))
+    assert record_run_failures(conn, job, ["cell_a", "cell_b"], set(), now=0.0) == 2
+    assert _reasons(conn) == {"cell_a": ("no_result", None), "cell_b": ("no_result", None)}
+
+    # Given reasons win; a success clears the entry
+    assert record_run_failures(conn, job, ["cell_a", "cell_b"], {"cell_b"}, reasons={"cell_a": ("no_nwb_v2", None)}, now=1.0) == 1
+    assert _reasons(conn) == {"cell_a": ("no_nwb_v2", None)}
+    assert conn.execute("SELECT attempts FROM failure_ledger").fetchone() == (2,)
@@ -0,0 +1,77 @@
+"""
+-----------------------------------------------------------------------
+File name: test_lims_functions.py
+Maintainer: Ramkumar Rajanbabu
+-----------------------------------------------------------------------
+Developer: Ramkumar Rajanbabu
+Date/time created: 10/17/2026
+Description: generate_cell_paths against a local sqlite LIMS stand-in
+-----------------------------------------------------------------------
+"""
+
+
+#-----Imports-----#
+# General imports
+import sqlite3
+import pytest
+# File imports
+from functions.fixture_functions import make_lims_stand_in
+from functions.lims_functions import generate_cell_paths
+from functions.runlog_functions import read_run_log, start_run_log, stop_run_log
+
+
+@pytest.fixture
+def lims_conn(tmp_path):
+    # LIMS storage directories start with one "/" (ex. /allen/programs/...)
+    cell_dirs = {f"Cell-{i:03d}": f"//allen/programs/celltypes/cell_{i:03d}/" for i in range(12)}
+    db_path = str(tmp_path / "lims_stand_in.sqlite")
+    make_lims_stand_in(db_path, cell_dirs)
+    conn = sqlite3.connect(db_path)
+    yield conn
+    conn.close()
+
+
+def _lims_queries():
+    log_df = read_run_log()
+    return log_df[(log_df["event"] == "stage") & (log_df["stage"] == "lims_query")]
+
+
+def test_batches_across_batch_size(tmp_path, lims_conn):
+    start_run_log(str(tmp_path / "logs"), "test")
+    try:
+        cell_paths = generate_cell_paths([f"Cell-{i:03d}" for i in range(12)], conn=lims_conn, batch_size=5)
+        queries = _lims_queries()
+    finally:
+        stop_run_log()
+    assert len(cell_paths) == 12
+    assert queries["cells"].tolist() == [5, 5, 2]
+    assert queries["rows"].sum() == 12
+
+
+def test_duplicates_and_na_names(tmp_path, lims_conn):
+    start_run_log(str(tmp_path / "logs"), "test")
+    try:
+        cell_paths = generate_cell_paths(["Cell-001", None, "Cell-002", float("nan"), "Cell-001"], conn=lims_conn)
+        queries = _lims_queries()
+    finally:
+        stop_run_log()
+    assert list(cell_paths) == ["Cell-001", "Cell-002"]
+    # Each name is queried once
+    assert queries["cells"].tolist() == [2]
+
+
+def test_missing_cells_map_to_none(lims_conn):
+    cell_paths = generate_cell_paths(["Cell-003", "Not-In-LIMS"], conn=lims_conn)
+    assert "Not-In-LIMS" not in cell_paths
+    assert cell_paths.get("Not-In-LIMS") is None
+    assert cell_paths["Cell-003"] is not None
+
+
+def test_storage_directory_prefix(lims_conn):
+    stored = lims_conn.execute("SELECT storage_directory FROM ephys_roi_results WHERE id = 4").fetchone()[0]
+    assert stored == "/allen/programs/celltypes/cell_004/"
+    assert generate_cell_paths(["Cell-004"], conn=lims_conn) == {"Cell-004": "//allen/programs/celltypes/cell_004/"}
+
+
+def test_empty_cell_list(lims_conn):
+    assert generate_cell_paths([], conn=lims_conn) == {}
@@ -0,0 +1,62 @@
+"""
+-----------------------------------------------------------------------
+File name: test_noise_reference.py
+Maintainer: Ramkumar Rajanbabu
+-----------------------------------------------------------------------
+Developer: Ramkumar Rajanbabu
+Date/time created: 10/17/2026
+Description: The h5py noise kernels against the plain reference and the
+stored reference values
+-----------------------------------------------------------------------
+"""
+
+
+#-----Imports-----#
+# General imports
+import json
+import os
+import numpy as np
+import pytest
+# File imports
+from functions.fixture_functions import reference_noise_row, write_synthetic_nwb
+from functions.nwb_functions import NwbFile
+from functions.rms_functions import calculate_cell_sweep_noise_h5, noise_from_nwb_h5
+
+
+# Directories
+reference_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "noise_reference.json")
+
+# Lists
+nwb_variants = [
+    {},
+    {"rate": 20000.0},
+    {"test_pulse": (0.01, 0.02), "stim_onset": 0.3},
+    {"noise_pa": (0.5, 20.0, 80.0), "seed": 3},
+    {"first_sample": 1.0},
+]
+
+
+def _assert_rows_equal(row, expected):
+    # Exact after the 3 decimal rounding, so a window off by one sample shows
+    assert row[0] == expected[0]
+    np.testing.assert_array_equal(np.array(row[1:], dtype=float), np.array(expected[1:], dtype=float))
+
+
+@pytest.mark.parametrize("nwb_kwargs", nwb_variants)
+def test_h5_kernels_match_the_reference(tmp_path, nwb_kwargs):
+    nwb_path = str(tmp_path / "cell.nwb")
+    write_synthetic_nwb(nwb_path, sweep_count=4, **nwb_kwargs)
+    expected = reference_noise_row("cell", nwb_path)
+    _assert_rows_equal(noise_from_nwb_h5("cell", nwb_path), expected)
+    with NwbFile(nwb_path, "cell") as nwb:
+        row, rep_row, sweep_rows = calculate_cell_sweep_noise_h5("cell", nwb.h5file, nwb.sweep_table)
+    _assert_rows_equal(row, expected)
+
+
+def test_h5_kernel_matches_the_stored_reference(tmp_path):
+    with open(reference_path) as f:
+        reference = json.load(f)
+    for seed, values in reference["rows"].items():
+        nwb_path = str(tmp_path / f"seed_{seed}.nwb")
+        write_synthetic_nwb(nwb_path, seed=int(seed), **reference["settings"])
+        _assert_rows_equal(noise_from_nwb_h5("cell", nwb_path), ["cell"] + values)
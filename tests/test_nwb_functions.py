@@ -0,0 +1,86 @@
+"""
+-----------------------------------------------------------------------
+File name: test_nwb_functions.py
+Maintainer: Ramkumar Rajanbabu
+-----------------------------------------------------------------------
+Developer: Ramkumar Rajanbabu
+Date/time created: 10/17/2026
+Description: A file found by a version probe is opened once, and bytes
+are counted only when asked for
+-----------------------------------------------------------------------
+"""
+
+
+#-----Imports-----#
+# General imports
+import pytest
+# File imports
+from functions import nwb_functions
+from functions.fixture_functions import build_fixture_tree
+from functions.general_functions import find_nwb_v2
+from functions.nwb_functions import NwbFile
+from functions.rms_functions import extract_cell_noise_h5
+from functions.runlog_functions import read_run_log, start_run_log, stop_run_log
+
+
+@pytest.fixture
+def opens(monkeypatch):
+    """
+    Records the file of every h5py open made through open_h5.
+    """
+
+    opened = []
+    open_h5 = nwb_functions.open_h5
+    def counting_open_h5(file, **kwargs):
+        opened.append(file)
+        return open_h5(file, **kwargs)
+    monkeypatch.setattr(nwb_functions, "open_h5", counting_open_h5)
+    yield opened
+    nwb_functions.release_probed_file()
+
+
+@pytest.mark.parametrize("indexed", [False, True])
+def test_probed_file_opened_once(tmp_path, opens, indexed):
+    cell_dirs = build_fixture_tree(str(tmp_path / "tree"), 1, unique_files=1)
+    (cell_name, cell_dir), = cell_dirs.items()
+    index_path = str(tmp_path / "nwb_index.sqlite") if indexed else None
+
+    rows = []
+    for _ in range(2):
+        rows.append(extract_cell_noise_h5(cell_name, cell_dir, index_path))
+        # Probed (or found in the index) and read through one handle
+        assert len(opens) == 1 and nwb_functions._probed is None
+        opens.clear()
+    assert rows[0] is not None and rows[0] == rows[1]
+
+
+def test_unread_probe_is_closed(tmp_path, opens):
+    cell_dirs = build_fixture_tree(str(tmp_path / "tree"), 2, unique_files=2)
+    first_dir, second_dir = cell_dirs.values()
+    first_path = find_nwb_v2(first_dir, keep_open=True)
+    h5file = nwb_functions._probed[1]
+
+    # Another file is read instead: the kept handle is closed, not handed over
+    with NwbFile(find_nwb_v2(second_dir)) as nwb:
+        assert nwb.h5file.filename != first_path
+    assert not h5file.id.valid
+    assert nwb_functions._probed is None
+
+
+@pytest.mark.parametrize("count_bytes", [False, True])
+def test_bytes_counted_on_request(tmp_path, monkeypatch, count_bytes):
+    monkeypatch.setattr(nwb_functions, "count_bytes", count_bytes)
+    cell_dirs = build_fixture_tree(str(tmp_path / "tree"), 1, unique_files=1)
+    (cell_name, cell_dir), = cell_dirs.items()
+    start_run_log(str(tmp_path / "run_logs"), "test")
+    try:
+        assert extract_cell_noise_h5(cell_name, cell_dir) is not None
+        log_df = read_run_log()
+    finally:
+        stop_run_log()
+    nwb_file = log_df[log_df["stage"] == "nwb_file"]
+    assert len(nwb_file) == 1
+    if count_bytes:
+        assert nwb_file["bytes"].iloc[0] > 0
+    else:
+        assert "bytes" not in nwb_file or nwb_file["bytes"].isna().all()
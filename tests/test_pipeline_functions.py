@@ -0,0 +1,41 @@
+"""
+-----------------------------------------------------------------------
+File name: test_pipeline_functions.py
+Maintainer: Ramkumar Rajanbabu
+-----------------------------------------------------------------------
+Developer: Ramkumar Rajanbabu
+Date/time created: 10/17/2026
+Description: extract_cell_metrics on found, missing and unreadable files
+-----------------------------------------------------------------------
+"""
+
+
+#-----Imports-----#
+# File imports
+from functions.fixture_functions import build_fixture_tree
+from functions import pipeline_functions
+from functions.pipeline_functions import extract_cell_metrics
+
+
+def test_opened_file(tmp_path):
+    cell_dirs = build_fixture_tree(str(tmp_path), 1, unique_files=1)
+    (cell_name, cell_dir), = cell_dirs.items()
+    noise_row, power_60hz_values, psd_row = extract_cell_metrics(cell_name, cell_dir)
+    assert noise_row[0] == cell_name and len(noise_row) == 7
+    assert len(power_60hz_values) == 4
+    assert psd_row[0] == cell_name
+
+
+def test_missing_file(tmp_path):
+    assert extract_cell_metrics("Missing-Cell", None) is None
+    assert extract_cell_metrics("Missing-Cell", str(tmp_path) + "/") is None
+
+
+def test_unreadable_file(tmp_path, monkeypatch):
+    cell_dirs = build_fixture_tree(str(tmp_path), 1, unique_files=1)
+    (cell_name, cell_dir), = cell_dirs.items()
+
+    def unreadable(nwb2_filepath, cell_name):
+        raise OSError("Unable to open file (truncated file)")
+    monkeypatch.setattr(pipeline_functions, "NwbFile", unreadable)
+    assert extract_cell_metrics(cell_name, cell_dir) is None
@@ -0,0 +1,166 @@
+"""
+-----------------------------------------------------------------------
+File name: test_poll_functions.py
+Maintainer: Ramkumar Rajanbabu
+-----------------------------------------------------------------------
+Developer: Ramkumar Rajanbabu
+Date/time created: 10/17/2026
+Description: Poll change detection against fixture directories, a fake
+JEM metadata csv and a local LIMS stand-in
+-----------------------------------------------------------------------
+"""
+
+
+#-----Imports-----#
+# General imports
+import os
+import sqlite3
+from datetime import date
+import pandas as pd
+import pytest
+# File imports
+from functions import lims_functions
+from functions.fixture_functions import build_fixture_tree, make_lims_stand_in
+from functions.index_functions import find_nwb_v2_indexed
+from functions.poll_functions import find_changed_cells, open_poll_state, read_poll_mark, record_polled_cells
+
+
+# Settings
+job = "test_poll"
+today = date(2023, 3, 20)
+
+
+class PollFixture:
+    """
+    Fixture cells (two with an NWB file, one with an empty directory waiting for its
+    upload), a LIMS stand-in and a JEM csv that rows can be added to.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.cell_dirs = build_fixture_tree(os.path.join(root, "tree"), 3, unique_files=1)
+        self.recent, self.waiting, self.old = list(self.cell_dirs)
+        # The waiting cell's directory exists, but its file isn't uploaded yet
+        waiting_dir = self.cell_dirs[self.waiting]
+        for name in os.listdir(waiting_dir):
+            os.remove(os.path.join(waiting_dir, name))
+        self.late = "Late-Cell"
+        self.cell_dirs[self.late] = os.path.join(root, "tree", "cells", "late") + os.sep
+        os.makedirs(self.cell_dirs[self.late])
+        self.db_path = os.path.join(root, "lims_stand_in.sqlite")
+        make_lims_stand_in(self.db_path, self.cell_dirs)
+
+        self.jem_path = os.path.join(root, "jem.csv")
+        self.index_path = os.path.join(root, "nwb_index.sqlite")
+        self.jem_rows = [(self.recent, "2023-03-15"), (self.waiting, "2023-03-16"), (self.old, "2022-06-01")]
+        self.conn = open_poll_state(os.path.join(root, "poll_state.sqlite"))
+
+    def jem_df(self):
+        jem_df = pd.DataFrame(self.jem_rows, columns=["jem-id_cell_specimen", "date_patch"])
+        jem_df["date_patch"] = pd.to_datetime(jem_df["date_patch"])
+        jem_df.to_csv(self.jem_path, index=False)
+        return jem_df
+
+    def poll(self, done_cells):
+        """
+        Runs find_changed_cells, "processes" the queue (indexing each cell's file) and
+        records the poll.
+        """
+
+        jem_df = self.jem_df()
+        queue, polled = find_changed_cells(self.conn, job, jem_df, done_cells, today=today)
+        for cell_name, path, reason in queue:
+            if path and find_nwb_v2_indexed(cell_name, path, self.index_path):
+                done_cells.add(cell_name)
+        record_polled_cells(self.conn, job, self.jem_path, jem_df, polled, done_cells, self.index_path)
+        return {cell_name: reason for cell_name, path, reason in queue}
+
+
+@pytest.fixture
+def poll_fixture(tmp_path, monkeypatch):
+    poll_fixture = PollFixture(str(tmp_path))
+    monkeypatch.setattr(lims_functions, "_lims_conn", sqlite3.connect(poll_fixture.db_path))
+    yield poll_fixture
+    poll_fixture.conn.close()
+
+
+def _touch(path, seconds):
+    stat = os.stat(path)
+    os.utime(path, (stat.st_atime, stat.st_mtime + seconds))
+
+
+def test_first_poll_takes_the_lookback_only(poll_fixture):
+    done_cells = set()
+    assert poll_fixture.poll(done_cells) == {poll_fixture.recent: "new", poll_fixture.waiting: "new"}
+    assert done_cells == {poll_fixture.recent}
+
+    mark = read_poll_mark(poll_fixture.conn, job)
+    assert mark["last_date_patch"] == "2023-03-16"
+    assert mark["jem_size"] == os.path.getsize(poll_fixture.jem_path)
+    # The older cell is recorded too, so it isn't taken as new next time
+    recorded = {row[0] for row in poll_fixture.conn.execute("SELECT cell_name FROM poll_cells WHERE job = ?", (job,))}
+    assert recorded == {poll_fixture.recent, poll_fixture.waiting, poll_fixture.old}
+
+
+def test_recorded_cells_are_not_reported_again(poll_fixture):
+    done_cells = set()
+    poll_fixture.poll(done_cells)
+    assert poll_fixture.poll(done_cells) == {}
+    assert poll_fixture.poll(done_cells) == {}
+
+
+def test_late_jem_row_is_new_whatever_its_patch_date(poll_fixture):
+    done_cells = set()
+    poll_fixture.poll(done_cells)
+    # Added to the metadata after the first poll, patched long before the lookback
+    poll_fixture.jem_rows.append((poll_fixture.late, "2021-01-05"))
+    assert poll_fixture.poll(done_cells) == {poll_fixture.late: "new"}
+    # The high-water mark stays at the newest patch date
+    assert read_poll_mark(poll_fixture.conn, job)["last_date_patch"] == "2023-03-16"
+    assert poll_fixture.poll(done_cells) == {}
+
+
+def test_upload_to_a_known_directory(poll_fixture):
+    done_cells = set()
+    poll_fixture.poll(done_cells)
+    assert poll_fixture.waiting not in done_cells
+
+    waiting_dir = poll_fixture.cell_dirs[poll_fixture.waiting]
+    source = os.path.join(poll_fixture.root, "tree", "source", "synthetic_000.nwb")
+    with open(source, "rb") as f_in, open(os.path.join(waiting_dir, "waiting.nwb"), "wb") as f_out:
+        f_out.write(f_in.read())
+    _touch(waiting_dir, 5)
+    assert poll_fixture.poll(done_cells) == {poll_fixture.waiting: "uploaded"}
+    assert poll_fixture.waiting in done_cells
+    assert poll_fixture.poll(done_cells) == {}
+
+
+@pytest.mark.parametrize("change", ["mtime", "size"])
+def test_changed_nwb_file(poll_fixture, change):
+    done_cells = set()
+    poll_fixture.poll(done_cells)
+    nwb_path = find_nwb_v2_indexed(poll_fixture.recent, poll_fixture.cell_dirs[poll_fixture.recent], poll_fixture.index_path)
+
+    if change == "mtime":
+        _touch(nwb_path, 5)
+    else:
+        # A new file in place of the hard link, one byte longer
+        with open(nwb_path, "rb") as f:
+            data = f.read()
+        os.remove(nwb_path)
+        with open(nwb_path, "wb") as f:
+            f.write(data + b"\0")
+    assert poll_fixture.poll(done_cells) == {poll_fixture.recent: "changed"}
+    assert poll_fixture.poll(done_cells) == {}
+
+
+def test_changed_file_of_a_cell_done_before_indexing(poll_fixture):
+    # Processed by an earlier run that didn't use the NWB index
+    done_cells = {poll_fixture.recent}
+    assert poll_fixture.poll(done_cells) == {poll_fixture.waiting: "new"}
+
+    nwb_dir = poll_fixture.cell_dirs[poll_fixture.recent]
+    nwb_path, = (os.path.join(nwb_dir, name) for name in os.listdir(nwb_dir) if name.endswith(".nwb"))
+    _touch(nwb_path, 5)
+    assert poll_fixture.poll(done_cells) == {poll_fixture.recent: "changed"}
+    assert poll_fixture.poll(done_cells) == {}
@@ -0,0 +1,53 @@
+"""
+-----------------------------------------------------------------------
+File name: test_power_functions.py
+Maintainer: Ramkumar Rajanbabu
+-----------------------------------------------------------------------
+Developer: Ramkumar Rajanbabu
+Date/time created: 10/17/2026
+Description: power60HzRatio values from variable and fixed length string
+results tables
+-----------------------------------------------------------------------
+"""
+
+
+#-----Imports-----#
+# General imports
+import h5py
+import numpy as np
+import pytest
+# File imports
+from functions.power_functions import last_nb_layer, power_60hz_key, read_power_60hz
+
+
+def _write_results(nwb_path, dtype):
+    # Keys: name/unit/tolerance rows; values: one row per result, the last layer is INDEP_HEADSTAGE
+    keys = np.full((3, 4), "", dtype=object)
+    keys[0, 2] = power_60hz_key
+    values = np.full((5, 4, last_nb_layer + 1), "", dtype=object)
+    values[0, 2, last_nb_layer] = "0.25;"
+    values[3, 2, last_nb_layer] = "0.5;"
+    values[4, 1, last_nb_layer] = "9;"
+    with h5py.File(nwb_path, "w") as h5file:
+        results = h5file.create_group("general/results")
+        for name, table in (("textualResultsKeys", keys), ("textualResultsValues", values)):
+            if dtype is object:
+                results.create_dataset(name, data=table, dtype=h5py.string_dtype())
+            else:
+                results.create_dataset(name, data=table.astype(dtype))
+
+
+@pytest.mark.parametrize("dtype", [object, "S64"])
+def test_read_power_60hz(tmp_path, dtype):
+    nwb_path = str(tmp_path / "cell.nwb")
+    _write_results(nwb_path, dtype)
+    with h5py.File(nwb_path, "r") as h5file:
+        assert read_power_60hz(h5file).tolist() == [0.25, 0.5]
+
+
+def test_no_power_60hz_results(tmp_path):
+    nwb_path = str(tmp_path / "cell.nwb")
+    with h5py.File(nwb_path, "w") as h5file:
+        h5file.create_group("general")
+    with h5py.File(nwb_path, "r") as h5file:
+        assert read_power_60hz(h5file) is None
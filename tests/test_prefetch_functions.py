@@ -0,0 +1,75 @@
+"""
+-----------------------------------------------------------------------
+File name: test_prefetch_functions.py
+Maintainer: Ramkumar Rajanbabu
+-----------------------------------------------------------------------
+Developer: Ramkumar Rajanbabu
+Date/time created: 10/17/2026
+Description: The streaming pipeline against fixture files and a local
+LIMS stand-in
+-----------------------------------------------------------------------
+"""
+
+
+#-----Imports-----#
+# General imports
+import os
+import sqlite3
+import pytest
+# File imports
+from functions import lims_functions
+from functions.fixture_functions import build_fixture_tree, make_lims_stand_in
+from functions.prefetch_functions import run_prefetch_pipeline
+from functions.rms_functions import noise_from_nwb_h5
+
+
+# Lists
+crash_cells = [] # Cells whose compute kills the worker process (seen by forked workers)
+
+
+def crashing_compute(cell_name, nwb_path):
+    if cell_name in crash_cells:
+        os._exit(1)
+    return noise_from_nwb_h5(cell_name, nwb_path)
+
+
+@pytest.fixture
+def cell_names(tmp_path, monkeypatch):
+    cell_dirs = build_fixture_tree(str(tmp_path / "tree"), 6, unique_files=2)
+    db_path = str(tmp_path / "lims_stand_in.sqlite")
+    make_lims_stand_in(db_path, cell_dirs)
+    # The resolve stage runs in a thread
+    monkeypatch.setattr(lims_functions, "_lims_conn", sqlite3.connect(db_path, check_same_thread=False))
+    return list(cell_dirs) + ["Not-In-LIMS"]
+
+
+def _run(cell_names, scratch_dir, compute, compute_limit):
+    results = []
+    stats = run_prefetch_pipeline(cell_names, compute, lambda cell_name, result: results.append((cell_name, result)),
+                                  scratch_dir, compute_limit=compute_limit, queue_size=2)
+    return results, stats
+
+
+def test_results_in_cell_order(tmp_path, cell_names):
+    scratch_dir = str(tmp_path / "scratch")
+    results, stats = _run(cell_names, scratch_dir, noise_from_nwb_h5, compute_limit=2)
+    assert [cell_name for cell_name, result in results] == cell_names
+    assert all(result[0] == cell_name for cell_name, result in results[:-1])
+    assert results[-1][1] is None
+    assert stats[2].count == len(cell_names) and stats[2].failed == 1
+    # Every copy is deleted after it is computed
+    assert os.listdir(scratch_dir) == []
+
+
+def test_worker_crash(tmp_path, cell_names):
+    crash_cells[:] = [cell_names[2]]
+    try:
+        scratch_dir = str(tmp_path / "scratch")
+        results, stats = _run(cell_names, scratch_dir, crashing_compute, compute_limit=2)
+    finally:
+        crash_cells[:] = []
+    # The crashing cell fails, the cells that shared its pool are retried
+    assert [cell_name for cell_name, result in results] == cell_names
+    assert results[2][1] is None
+    assert all(result is not None for cell_name, result in results[:2] + results[3:-1])
+    assert os.listdir(scratch_dir) == []
@@ -0,0 +1,95 @@
+"""
+-----------------------------------------------------------------------
+File name: test_psd_functions.py
+Maintainer: Ramkumar Rajanbabu
+-----------------------------------------------------------------------
+Developer: Ramkumar Rajanbabu
+Date/time created: 10/17/2026
+Description: Welch spectra and mains band power of known tones in white
+noise, chunked and whole, against scipy where it is installed
+-----------------------------------------------------------------------
+"""
+
+
+#-----Imports-----#
+# General imports
+import numpy as np
+import pytest
+# File imports
+from functions.psd_functions import band_powers, baseline_psd_metrics, mains_harmonics, welch_psd
+
+
+# Settings
+rate = 10000.0
+tone_pa = (3.0, 2.0, 1.0) # Amplitude of the 60, 120 and 180 Hz tones
+noise_pa = 0.5
+
+
+def _baseline(duration=0.5, seed=0, tones=tone_pa, sigma=noise_pa):
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(duration * rate)) / rate
+    signal = sum(amplitude * np.sin(2 * np.pi * freq * t + phase)
+                 for amplitude, freq, phase in zip(tones, mains_harmonics, rng.uniform(0, 2 * np.pi, len(tones))))
+    # An offset, which the per-segment mean removal takes out
+    return signal + rng.normal(0.0, sigma, len(t)) + 25.0
+
+
+def test_band_powers_of_known_tones():
+    (freqs, psd), = welch_psd([_baseline()], [rate])
+    metrics = band_powers(freqs, psd)
+    # A tone of amplitude A has power A^2/2
+    for band_power, amplitude in zip(metrics[:3], tone_pa):
+        assert band_power == pytest.approx(amplitude**2 / 2, rel=0.05)
+    assert metrics[3] == pytest.approx(np.sqrt(noise_pa**2 + sum(amplitude**2 / 2 for amplitude in tone_pa)), rel=0.02)
+
+
+def test_white_noise_only():
+    (freqs, psd), = welch_psd([_baseline(duration=2.0, tones=(0.0, 0.0, 0.0))], [rate])
+    # One-sided density of white noise: 2 sigma^2 / rate
+    assert psd[1:-1].mean() == pytest.approx(2 * noise_pa**2 / rate, rel=0.05)
+    metrics = band_powers(freqs, psd)
+    assert all(band_power < 0.01 for band_power in metrics[:3])
+    assert metrics[3] == pytest.approx(noise_pa, rel=0.02)
+
+
+def test_chunk_boundaries():
+    # Same rate and length (one group) and a longer baseline, split over chunks of every size
+    segments = [_baseline(seed=0), _baseline(seed=1), _baseline(duration=0.73, seed=2)]
+    whole = welch_psd(segments, [rate] * 3)
+    for chunk_frames in (1, 2, 3, 7):
+        chunked = welch_psd(segments, [rate] * 3, chunk_frames=chunk_frames)
+        for (freqs, psd), (chunk_freqs, chunk_psd) in zip(whole, chunked):
+            np.testing.assert_array_equal(freqs, chunk_freqs)
+            np.testing.assert_allclose(chunk_psd, psd, rtol=1e-12)
+
+
+def test_segments_shorter_than_one_window():
+    short = _baseline(duration=0.03) # 300 samples, under the 100 ms (1000 sample) Welch segment
+    odd = _baseline(duration=0.0305) # 305 samples, no Nyquist bin
+    spectra = welch_psd([short, odd, short[:1], None], [rate] * 4)
+    for (freqs, psd), segment in zip(spectra, (short, odd)):
+        # The whole segment is one frame
+        np.testing.assert_array_equal(freqs, np.fft.rfftfreq(len(segment), 1.0 / rate))
+        assert psd.shape == freqs.shape
+        assert np.isfinite(psd).all()
+    assert spectra[2:] == [None, None]
+    assert baseline_psd_metrics([short[:1], None], [rate, rate]) == [None, None]
+
+
+def test_bands_past_nyquist():
+    low_rate = 200.0
+    (freqs, psd), = welch_psd([np.random.default_rng(0).normal(0.0, 1.0, 200)], [low_rate])
+    metrics = band_powers(freqs, psd)
+    assert not np.isnan(metrics[0])
+    assert np.isnan(metrics[2])
+
+
+@pytest.mark.parametrize("duration", [0.5, 0.73, 0.03, 0.0305])
+def test_matches_scipy(duration):
+    signal = pytest.importorskip("scipy.signal")
+    segment = _baseline(duration=duration)
+    (freqs, psd), = welch_psd([segment], [rate])
+    nperseg = min(int(rate * 0.1), len(segment))
+    scipy_freqs, scipy_psd = signal.welch(segment, fs=rate, nperseg=nperseg)
+    np.testing.assert_allclose(freqs, scipy_freqs)
+    np.testing.assert_allclose(psd, scipy_psd, rtol=1e-9)
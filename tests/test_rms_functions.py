@@ -0,0 +1,86 @@
+"""
+-----------------------------------------------------------------------
+File name: test_rms_functions.py
+Maintainer: Ramkumar Rajanbabu
+-----------------------------------------------------------------------
+Developer: Ramkumar Rajanbabu
+Date/time created: 10/17/2026
+Description: Baseline epochs and rms of synthetic NWB files (ipfx epoch rules)
+-----------------------------------------------------------------------
+"""
+
+
+#-----Imports-----#
+# General imports
+import h5py
+import numpy as np
+# File imports
+from functions.fixture_functions import reference_noise_row, write_synthetic_nwb
+from functions.rms_functions import calculate_std_vs_h5, find_baseline_epoch, read_vs_baselines_h5
+
+
+# Settings
+rate = 50000.0
+test_pulse = (0.005, 0.015)
+stim_onset = 0.5
+
+
+def _stimulus(h5file, sweep_number=0):
+    return h5file[f"stimulus/presentation/data_{sweep_number:05d}_DA0/data"]
+
+
+def test_epoch_of_a_standard_sweep(tmp_path):
+    nwb_path = str(tmp_path / "cell.nwb")
+    write_synthetic_nwb(nwb_path, sweep_count=3, rate=rate, test_pulse=test_pulse, stim_onset=stim_onset)
+    with h5py.File(nwb_path, "r") as h5file:
+        test_end, bl_end = find_baseline_epoch(_stimulus(h5file), rate)
+    tp_start, tp_end, onset = int(test_pulse[0] * rate), int(test_pulse[1] * rate), int(stim_onset * rate)
+    # ipfx: the test epoch ends one pulse-onset length after the test pulse (diff indexes), the stim epoch starts at the onset
+    assert test_end == tp_end + tp_start - 1
+    assert bl_end == onset
+
+
+def test_epoch_with_a_change_at_the_first_sample(tmp_path):
+    nwb_path = str(tmp_path / "cell.nwb")
+    write_synthetic_nwb(nwb_path, sweep_count=3, rate=rate, test_pulse=test_pulse, stim_onset=stim_onset, first_sample=1.0)
+    with h5py.File(nwb_path, "r") as h5file:
+        assert np.flatnonzero(np.diff(_stimulus(h5file)[:10]))[0] == 0
+        epoch = find_baseline_epoch(_stimulus(h5file), rate)
+        baselines = read_vs_baselines_h5(h5file)
+        rms_list = calculate_std_vs_h5(h5file, [[0], [1], [2]])
+
+    # get_test_epoch skips the first change; get_stim_epoch doesn't, so the stim epoch starts after the test pulse
+    tp_start, tp_end = int(test_pulse[0] * rate), int(test_pulse[1] * rate)
+    assert epoch == (tp_end + tp_start - 1, tp_end)
+    assert all(baseline is not None for baseline in baselines)
+    # Same as calculate_std_vs on these epochs: no long baseline, a short one before the stim epoch
+    for long_rms, short_rms in rms_list:
+        assert np.isnan(long_rms)
+        assert not np.isnan(short_rms)
+    np.testing.assert_array_equal(np.ravel(rms_list), reference_noise_row("cell", nwb_path)[1:])
+
+
+def test_rms_of_the_calculate_std_vs_windows(tmp_path):
+    for seed in range(5):
+        nwb_path = str(tmp_path / f"cell_{seed}.nwb")
+        write_synthetic_nwb(nwb_path, sweep_count=3, rate=rate, test_pulse=test_pulse, stim_onset=stim_onset, seed=seed)
+        with h5py.File(nwb_path, "r") as h5file:
+            rms_list = calculate_std_vs_h5(h5file, [[0], [1], [2]])
+        # Exact after the 3 decimal rounding (a short window one sample off changes it)
+        assert [float(value) for value in np.ravel(rms_list)] == list(reference_noise_row("cell", nwb_path)[1:])
+
+
+def test_epoch_without_a_stimulus(tmp_path):
+    stimulus = np.zeros(int(rate), dtype=np.float32)
+    stimulus[250:750] = -5.0
+    assert find_baseline_epoch(stimulus, rate) is None
+
+
+def test_rms_matches_the_noise(tmp_path):
+    nwb_path = str(tmp_path / "cell.nwb")
+    write_synthetic_nwb(nwb_path, sweep_count=3, noise_pa=(2.0, 4.0, 8.0))
+    with h5py.File(nwb_path, "r") as h5file:
+        rms_list = calculate_std_vs_h5(h5file, [[0], [1], [2]])
+    for (long_rms, short_rms), noise in zip(rms_list, (2.0, 4.0, 8.0)):
+        assert abs(long_rms - noise) < 0.05 * noise
+        assert abs(short_rms - noise) < 0.25 * noise
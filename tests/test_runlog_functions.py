@@ -0,0 +1,50 @@
+"""
+-----------------------------------------------------------------------
+File name: test_runlog_functions.py
+Maintainer: Ramkumar Rajanbabu
+-----------------------------------------------------------------------
+Developer: Ramkumar Rajanbabu
+Date/time created: 10/17/2026
+Description: Run log names and past timings per job
+-----------------------------------------------------------------------
+"""
+
+
+#-----Imports-----#
+# General imports
+import os
+from datetime import datetime
+# File imports
+from functions import runlog_functions
+from functions.runlog_functions import log_event, past_stage_seconds, start_run_log, stop_run_log
+
+
+class FrozenClock(datetime):
+    @classmethod
+    def now(cls, tz=None):
+        return cls(2023, 3, 1, 6, 0, 0)
+
+
+def test_runs_started_together_get_their_own_log(tmp_path, monkeypatch):
+    monkeypatch.setattr(runlog_functions, "datetime", FrozenClock)
+    log_paths = []
+    try:
+        for pid in (101, 102):
+            monkeypatch.setattr(os, "getpid", lambda: pid)
+            log_paths.append(start_run_log(str(tmp_path), "rig_noise_2023"))
+    finally:
+        stop_run_log()
+    assert len(set(log_paths)) == 2
+
+
+def test_past_timings_of_the_job_only(tmp_path):
+    log_dir = str(tmp_path)
+    try:
+        for job, cell_name in (("rig_noise", "cell_a"), ("rig_noise_2023", "cell_b")):
+            start_run_log(log_dir, job)
+            log_event("stage", stage="cell", cell=cell_name, seconds=1.5)
+            stop_run_log()
+    finally:
+        stop_run_log()
+    assert past_stage_seconds(log_dir, "rig_noise") == {"cell_a": 1.5}
+    assert past_stage_seconds(log_dir, "rig_noise_2023") == {"cell_b": 1.5}
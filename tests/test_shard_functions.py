@@ -0,0 +1,112 @@
+"""
+-----------------------------------------------------------------------
+File name: test_shard_functions.py
+Maintainer: Ramkumar Rajanbabu
+-----------------------------------------------------------------------
+Developer: Ramkumar Rajanbabu
+Date/time created: 10/17/2026
+Description: Shards started together on a fresh machine share one JEM
+snapshot, one plan and one seeded store
+-----------------------------------------------------------------------
+"""
+
+
+#-----Imports-----#
+# General imports
+import multiprocessing
+import os
+import pandas as pd
+import pytest
+# File imports
+from functions.jem_functions import load_jem_metadata
+from functions.shard_functions import select_shard_cells
+from functions.store_functions import open_metrics_store, read_metrics
+
+
+# Settings
+num_shards = 6
+columns = ["cell_name", "long_rms"]
+cell_list = [f"cell_{i:03d}" for i in range(60)]
+
+
+def _start_step(barrier, results, step, args):
+    """
+    Runs step(*args) once every shard is ready, like --shard i/N processes started by
+    the same scheduled task.
+    """
+
+    barrier.wait()
+    try:
+        results.put((step(*args), None))
+    except Exception as e:
+        results.put((None, repr(e)))
+
+
+def _start_together(step, args_list):
+    """
+    Runs step in one new process per args, all at once.
+
+    Returns:
+        results (list): each process's return value, in the order they finished.
+    """
+
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(len(args_list))
+    results = context.Queue()
+    processes = [context.Process(target=_start_step, args=(barrier, results, step, args)) for args in args_list]
+    for process in processes:
+        process.start()
+    rows = [results.get(timeout=120) for _ in processes]
+    for process in processes:
+        process.join(timeout=120)
+    assert [error for _, error in rows if error] == []
+    return [result for result, _ in rows]
+
+
+def _load_cells(jem_path, snapshot_path):
+    return load_jem_metadata(jem_path, snapshot_path, year=2023)["jem-id_cell_specimen"].tolist()
+
+
+def _plan_and_open_store(shard, plan_path, store_path, seed_csv):
+    shard_cells, costs, plan = select_shard_cells(cell_list, shard, num_shards, plan_path=plan_path)
+    open_metrics_store(store_path, "noise_metrics", columns, seed_csv=seed_csv).close()
+    return shard_cells, plan
+
+
+@pytest.mark.parametrize("attempt", range(3))
+def test_jem_snapshot_loaded_together(tmp_path, attempt):
+    jem_path = str(tmp_path / "jem.csv")
+    pd.DataFrame({
+        "jem-date_patch": "03/01/2023 10:00:00 -0800",
+        "jem-date_patch_y": 2023,
+        "jem-date_patch_m": 3,
+        "jem-date_patch_d": 1,
+        "jem-id_cell_specimen": cell_list,
+        "jem-id_patched_cell_container": [f"PAS{i}" for i in range(len(cell_list))],
+        "jem-status_success_failure": "SUCCESS",
+    }).to_csv(jem_path, index=False)
+    snapshot_path = str(tmp_path / "local" / "jem_snapshot.sqlite")
+
+    # Every shard sees the whole csv, never a snapshot another one is still writing
+    for cells in _start_together(_load_cells, [(jem_path, snapshot_path)] * num_shards):
+        assert cells == cell_list
+
+
+@pytest.mark.parametrize("attempt", range(3))
+def test_shards_started_together(tmp_path, attempt):
+    plan_path = str(tmp_path / "plans" / "plan.csv")
+    store_path = str(tmp_path / "local" / "metrics_store.sqlite")
+    seed_csv = str(tmp_path / "noise.csv")
+    pd.DataFrame({"cell_name": cell_list[:5], "long_rms": [1.0, 2.0, 3.0, 4.0, 5.0]}).to_csv(seed_csv, index=False)
+
+    rows = _start_together(_plan_and_open_store, [(shard, plan_path, store_path, seed_csv) for shard in range(1, num_shards + 1)])
+    # One plan: every shard has the same id and together they cover each cell once
+    assert len({plan for _, plan in rows}) == 1
+    assert sorted(cell_name for shard_cells, _ in rows for cell_name in shard_cells) == cell_list
+    assert os.listdir(os.path.dirname(plan_path)) == ["plan.csv"]
+    # Seeded once
+    conn = open_metrics_store(store_path, "noise_metrics", columns)
+    try:
+        assert read_metrics(conn, "noise_metrics", columns)["cell_name"].tolist() == cell_list[:5]
+    finally:
+        conn.close()